@@ -0,0 +1,92 @@
+import os
+import json
+
+# 控制端（config / brain / intent）和机器人服务端（robot_server）共用同一份动作表
+DEFAULT_REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "actions.json")
+
+# 未声明 lanes 时按 group 占用的资源通道
+DEFAULT_LANES = {"arm": ["arm"], "loco": ["legs"]}
+
+
+class ActionRegistry:
+    """
+    声明式动作表（actions.json），加载一次后建好所有索引
+    每个动作字段：
+    - id / name: SDK 侧的组内编号与名称
+    - duration: 预计执行时长 (秒)
+    - release_after: 机械臂动作执行后隔多久自动 “release arm”
+    - lanes: 占用的资源通道（arm / legs），不同通道的动作可以并行
+    - steps: 运动动作的 LocoClient 调用序列，["sleep", 秒] 表示等待
+    - llm_id / synonyms: 暴露给大模型与本地意图识别的编号和同义词
+    """
+
+    def __init__(self, groups):
+        self.groups = {}     # group -> [entry, ...]（保持文件中的顺序）
+        self.by_id = {}      # (group, id) -> entry
+        self.by_name = {}    # (group, name) -> entry
+        self.name_groups = {}  # name -> [group, ...]，用于未指定 group 时自动判断
+        self.llm_actions = {}  # llm_id -> entry
+        self.synonyms = {}   # 同义词 -> llm_id
+
+        for group, entries in groups.items():
+            self.groups[group] = []
+            for raw in entries:
+                entry = dict(raw, group=group)
+                entry.setdefault("duration", 0.0)
+                entry.setdefault("release_after", None)
+                entry.setdefault("lanes", DEFAULT_LANES.get(group, [group]))
+                entry.setdefault("synonyms", [])
+                entry["lanes"] = sorted(entry["lanes"])
+
+                self.groups[group].append(entry)
+                self.by_id[(group, entry["id"])] = entry
+                self.by_name[(group, entry["name"])] = entry
+                self.name_groups.setdefault(entry["name"], []).append(group)
+                if entry.get("llm_id") is not None:
+                    if entry["llm_id"] in self.llm_actions:
+                        raise ValueError(f"Duplicate llm_id in action registry: {entry['llm_id']}")
+                    self.llm_actions[entry["llm_id"]] = entry
+                    for synonym in entry["synonyms"]:
+                        self.synonyms[synonym] = entry["llm_id"]
+
+        self.llm_actions = dict(sorted(self.llm_actions.items()))
+        self.prompt_text = self._build_prompt_text()
+
+    @classmethod
+    def load(cls, path=DEFAULT_REGISTRY_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def options(self, group):
+        """[{"name", "id"}, ...]，与 /cmd/action list 的返回格式一致"""
+        return [{"name": e["name"], "id": e["id"]} for e in self.groups.get(group, [])]
+
+    def action_map(self):
+        """暴露给大模型的动作：llm_id -> {"group", "name", "desc", "synonyms", "duration"}"""
+        return {
+            llm_id: {
+                "group": e["group"],
+                "name": e["name"],
+                "desc": "/".join(e["synonyms"]),
+                "synonyms": list(e["synonyms"]),
+                "duration": e["duration"],
+            }
+            for llm_id, e in self.llm_actions.items()
+        }
+
+    def _build_prompt_text(self):
+        prompt = "【可用动作列表】\n"
+        for llm_id, entry in self.llm_actions.items():
+            prompt += f"- ID {llm_id}: {'/'.join(entry['synonyms'])}\n"
+        return prompt
+
+
+_registry = None
+
+
+def get_registry():
+    """进程内只加载一次"""
+    global _registry
+    if _registry is None:
+        _registry = ActionRegistry.load()
+    return _registry
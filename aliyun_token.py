@@ -0,0 +1,186 @@
+import sys
+import json
+import time
+import uuid
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class AliyunTokenManager:
+    """
+    阿里云 NLS Token 生命周期管理
+    - 缓存 Token 及其过期时间
+    - 后台线程在过期前 refresh_margin 秒主动刷新
+    - 获取失败时指数退避重试
+    - get_token() 只读缓存，永不阻塞
+    """
+
+    def __init__(self, fetcher, refresh_margin=600, min_backoff=1.0, max_backoff=60.0, default_ttl=3600):
+        """
+        :param fetcher: 无参函数，返回 (token, expire_time_unix_seconds)，失败返回 (None, 0) 或抛异常
+                        expire_time 为 None 表示响应里没有过期时间，按 default_ttl 估算
+        """
+        self.fetcher = fetcher
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self._token = None
+        self._expire_time = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+        self._running = False
+        self.refresh_count = 0
+
+    def start(self, wait=10.0):
+        """
+        启动后台刷新线程
+        :param wait: 等待首次获取成功的最长时间 (秒)
+        :return: 是否已拿到可用 Token
+        """
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="aliyun-token", daemon=True)
+            self._thread.start()
+        return self._ready.wait(wait)
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    def get_token(self):
+        """返回当前缓存的 Token（可能为 None），不发起网络请求"""
+        with self._lock:
+            return self._token
+
+    def seconds_left(self):
+        with self._lock:
+            return self._expire_time - time.time()
+
+    def invalidate(self):
+        """识别接口报告 Token 失效时调用，立即触发刷新"""
+        self._wakeup.set()
+
+    def _refresh_once(self):
+        token, expire_time = self.fetcher()
+        if not token:
+            raise RuntimeError("empty token")
+        if expire_time is None:
+            # 响应缺少 ExpireTime：按保守的有效期刷新，而不是当成已过期每秒请求一次
+            print(f"⚠️ Token 响应缺少 ExpireTime，按 {self.default_ttl}s 有效期处理")
+            expire_time = time.time() + self.default_ttl
+        elif expire_time <= time.time():
+            # 已过期的 Token 不可用，走退避重试
+            raise RuntimeError(f"token already expired (ExpireTime={expire_time})")
+        with self._lock:
+            self._token = token
+            self._expire_time = expire_time
+        self.refresh_count += 1
+        self._ready.set()
+        print(f"🔑 Aliyun Token 已刷新，剩余有效期 {expire_time - time.time():.0f}s")
+
+    def _run(self):
+        backoff = self.min_backoff
+        while self._running:
+            try:
+                self._refresh_once()
+                backoff = self.min_backoff
+                # 睡到过期前 refresh_margin 秒（过期时间很短时至少留一半）
+                ttl = self.seconds_left()
+                delay = max(1.0, min(ttl - self.refresh_margin, ttl / 2))
+            except Exception as e:
+                print(f"❌ Token 获取异常: {e}，{backoff:.0f}s 后重试")
+                delay = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+
+def fetch_token_via_sdk(access_key_id, access_key_secret, region="cn-shanghai"):
+    """通过阿里云 SDK 的 CreateToken 获取 Token，返回 (token, expire_time)"""
+    from aliyunsdkcore.client import AcsClient
+    from aliyunsdkcore.request import CommonRequest
+
+    client = AcsClient(access_key_id, access_key_secret, region)
+    request = CommonRequest()
+    request.set_method('POST')
+    request.set_domain('nls-meta.cn-shanghai.aliyuncs.com')
+    request.set_version('2019-02-28')
+    request.set_action_name('CreateToken')
+
+    response = client.do_action_with_exception(request)
+    return _parse_create_token(json.loads(response))
+
+
+def fetch_token_via_http(url, timeout=5):
+    """从返回 CreateToken 格式 JSON 的 HTTP 地址获取 Token（用于本地桩服务）"""
+    resp = requests.get(url, timeout=timeout)
+    resp.raise_for_status()
+    return _parse_create_token(resp.json())
+
+
+def _parse_create_token(jss):
+    token = jss.get('Token') or {}
+    return token.get('Id'), token.get('ExpireTime')
+
+
+# ================= 本地桩服务 (测试用) =================
+
+def make_stub_server(port=0, ttl=30, fail_first=0):
+    """
+    模拟 CreateToken 的本地服务
+    :param ttl: 每个 Token 的有效期 (秒)，设置得很短可以快速验证刷新逻辑
+    :param fail_first: 前 N 次请求返回 500，用于验证退避重试
+    """
+    state = {"count": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["count"] += 1
+            if state["count"] <= fail_first:
+                self.send_response(500)
+                self.end_headers()
+                return
+            body = json.dumps({"Token": {"Id": uuid.uuid4().hex, "ExpireTime": int(time.time() + ttl)}})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+
+if __name__ == "__main__":
+    # python aliyun_token.py --serve 8765   只启动桩服务
+    # python aliyun_token.py               桩服务 + 管理器演示（短 TTL、前两次失败）
+    if "--serve" in sys.argv:
+        idx = sys.argv.index("--serve") + 1
+        port = int(sys.argv[idx]) if idx < len(sys.argv) else 8765
+        server = make_stub_server(port, ttl=60)
+        print(f"Stub token server on http://127.0.0.1:{port}/")
+        server.serve_forever()
+
+    server = make_stub_server(ttl=6, fail_first=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    manager = AliyunTokenManager(lambda: fetch_token_via_http(stub_url), refresh_margin=2, max_backoff=2)
+    ok = manager.start(wait=10)
+    print(f"首次获取: {'成功' if ok else '失败'}")
+
+    try:
+        for _ in range(15):
+            print(f"token={manager.get_token()} ttl={manager.seconds_left():.1f}s refresh_count={manager.refresh_count}")
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    manager.stop()
+    server.shutdown()
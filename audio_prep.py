@@ -0,0 +1,152 @@
+import os
+import math
+import wave
+import audioop
+import hashlib
+import threading
+
+# 处理对象：16kHz、单声道、16bit PCM
+SAMPLE_RATE = 16000
+FRAME_BYTES = 320              # 10ms 一帧，用于静音判断和响度统计
+
+SILENCE_DB = -45.0             # 帧 RMS 低于该值 (dBFS) 视为静音
+TRIM_PAD_MS = 50               # 裁剪后在有声部分前后保留的静音，避免切掉起音/尾音
+TARGET_DB = -20.0              # 目标响度：有声帧的平均 RMS (dBFS)
+MAX_GAIN_DB = 20.0             # 最大提升，避免把底噪放大成噪音
+PEAK_DB = -1.0                 # 增益后峰值不超过该值 (dBFS)
+
+CACHE_DIR = "audio_cache"
+CACHE_MAX_FILES = 200
+
+# 处理参数参与缓存键：参数调整后旧的缓存自动失效
+PARAMS_SIGNATURE = f"{SILENCE_DB}/{TRIM_PAD_MS}/{TARGET_DB}/{MAX_GAIN_DB}/{PEAK_DB}".encode()
+
+
+def _db(rms):
+    return 20 * math.log10(rms / 32768.0) if rms > 0 else -120.0
+
+
+_SILENCE_RMS = 32768.0 * 10 ** (SILENCE_DB / 20)
+
+
+def _frames(pcm):
+    for offset in range(0, len(pcm) - FRAME_BYTES + 1, FRAME_BYTES):
+        yield offset, pcm[offset:offset + FRAME_BYTES]
+
+
+def trim_silence(pcm):
+    """裁掉开头和结尾的静音（保留 TRIM_PAD_MS），全部是静音时返回 b\"\""""
+    voiced = [offset for offset, frame in _frames(pcm) if audioop.rms(frame, 2) >= _SILENCE_RMS]
+    if not voiced:
+        return b""
+    pad = TRIM_PAD_MS * SAMPLE_RATE // 1000 * 2
+    start = max(0, voiced[0] - pad)
+    end = min(len(pcm), voiced[-1] + FRAME_BYTES + pad)
+    return pcm[start:end]
+
+
+def normalize_loudness(pcm):
+    """
+    把有声帧的平均 RMS 调整到 TARGET_DB
+    只统计高于静音阈值的帧（停顿不拉低响度估计），增益受 MAX_GAIN_DB 和峰值余量限制
+    """
+    energies = [rms * rms for rms in (audioop.rms(frame, 2) for _, frame in _frames(pcm)) if rms >= _SILENCE_RMS]
+    if not energies:
+        return pcm
+    level_db = _db(math.sqrt(sum(energies) / len(energies)))
+    gain_db = min(TARGET_DB - level_db, MAX_GAIN_DB, PEAK_DB - _db(audioop.max(pcm, 2)))
+    if abs(gain_db) < 0.5:
+        return pcm
+    return audioop.mul(pcm, 2, 10 ** (gain_db / 20))
+
+
+def preprocess_pcm(pcm):
+    """入库预处理：裁剪首尾静音 + 响度归一化"""
+    return normalize_loudness(trim_silence(pcm))
+
+
+def iter_trim_leading(chunks):
+    """
+    流式版本：只裁掉开头的静音（结尾和响度需要完整数据，流式播放时不处理）
+    :param chunks: 16k 单声道 16bit PCM 块迭代器
+    """
+    chunks = iter(chunks)
+    pad = TRIM_PAD_MS * SAMPLE_RATE // 1000 * 2
+    head = b""
+    scanned = 0
+    for chunk in chunks:
+        head += chunk
+        for offset, frame in _frames(head[scanned:]):
+            if audioop.rms(frame, 2) >= _SILENCE_RMS:
+                yield head[max(0, scanned + offset - pad):]
+                yield from chunks
+                return
+        scanned = len(head) - len(head) % FRAME_BYTES
+        # 只保留最后 pad 长度的静音，内存不随静音时长增长
+        drop = max(0, scanned - pad)
+        head, scanned = head[drop:], scanned - drop
+
+
+class PrepCache:
+    """
+    预处理结果缓存：键为原文件内容的哈希，值为处理后的 16k 单声道 WAV 文件
+    同一文件重复上传 / 播放时直接返回缓存；文件数超过 max_files 时删除最久未使用的
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_files=CACHE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def process(self, src_path, decode):
+        """
+        :param decode: fn(src_path) -> 16k 单声道 16bit PCM bytes，无法解码时返回 None
+        :return: 处理后的 WAV 路径；无法解码或全是静音时返回 None
+        """
+        digest = hashlib.sha1(PARAMS_SIGNATURE)
+        with open(src_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        cached = os.path.join(self.directory, digest.hexdigest() + ".wav")
+
+        if os.path.exists(cached):
+            os.utime(cached)  # 更新使用时间，供淘汰时参考
+            self.hits += 1
+            return cached
+
+        pcm = decode(src_path)
+        if pcm is None:
+            return None
+        processed = preprocess_pcm(pcm)
+        if not processed:
+            return None
+        self.misses += 1
+        print(f"[Prep] {os.path.basename(src_path)}: {len(pcm) / 32000:.2f}s -> {len(processed) / 32000:.2f}s")
+
+        tmp = f"{cached}.{threading.get_ident()}.tmp"
+        with wave.open(tmp, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes(processed)
+        os.replace(tmp, cached)
+        self._evict()
+        return cached
+
+    def _evict(self):
+        with self._lock:
+            files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".wav")]
+            if len(files) <= self.max_files:
+                return
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.max_files]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
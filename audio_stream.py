@@ -0,0 +1,211 @@
+import shutil
+import struct
+import audioop
+import threading
+import subprocess
+
+# 输出格式：16kHz、单声道、16bit PCM（机器人 VoicePlayer 的输入格式）
+TARGET_RATE = 16000
+READ_CHUNK = 32 * 1024        # 每次从上传流读取的字节数
+MAX_WAV_HEADER = 1024 * 1024  # WAV 头（含 LIST 等附加块）最大缓冲，超过视为无效文件
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class UnsupportedAudio(Exception):
+    """无法识别或无法转换的音频格式"""
+
+
+def detect_format(head):
+    """根据文件头的魔数判断格式，返回 "wav" / "mp3" / "ogg" / "flac" / "m4a" / "aac" / "webm" 或 None"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE6 == 0xE2):
+        return "mp3"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xF6 == 0xF0:
+        return "aac"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    return None
+
+
+def parse_wav_header(head):
+    """
+    解析 RIFF/WAVE 头
+    :return: (fmt, data_offset, data_size)，头还没收全时返回 None
+    :raises UnsupportedAudio: 文件结构无效
+    """
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(head):
+        chunk_id = head[offset:offset + 4]
+        (size,) = struct.unpack("<I", head[offset + 4:offset + 8])
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            if body + 16 > len(head):
+                return None
+            audio_format, channels, rate, _, block_align, bits = struct.unpack("<HHIIHH", head[body:body + 16])
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and size >= 40 and body + 26 <= len(head):
+                # 子格式 GUID 的前两个字节就是实际的格式编号
+                (audio_format,) = struct.unpack("<H", head[body + 24:body + 26])
+            fmt = {"format": audio_format, "channels": channels, "rate": rate,
+                   "block_align": block_align, "sampwidth": bits // 8}
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise UnsupportedAudio("WAV data chunk before fmt chunk")
+            # 流式写出的 WAV 可能把长度写成 0 或 0xFFFFFFFF，此时读到结尾为止
+            data_size = size if 0 < size < 0xFFFFFFFF else None
+            return fmt, body, data_size
+        offset = body + size + (size & 1)
+    return None
+
+
+class WavToPcm:
+    """PCM WAV -> 16k 单声道 16bit，逐块转换（重采样状态跨块保留）"""
+
+    def __init__(self, fmt, data_size=None):
+        self.channels = fmt["channels"]
+        self.rate = fmt["rate"]
+        self.sampwidth = fmt["sampwidth"]
+        self.block_align = fmt["block_align"] or self.channels * self.sampwidth
+        self.remaining = data_size
+        self._tail = b""
+        self._ratecv_state = None
+
+    @staticmethod
+    def supports(fmt):
+        return (fmt["format"] == WAVE_FORMAT_PCM and fmt["channels"] in (1, 2)
+                and fmt["sampwidth"] in (1, 2, 3, 4) and fmt["rate"] > 0)
+
+    def feed(self, data):
+        if self.remaining is not None:
+            data = data[:self.remaining]
+            self.remaining -= len(data)
+        data = self._tail + data
+        usable = len(data) - len(data) % self.block_align
+        data, self._tail = data[:usable], data[usable:]
+        if not data:
+            return b""
+
+        width = self.sampwidth
+        if width == 1:
+            # 8bit WAV 是无符号的
+            data = audioop.bias(data, 1, -128)
+        if self.channels == 2:
+            data = audioop.tomono(data, width, 0.5, 0.5)
+        if width != 2:
+            data = audioop.lin2lin(data, width, 2)
+        if self.rate != TARGET_RATE:
+            data, self._ratecv_state = audioop.ratecv(data, 2, 1, self.rate, TARGET_RATE, self._ratecv_state)
+        return data
+
+    @property
+    def finished(self):
+        return self.remaining is not None and self.remaining <= 0
+
+
+def _iter_ffmpeg(chunks):
+    """压缩格式交给 ffmpeg 解码（管道进、管道出，不写文件）"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise UnsupportedAudio("ffmpeg not found; only PCM WAV can be converted")
+
+    proc = subprocess.Popen(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(TARGET_RATE), "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+
+    def _feed():
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=_feed, daemon=True)
+    feeder.start()
+    produced = False
+    try:
+        while True:
+            data = proc.stdout.read(READ_CHUNK)
+            if not data:
+                break
+            produced = True
+            yield data
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        feeder.join(timeout=1)
+    if not produced:
+        raise UnsupportedAudio("ffmpeg could not decode the upload")
+
+
+def iter_pcm_16k_mono(chunks):
+    """
+    把任意格式的音频字节流转换成 16k 单声道 16bit PCM 块
+    - PCM WAV 直接用 audioop 逐块转换
+    - 其他格式（mp3 / ogg / flac / m4a / aac / webm，以及浮点 WAV）走 ffmpeg 管道
+    内存占用只与块大小有关，与文件大小无关
+    :param chunks: bytes 迭代器（例如上传请求的读取流）
+    :raises UnsupportedAudio: 格式无法识别 / 无法转换
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 12:
+            break
+
+    kind = detect_format(head)
+    if kind is None:
+        raise UnsupportedAudio("Unrecognized audio format")
+
+    if kind == "wav":
+        parsed = parse_wav_header(head)
+        while parsed is None:
+            chunk = next(chunks, None)
+            if chunk is None or len(head) > MAX_WAV_HEADER:
+                raise UnsupportedAudio("Incomplete WAV header")
+            head += chunk
+            parsed = parse_wav_header(head)
+
+        fmt, data_offset, data_size = parsed
+        if WavToPcm.supports(fmt):
+            converter = WavToPcm(fmt, data_size)
+            data = converter.feed(head[data_offset:])
+            if data:
+                yield data
+            for chunk in chunks:
+                if converter.finished:
+                    break
+                data = converter.feed(chunk)
+                if data:
+                    yield data
+            return
+
+    # 已读取的文件头需要一并交给 ffmpeg
+    def _replay():
+        yield head
+        yield from chunks
+
+    yield from _iter_ffmpeg(_replay())
+
+
+def iter_file(f, size=READ_CHUNK):
+    """文件对象 -> bytes 块迭代器"""
+    return iter(lambda: f.read(size), b"")
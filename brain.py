@@ -1,24 +1,225 @@
-from openai import OpenAI
 import json
 import requests
 import re
+import time
+import socket
+import threading
+import weakref
 from config import LLM_API_KEY, LLM_BASE_URL, LLM_MODEL, url, sessionId
+from config import MEMORY_MAX_TOKENS, MEMORY_MAX_TURNS, MEMORY_SUMMARIZE
+from config import REPLY_BACKEND, ACTION_MAP, get_action_prompt_text
+from config import RESPONSE_CACHE, RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MIN_ASKS, WAKE_WORDS
+from config import REPLY_CONNECT_TIMEOUT, REPLY_READ_TIMEOUT
+from memory import MemoryStore
+from response_cache import ResponseCache
+from recorder import recorder
+
+# 切分规则：句号、问号、感叹号、换行符
+SENTENCE_SPLIT_PATTERN = re.compile(r'([。！？.!?\n]+)')
+
+# 大模型回复中内嵌的动作标签，例如 “[ACTION:4]你好呀！”
+ACTION_TAG_PATTERN = re.compile(r'\[ACTION:(\d+)\]')
+ACTION_TAG_MAX_LEN = 16
+
+CHAT_SYSTEM_PROMPT = (
+    "你是展厅里的人形机器人“桂小志”，回答要口语化、简短（不超过3句话）。\n"
+    "如果回复适合配合一个肢体动作，在对应句子的最前面插入动作标签 [ACTION:ID]，"
+    "每次回复最多一个动作，不需要动作时不要输出标签。\n"
+)
+
+
+class CancelToken:
+    """
+    回复请求的取消令牌
+    cancel() 会立即执行注册的中止回调（关闭 HTTP 流、释放 socket），
+    而不是等生成器下一次被迭代时才发现。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.cancelled_at = None
+        self.session_id = None  # 所属会话，按会话打断时使用
+        self.completed = False  # 回复流正常结束（收到完整回复）时由流式请求置为 True
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.cancelled_at = time.time()
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception:
+                pass
+
+    def on_cancel(self, cb):
+        """注册中止回调；已取消时立即执行。返回注销函数"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(cb)
+                return lambda: self._discard(cb)
+        cb()
+        return lambda: None
+
+    def _discard(self, cb):
+        with self._lock:
+            if cb in self._callbacks:
+                self._callbacks.remove(cb)
+
+
+def _abort_response(response):
+    """
+    立即中止一个流式 HTTP 响应：
+    先 shutdown 底层 socket 让阻塞中的读取马上返回，再 close 释放连接
+    """
+    try:
+        sock = response.raw._fp.fp.raw._sock
+        sock.shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+    try:
+        response.close()
+    except Exception:
+        pass
+
+
+class SentenceSplitter:
+    """把流式文本按标点切分成句子"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        sentences = []
+        while True:
+            match = SENTENCE_SPLIT_PATTERN.search(self.buffer)
+            if not match:
+                break
+            end_pos = match.end()
+            sentence = self.buffer[:end_pos]
+            self.buffer = self.buffer[end_pos:]
+            if sentence.strip():
+                sentences.append(sentence)
+        return sentences
+
+    def flush(self):
+        rest, self.buffer = self.buffer, ""
+        return [rest] if rest.strip() else []
+
+
+class ActionTagParser:
+    """
+    从 token 流中实时剥离动作标签
+    标签可能被拆在多个 chunk 中，遇到 '[' 时先暂存，确认不是标签再当作普通文本放出
+    """
+
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, chunk):
+        """:return: [("text", str) | ("action", int), ...]"""
+        self.pending += chunk
+        events = []
+        while self.pending:
+            start = self.pending.find("[")
+            if start < 0:
+                events.append(("text", self.pending))
+                self.pending = ""
+                break
+            if start > 0:
+                events.append(("text", self.pending[:start]))
+                self.pending = self.pending[start:]
+
+            match = ACTION_TAG_PATTERN.match(self.pending)
+            if match:
+                events.append(("action", int(match.group(1))))
+                self.pending = self.pending[match.end():]
+                continue
+
+            if "]" in self.pending or len(self.pending) > ACTION_TAG_MAX_LEN:
+                # 不是动作标签，'[' 作为普通文本输出
+                events.append(("text", self.pending[0]))
+                self.pending = self.pending[1:]
+                continue
+
+            # 标签可能还没收完整，等下一个 chunk
+            break
+        return events
+
+    def flush(self):
+        rest, self.pending = self.pending, ""
+        return [("text", rest)] if rest else []
 
 
 class RobotBrain:
     def __init__(self):
-        self.client = OpenAI(api_key=LLM_API_KEY, base_url=LLM_BASE_URL)
+        self._client = None
+        self._client_lock = threading.Lock()
         self.model = LLM_MODEL
 
         # === 记忆模块配置 ===
-        self.history = []
-        self.max_history_items = 0
+        # 按会话隔离；每个会话受消息条数与 token 预算双重约束
+        self.memory = MemoryStore(
+            max_tokens=MEMORY_MAX_TOKENS,
+            max_turns=MEMORY_MAX_TURNS,
+            summarizer=self._summarize_history if MEMORY_SUMMARIZE else None,
+        )
+
+        # === 进行中的回复请求（用于打断时统一取消）===
+        self._active_tokens = weakref.WeakSet()
+        self._tokens_lock = threading.Lock()
+        self._cancel_stats = {"cancels": 0, "total_ms": 0.0, "max_ms": 0.0}
+        self._open_streams = 0
+
+        # === 高频问题回复缓存 ===
+        self.response_cache = None
+        if RESPONSE_CACHE:
+            self.response_cache = ResponseCache(RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, strip_words=WAKE_WORDS,
+                                                min_asks=RESPONSE_CACHE_MIN_ASKS)
+
+    @property
+    def client(self):
+        """OpenAI 客户端：第一次使用时才导入 openai 并创建（导入较慢，不拖慢启动）"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI(api_key=LLM_API_KEY, base_url=LLM_BASE_URL)
+        return self._client
 
-    def update_history(self, role, content):
-        """更新对话历史，并保持在限制长度内"""
-        self.history.append({"role": role, "content": content})
-        while len(self.history) > self.max_history_items:
-            self.history.pop(0)
+    @property
+    def history(self):
+        """默认会话的对话历史"""
+        return self.memory.get(sessionId).messages()
+
+    def update_history(self, role, content, session_id=sessionId):
+        """更新对话历史，超出预算的旧消息自动淘汰"""
+        self.memory.get(session_id).add(role, content)
+
+    def build_messages(self, user_text, system_prompt=None, session_id=sessionId, budget=None):
+        """组装发送给大模型的消息：system + 预算内的历史上下文 + 本轮用户输入"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend(self.memory.get(session_id).context(budget))
+        messages.append({"role": "user", "content": user_text})
+        return messages
+
+    def _summarize_history(self, previous_summary, evicted_messages):
+        """把被淘汰的旧对话压缩成摘要（在记忆模块的后台线程中调用）"""
+        dialog = "\n".join(f"{m['role']}: {m['content']}" for m in evicted_messages)
+        return self._call_llm([
+            {"role": "system", "content": "请把下面的对话要点压缩成一段不超过100字的摘要，保留用户的关键信息和诉求："},
+            {"role": "user", "content": f"已有摘要：{previous_summary or '无'}\n新对话：\n{dialog}"},
+        ], temperature=0.3)
 
     def _call_llm(self, messages, temperature=0.7):
         try:
@@ -32,14 +233,15 @@ class RobotBrain:
             print(f"❌ LLM API Error: {str(e)}")
             return None
 
-    def _call_external_api_stream(self, text):
+    def _call_external_api_stream(self, text, cancel_token=None, session_id=sessionId):
         """
         请求外部API，过滤 eventName='text-data'，
         并将接收到的文本按标点切分为句子，实时 yield 返回。
+        cancel_token 被取消时立即关闭连接（服务端随之停止生成）。
         """
         params = {
             "voiceText": text,
-            "sessionId": sessionId
+            "sessionId": session_id
         }
 
         headers = {
@@ -55,15 +257,21 @@ class RobotBrain:
 
         print(f"📡 Calling External API (Streaming) for: {text}")
 
-        buffer = ""
-        # 切分规则：句号、问号、感叹号、换行符
-        split_pattern = r'([。！？.!?\n]+)'
+        splitter = SentenceSplitter()
+        cancel_token = cancel_token or CancelToken()
+        response = None
+        unregister = None
 
         try:
-            response = requests.get(url, params=params, headers=headers, stream=True)
+            response = requests.get(url, params=params, headers=headers, stream=True,
+                                    timeout=(REPLY_CONNECT_TIMEOUT, REPLY_READ_TIMEOUT))
+            self._stream_opened()
+            unregister = cancel_token.on_cancel(lambda: _abort_response(response))
 
             if response.status_code == 200:
                 for line in response.iter_lines():
+                    if cancel_token.is_cancelled():
+                        break
                     if line:
                         decoded_line = line.decode('utf-8')
                         if decoded_line.startswith("data:"):
@@ -74,48 +282,203 @@ class RobotBrain:
                                 # 只关注 text-data 事件
                                 if data.get("eventName") == "text-data":
                                     chunk = data.get("data", "")
-                                    buffer += chunk
-
-                                    # 缓冲区切分逻辑
-                                    while True:
-                                        match = re.search(split_pattern, buffer)
-                                        if match:
-                                            end_pos = match.end()
-                                            sentence = buffer[:end_pos]
-                                            buffer = buffer[end_pos:]
-
-                                            if sentence.strip():
-                                                yield sentence
-                                        else:
-                                            break
+                                    recorder.record("chunk", request=text, data=chunk)
+                                    yield from splitter.feed(chunk)
                             except json.JSONDecodeError:
                                 pass
 
                 # 收尾
-                if buffer.strip():
-                    yield buffer
+                if not cancel_token.is_cancelled():
+                    yield from splitter.flush()
+                    cancel_token.completed = True
             else:
                 print(f"❌ API Status Code: {response.status_code}")
         except Exception as e:
-            print(f"❌ API Error: {str(e)}")
+            if not cancel_token.is_cancelled():
+                print(f"❌ API Error: {str(e)}")
+        finally:
+            if response is not None:
+                if unregister:
+                    unregister()
+                response.close()
+                self._stream_closed(cancel_token)
 
-    def get_chat_reply(self, user_text):
+    def _call_llm_stream(self, user_text, session_id=sessionId, on_action=None, cancel_token=None):
+        """
+        流式请求 OpenAI 兼容接口（带历史上下文与动作列表），
+        token 流中的 [ACTION:ID] 标签一出现就回调 on_action，剩余文本按句子 yield。
+        """
+        system_prompt = CHAT_SYSTEM_PROMPT + get_action_prompt_text()
+        messages = self.build_messages(user_text, system_prompt, session_id)
+
+        print(f"📡 Calling LLM (Streaming) for: {user_text}")
+
+        splitter = SentenceSplitter()
+        parser = ActionTagParser()
+
+        def _handle(events):
+            for kind, value in events:
+                if kind == "action":
+                    if value in ACTION_MAP and on_action:
+                        print(f"🦾 [LLM] Inline action: {value}")
+                        on_action(value)
+                else:
+                    yield from splitter.feed(value)
+
+        cancel_token = cancel_token or CancelToken()
+        stream = None
+        unregister = None
+
+        try:
+            stream = self.client.with_options(
+                timeout=REPLY_READ_TIMEOUT
+            ).chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                stream=True,
+            )
+            self._stream_opened()
+            unregister = cancel_token.on_cancel(stream.close)
+
+            for chunk in stream:
+                if cancel_token.is_cancelled():
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    recorder.record("chunk", request=user_text, data=delta)
+                    yield from _handle(parser.feed(delta))
+
+            if not cancel_token.is_cancelled():
+                yield from _handle(parser.flush())
+                yield from splitter.flush()
+                cancel_token.completed = True
+        except Exception as e:
+            if not cancel_token.is_cancelled():
+                print(f"❌ LLM API Error: {str(e)}")
+        finally:
+            if stream is not None:
+                if unregister:
+                    unregister()
+                stream.close()
+                self._stream_closed(cancel_token)
+
+    # ================= 取消 / 打断 =================
+
+    def cancel_all(self, session_id=None):
+        """打断：取消进行中的回复请求（session_id 为 None 时取消全部），立即关闭对应的 HTTP 连接"""
+        with self._tokens_lock:
+            tokens = [t for t in self._active_tokens if session_id is None or t.session_id == session_id]
+        for token in tokens:
+            token.cancel()
+        return len(tokens)
+
+    def _stream_opened(self):
+        with self._tokens_lock:
+            self._open_streams += 1
+
+    def _stream_closed(self, cancel_token):
+        """连接已释放；若是被取消的，记录从 cancel() 到连接释放的耗时"""
+        with self._tokens_lock:
+            self._open_streams -= 1
+            if cancel_token.cancelled_at is not None:
+                elapsed = (time.time() - cancel_token.cancelled_at) * 1000
+                self._cancel_stats["cancels"] += 1
+                self._cancel_stats["total_ms"] += elapsed
+                self._cancel_stats["max_ms"] = max(self._cancel_stats["max_ms"], elapsed)
+
+    def drop_session(self, session_id):
+        """会话淘汰：取消该会话进行中的回复并释放它的对话记忆"""
+        self.cancel_all(session_id)
+        self.memory.drop(session_id)
+
+    def stream_stats(self):
+        with self._tokens_lock:
+            cancels = self._cancel_stats["cancels"]
+            return {
+                "open_streams": self._open_streams,
+                "cancels": cancels,
+                "avg_cancel_ms": round(self._cancel_stats["total_ms"] / cancels, 1) if cancels else 0.0,
+                "max_cancel_ms": round(self._cancel_stats["max_ms"], 1),
+            }
+
+    def get_chat_reply(self, user_text, session_id=sessionId, on_action=None, record_history=True,
+                       cancel_token=None):
         """
         获取回复 (Generator)
-        只负责流式获取语音文本，不处理动作上下文。
+        - REPLY_BACKEND = "external": 只负责流式获取语音文本，不处理动作上下文。
+        - REPLY_BACKEND = "llm": 流式大模型回复，内嵌动作通过 on_action(action_id) 与语音并行触发。
+        - 命中回复缓存时直接回放缓存的句子，不发起网络请求。
+        - record_history=False 时不写入对话历史（推测式请求由调用方在采纳后再写入）。
+        - cancel_token 或 cancel_all() 取消时，底层连接立即关闭；调用方中途停止迭代也会关闭连接。
         """
         full_reply_accumulator = ""
 
+        cached = self.response_cache.lookup(user_text, session_id) if self.response_cache else None
+        if cached:
+            entry, kind = cached
+            # 缓存命中没有回复流，记录句子本身以便回放
+            recorder.record("reply_start", text=user_text, cached=True,
+                            sentences=entry["sentences"], actions=entry["actions"])
+            print(f"💾 [Cache] Hit ({kind}): {entry['question']}")
+            if on_action:
+                for action_id in entry["actions"]:
+                    on_action(action_id)
+            for sentence in entry["sentences"]:
+                full_reply_accumulator += sentence
+                yield sentence
+            if record_history:
+                self.update_history("user", user_text, session_id)
+                self.update_history("assistant", full_reply_accumulator, session_id)
+            return
+
+        sentences = []
+        actions = []
+
+        def _on_action(action_id):
+            actions.append(action_id)
+            if on_action:
+                on_action(action_id)
+
+        cancel_token = cancel_token or CancelToken()
+        cancel_token.session_id = session_id
+        with self._tokens_lock:
+            self._active_tokens.add(cancel_token)
+
+        recorder.record("reply_start", text=user_text, cached=False)
         # 调用流式处理
-        stream_generator = self._call_external_api_stream(user_text)
-        print(stream_generator)
-        for sentence in stream_generator:
-            print(sentence)
-            full_reply_accumulator += sentence
+        start_time = time.time()
+        if REPLY_BACKEND == "llm":
+            stream_generator = self._call_llm_stream(user_text, session_id, _on_action, cancel_token)
+        else:
+            stream_generator = self._call_external_api_stream(user_text, cancel_token, session_id)
+        try:
+            for sentence in stream_generator:
+                print(sentence)
+                if not sentences and self.response_cache:
+                    self.response_cache.record_miss_latency((time.time() - start_time) * 1000)
+                sentences.append(sentence)
+                full_reply_accumulator += sentence
+
+                yield sentence
+        finally:
+            # 调用方 break / close() 时也要立刻释放连接，而不是等垃圾回收
+            stream_generator.close()
+            with self._tokens_lock:
+                self._active_tokens.discard(cancel_token)
+
+        recorder.record("reply_end", text=user_text, sentences=len(sentences), cancelled=cancel_token.is_cancelled())
+        if cancel_token.is_cancelled():
+            return
 
-            yield sentence
+        # 完整收到的回复才写入缓存（被打断、中途断开的回复不缓存）
+        if self.response_cache and sentences and cancel_token.completed:
+            self.response_cache.store(user_text, sentences, actions, session_id)
 
         # 更新历史
-        self.update_history("user", user_text)
-        if full_reply_accumulator:
-            self.update_history("assistant", full_reply_accumulator)
+        if record_history:
+            self.update_history("user", user_text, session_id)
+            if full_reply_accumulator:
+                self.update_history("assistant", full_reply_accumulator, session_id)
@@ -0,0 +1,124 @@
+import time
+import threading
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    熔断器（机器人不可达时快速失败）
+    - closed：正常放行，记录最近 window 次调用的成败；失败率达到 failure_rate（且至少 min_calls 次）时熔断
+    - open：allow() 直接返回 False，调用方立即失败，不再等网络超时
+    - half_open：冷却时间到后由后台线程调用 probe() 探测（例如 GET /status），成功则恢复，失败则冷却时间加倍
+    """
+
+    def __init__(self, probe, window=10, failure_rate=0.5, min_calls=3, cooldown=2.0, max_cooldown=30.0,
+                 on_change=None):
+        """
+        :param probe: fn() -> bool，探测服务是否恢复
+        :param on_change: fn(state)，状态变化时回调
+        """
+        self.probe = probe
+        self.window = window
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.on_change = on_change
+
+        self.state = CLOSED
+        self._results = deque(maxlen=window)
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._closed.set()
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """是否放行本次调用（熔断期间计数后直接拒绝）"""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            self.rejected += 1
+        return False
+
+    def wait_closed(self, timeout=None):
+        """等待恢复，返回是否已恢复"""
+        return self._closed.wait(timeout)
+
+    def record_success(self):
+        with self._lock:
+            self._results.append(True)
+            if self.state == CLOSED:
+                return
+        # 其他途径（例如长连接）已经证明服务可达
+        self._set_closed()
+
+    def record_failure(self):
+        with self._lock:
+            if self.state != CLOSED:
+                return
+            self._results.append(False)
+            failures = self._results.count(False)
+            if failures < self.min_calls or failures / len(self._results) < self.failure_rate:
+                return
+            self.state = OPEN
+            self.opened_at = time.time()
+            self.trips += 1
+            self._cooldown = self.base_cooldown
+            self._closed.clear()
+        self._notify(OPEN)
+        threading.Thread(target=self._probe_loop, name="breaker-probe", daemon=True).start()
+
+    def _set_closed(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            self.state = CLOSED
+            self.opened_at = None
+            self._results.clear()
+            self._closed.set()
+        self._notify(CLOSED)
+
+    def _probe_loop(self):
+        while self.state != CLOSED:
+            time.sleep(self._cooldown)
+            with self._lock:
+                if self.state == CLOSED:
+                    return
+                self.state = HALF_OPEN
+            try:
+                ok = self.probe()
+            except Exception:
+                ok = False
+            if ok:
+                self._set_closed()
+                return
+            with self._lock:
+                if self.state == CLOSED:
+                    return
+                self.state = OPEN
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+
+    def _notify(self, state):
+        if self.on_change is not None:
+            try:
+                self.on_change(state)
+            except Exception:
+                pass
+
+    def status(self):
+        with self._lock:
+            calls = len(self._results)
+            return {
+                "state": self.state,
+                "failure_rate": round(self._results.count(False) / calls, 2) if calls else 0.0,
+                "open_for_s": round(time.time() - self.opened_at, 1) if self.opened_at else None,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
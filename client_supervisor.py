@@ -0,0 +1,140 @@
+import time
+import threading
+
+
+def probe_call(client, method):
+    """
+    调用 SDK 客户端的一个只读接口作为健康检查
+    SDK 接口返回错误码（或 (code, data)），0 表示正常；客户端没有该方法时视为正常
+    """
+    fn = getattr(client, method, None)
+    if not callable(fn):
+        return True
+    ret = fn()
+    code = ret[0] if isinstance(ret, tuple) else ret
+    return code in (0, None)
+
+
+class ClientSupervisor:
+    """
+    SDK 客户端守护
+    - 所有客户端并行初始化，初始化失败按指数退避重试
+    - 后台定期健康检查；连续失败 failure_threshold 次（含指令执行失败的上报）后重新创建客户端
+    - 重建期间通过 on_change(name, None) 置空，调用方可以立即失败，或用 wait_ready 短暂等待
+    """
+
+    def __init__(self, specs, on_change, probe_interval=5.0, failure_threshold=2, max_backoff=10.0):
+        """
+        :param specs: {name: {"factory": fn() -> client, "probe": fn(client) -> bool}}
+        :param on_change: fn(name, client)，客户端可用 / 失效时回调（失效时 client 为 None）
+        """
+        self.specs = specs
+        self.on_change = on_change
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+        self.max_backoff = max_backoff
+
+        self._clients = {name: None for name in specs}
+        self._ready = {name: threading.Event() for name in specs}
+        self._connecting = set()
+        self._lock = threading.Lock()
+        self._state = {
+            name: {"state": "init", "reconnects": 0, "failures": 0, "last_error": None, "last_ok": None}
+            for name in specs
+        }
+
+    def start(self, wait=None):
+        """
+        并行初始化所有客户端并启动健康检查线程
+        :param wait: 最多等待初始化完成的时间 (秒)，None 表示一直等
+        :return: 是否全部就绪
+        """
+        for name in self.specs:
+            self._spawn_connect(name)
+        threading.Thread(target=self._monitor, name="sdk-monitor", daemon=True).start()
+
+        deadline = None if wait is None else time.time() + wait
+        for event in self._ready.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            event.wait(remaining)
+        return all(event.is_set() for event in self._ready.values())
+
+    def get(self, name):
+        return self._clients.get(name)
+
+    def wait_ready(self, name, timeout):
+        """客户端正在重建时短暂等待，返回是否可用"""
+        return self._ready[name].wait(timeout)
+
+    def report_failure(self, name, error):
+        """指令执行中 SDK 调用出错时上报，累计到阈值后重建客户端"""
+        with self._lock:
+            state = self._state[name]
+            state["failures"] += 1
+            state["last_error"] = str(error)
+            trigger = state["failures"] >= self.failure_threshold and name not in self._connecting
+            if trigger:
+                state["reconnects"] += 1
+        if trigger:
+            print(f"SDK client '{name}' unhealthy ({error}), re-creating...")
+            self._spawn_connect(name)
+
+    def status(self):
+        with self._lock:
+            return {name: dict(state) for name, state in self._state.items()}
+
+    def _spawn_connect(self, name):
+        with self._lock:
+            if name in self._connecting:
+                return
+            self._connecting.add(name)
+        threading.Thread(target=self._connect, args=(name,), name=f"sdk-connect-{name}", daemon=True).start()
+
+    def _connect(self, name):
+        # 先置空：重建期间的指令立即失败或等待，而不是打到坏掉的客户端上
+        self._ready[name].clear()
+        self._clients[name] = None
+        self.on_change(name, None)
+        with self._lock:
+            self._state[name]["state"] = "connecting"
+
+        backoff = 1.0
+        while True:
+            started = time.time()
+            try:
+                client = self.specs[name]["factory"]()
+                break
+            except Exception as e:
+                with self._lock:
+                    self._state[name]["last_error"] = str(e)
+                print(f"SDK client '{name}' init failed: {e}, retry in {backoff:.0f}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+        self._clients[name] = client
+        self.on_change(name, client)
+        with self._lock:
+            state = self._state[name]
+            state.update(state="ready", failures=0, last_ok=time.time(),
+                         init_ms=round((time.time() - started) * 1000, 1))
+            self._connecting.discard(name)
+        self._ready[name].set()
+        print(f"SDK client '{name}' ready")
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.probe_interval)
+            for name, spec in self.specs.items():
+                client = self._clients.get(name)
+                if client is None or name in self._connecting:
+                    continue
+                try:
+                    ok = spec["probe"](client)
+                    error = "health probe failed"
+                except Exception as e:
+                    ok, error = False, e
+                if ok:
+                    with self._lock:
+                        self._state[name].update(failures=0, last_ok=time.time())
+                else:
+                    self.report_failure(name, error)
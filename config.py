@@ -1,55 +1,117 @@
 import os
 
+from action_registry import get_registry
+
 # === 机器人配置 ===
 ROBOT_SERVER_URL = "http://192.168.1.72:6000"
+# 长连接控制通道端口（与 ROBOT_SERVER_URL 同一主机）；不可用时自动回退到 HTTP
+USE_CONTROL_CHANNEL = True
+ROBOT_CONTROL_PORT = 6001
+# 多机器人：{名称: {"url": ..., "groups": [...], "control_port": 可选}}；为空时只控制 ROBOT_SERVER_URL 一台（名称 "default"）
+# 第一台为主机器人，自动对话的回复只由它播报
+ROBOT_FLEET = {}
+FLEET_SYNC_LEAD = 0.3            # 同步开始时间在最大单程延迟之外再留出的余量 (秒)
+FLEET_CLOCK_SYNC_INTERVAL = 30   # 时钟偏差重新估计的间隔 (秒)
 MIC_DEVICE_INDEX = 1
+# 机器人说话时的麦克风屏蔽方式: "auto"（Windows 上同时系统静音）/ "software"（仅丢弃采集帧）/ "os"
+MIC_GATE_MODE = "auto"
+
+# === 指令合并 ===
+BATCH_WINDOW = 0.02   # 该时间窗口 (秒) 内提交的指令合并成一次 /cmd/batch
+BATCH_TIMEOUT = 10    # 批量请求超时 (秒)，动作指令在服务端是串行执行的
+
+# === 说话队列 ===
+SPEECH_COALESCE_MAX_CHARS = 40  # 同优先级相邻短句合并后的最大字数
+# 各优先级排队的最长时间 (秒)，超时丢弃；None 表示不过期。键: 0 导演 / 1 系统提示 / 2 自动回复
+SPEECH_MAX_AGE = {0: None, 1: 10.0, 2: 15.0}
+
+# === 熔断（机器人服务不可达时快速失败）===
+ROBOT_BREAKER_WINDOW = 10          # 统计最近多少次请求
+ROBOT_BREAKER_FAILURE_RATE = 0.5   # 失败率达到该值时熔断
+ROBOT_BREAKER_MIN_FAILURES = 3     # 至少失败这么多次才熔断
+ROBOT_BREAKER_COOLDOWN = 2.0       # 熔断后多久 (秒) 用 GET /status 探测一次，探测失败则加倍
+ROBOT_BREAKER_MAX_COOLDOWN = 30.0
+# 熔断期间的播报: "buffer" 排队等恢复（仍受 SPEECH_MAX_AGE 限制）/ "drop" 直接丢弃
+ROBOT_SPEECH_WHEN_OPEN = "buffer"
 
 # === 大模型配置 ===
 LLM_API_KEY = os.getenv("OPENAI_API_KEY")  # 请替换你的 Key
 LLM_BASE_URL = "https://api.rcouyi.com/v1" # 或你的本地/中转地址
 LLM_MODEL = "gpt-4o" # 或你的模型名
 
+# === 对话记忆配置 ===
+MEMORY_MAX_TOKENS = 1200   # 每个会话上下文的 token 预算
+MEMORY_MAX_TURNS = 20      # 每个会话最多保留的消息条数
+MEMORY_SUMMARIZE = False   # 是否用大模型把淘汰的旧对话压缩成摘要
+
 # === 语音交互配置 ===
 WAKE_WORDS = ["你好", "桂小志", "guixiaozhi", "guixiaozi"]
 VOSK_MODEL_PATH = "model"
 IS_LLM_CHECK = True
 
+# 流式回复请求超时 (秒)：连接超时 / 两次数据之间的最长间隔
+REPLY_CONNECT_TIMEOUT = 5
+REPLY_READ_TIMEOUT = 30
+
+# === 多会话（多个展台 / 机器人共用一个后端）===
+SESSION_IDLE_TIMEOUT = 600   # 会话空闲多久 (秒) 后淘汰，同时释放其对话记忆
+SESSION_MAX = 64             # 同时保留的会话数上限，超出时淘汰最久未活动的空闲会话
+REPLY_POOL_SIZE = 4          # 各会话共用的回复线程池大小（同时进行的回复流）
+REPLY_POOL_QUEUE = 16        # 排队等待的回复数上限，超出时 /api/chat 返回 429
+
+# 回复来源: "external" 外部流式问答接口 (仅文本) / "llm" OpenAI 兼容流式接口 (支持内嵌动作标签)
+REPLY_BACKEND = "external"
+
+# 高频问题回复缓存（命中时直接回放，不请求外部接口）
+RESPONSE_CACHE = True
+RESPONSE_CACHE_PATH = "response_cache.json"
+RESPONSE_CACHE_TTL = 24 * 3600  # 秒
+RESPONSE_CACHE_MIN_ASKS = 2  # 同一问题 (同一会话) 完整回答过几次后才缓存，只缓存高频问题
+
+# 本地意图快速通道：简单动作指令（如“站起来”“挥手”）不经过大模型直接执行
+INTENT_FAST_PATH = True
+INTENT_MIN_CONFIDENCE = 0.6  # 低于该置信度时回退到大模型
+
+# VAD 断句: "energy" (能量+频谱) / "webrtc" (需安装 webrtcvad) / None (使用 speech_recognition 原生 1s 停顿断句)
+VAD_MODE = "energy"
+VAD_BASE_SILENCE = 0.6  # 默认静音窗口 (秒)
+VAD_MIN_SILENCE = 0.3   # 部分识别文本看起来已说完时的静音窗口
+VAD_MAX_SILENCE = 1.2   # 句子明显没说完时的静音窗口
+# 短 / 长窗口依赖下面的部分识别结果；PARTIAL_ASR = False 时只使用 VAD_BASE_SILENCE
+
+# 句中停顿时的部分识别（需开启 VAD_MODE），结果用于自适应断句与推测式预取回复
+PARTIAL_ASR = True
+PARTIAL_ASR_SILENCE = 0.25     # 停顿超过该时长 (秒) 时对已录音频做一次部分识别
+PARTIAL_ASR_MIN_SPEECH = 0.6   # 已说话时长不足时不做部分识别
+
+# 推测式回复：稳定的部分识别结果含唤醒词时提前请求回复，最终文本差异过大则取消重来
+# 仅在 REPLY_BACKEND = "llm" 时生效：外部接口按 sessionId 在服务端保存上下文，被取消的推测请求无法撤回，会污染对话
+# 采纳的推测回复基于未纠错的部分文本，不经过 IS_LLM_CHECK 纠错（纠错需要一次额外请求，会抵消提前量）
+SPECULATIVE_REPLY = True
+SPECULATIVE_MATCH_THRESHOLD = 0.85  # 部分文本与最终文本的相似度阈值
+
+# ASR 识别工作池
+ASR_WORKERS = 2                 # 并发识别线程数
+ASR_MAX_PENDING = 4             # 待识别音频 / 待取文本的最大积压数
+ASR_BACKLOG_POLICY = "coalesce"  # 积压时: "coalesce" 合并 / "drop_oldest" 丢弃最早
+ASR_TIMEOUT = 10                # 单次识别请求超时 (秒)
+# 对话录制：记录句子音频、识别结果、唤醒判断、回复流和下发的指令，用于 replay.py 离线回放
+RECORD_SESSIONS = False
+RECORD_DIR = "recordings"  # 每次启动一个子目录
+
+# 设置后从该地址获取 Token（CreateToken 格式），用于本地桩服务测试: python aliyun_token.py --serve 8765
+ALIYUN_TOKEN_URL = None
+
 # api 设置
 url = "https://gzybot.wenhuaguangxi.com:XXX/XXXXXXXXXX"
 sessionId = "XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
 
 # === 动作定义 (ACTION_MAP) ===
-# 大模型根据 "desc" 来判断用户意图，并返回对应的 Key (数字 ID)
-ACTION_MAP = {
-    # --- Arm Actions (手臂动作) ---
-    1:  {"group": "arm", "name": "shake hand",    "desc": "握手"},
-    2:  {"group": "arm", "name": "high five",     "desc": "击掌"},
-    3:  {"group": "arm", "name": "hug",           "desc": "拥抱"},
-    4:  {"group": "arm", "name": "high wave",     "desc": "挥手/打招呼/招手"},
-    5:  {"group": "arm", "name": "clap",          "desc": "鼓掌/拍手"},
-    6:  {"group": "arm", "name": "heart",         "desc": "比心"},
-    7:  {"group": "arm", "name": "hands up",      "desc": "举手/举起手"},
-    8:  {"group": "arm", "name": "release arm",   "desc": "放下手/松手/放松手臂"},
-
-    # --- Locomotion Actions (运动/姿态) ---
-    9:  {"group": "loco", "name": "Squat2StandUp", "desc": "站起来/起立"},
-    10: {"group": "loco", "name": "StandUp2Squat", "desc": "蹲下/下蹲"},
-    11: {"group": "loco", "name": "low stand",     "desc": "低站姿/低姿态"},
-    12: {"group": "loco", "name": "high stand",    "desc": "高站姿/高姿态"},
-    13: {"group": "loco", "name": "move forward",  "desc": "前进/往前走/向前"},
-    14: {"group": "loco", "name": "move lateral",  "desc": "横移/左移/右移/侧移"},
-    15: {"group": "loco", "name": "move rotate",   "desc": "转圈/旋转/原地转"},
-    # 16: {"group": "loco", "name": "damp",          "desc": "阻尼状态/放松/变软"},
-    # 17: {"group": "loco", "name": "zero torque",   "desc": "零力矩模式"},
-    18: {"group": "loco", "name": "wave hand1",    "desc": "摆手一/动作一"},
-    19: {"group": "loco", "name": "wave hand2",    "desc": "摆手二/动作二"},
-    # 20: {"group": "loco", "name": "Lie2StandUp",   "desc": "躺倒起立/起身/鲤鱼打挺"},
-}
+# 动作统一在 actions.json 中声明（机器人服务端共用同一份文件）
+# 大模型根据 "desc"（同义词）来判断用户意图，并返回对应的 Key (llm_id)
+ACTION_MAP = get_registry().action_map()
+
 
 def get_action_prompt_text():
-    """生成给大模型的提示词文本"""
-    prompt = "【可用动作列表】\n"
-    for aid, info in ACTION_MAP.items():
-        prompt += f"- ID {aid}: {info['desc']}\n"
-    # print(prompt)
-    return prompt
+    """给大模型的提示词文本（加载动作表时已生成好）"""
+    return get_registry().prompt_text
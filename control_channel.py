@@ -0,0 +1,341 @@
+import json
+import time
+import socket
+import struct
+import threading
+import socketserver
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# ================= 帧格式 =================
+# 4 字节大端长度 + UTF-8 JSON
+# 客户端 -> 服务端: {"type": "req", "id": 1, "cmd": "speak", ...} / {"type": "ping", "t": ...}
+# 服务端 -> 客户端: {"type": "resp", "id": 1, "code": 200, "result": {...}} / {"type": "pong", "t": ...}
+#                   {"type": "event", "event": "speech_started", ...}
+
+_HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+HEARTBEAT_INTERVAL = 2.0  # 心跳间隔 (秒)
+HEARTBEAT_TIMEOUT = 6.0   # 超过该时间没有收到任何数据则认为连接已断开
+
+
+class ChannelUnavailable(Exception):
+    """长连接不可用（未连接 / 发送失败），指令没有发出，调用方应回退到 HTTP"""
+
+
+class ChannelRequestLost(Exception):
+    """指令已发出但没有收到结果（超时 / 发出后断线）：服务端可能已经执行，调用方不能再重发"""
+
+
+def send_frame(sock, message, lock=None):
+    data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    frame = _HEADER.pack(len(data)) + data
+    if lock is None:
+        sock.sendall(frame)
+    else:
+        with lock:
+            sock.sendall(frame)
+
+
+def _recv_exact(sock, n):
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        buf += chunk
+    return buf
+
+
+def recv_frame(sock):
+    (length,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ConnectionError(f"frame too large: {length}")
+    return json.loads(_recv_exact(sock, length).decode("utf-8"))
+
+
+# ================= 服务端 =================
+
+class _Server(socketserver.ThreadingTCPServer):
+    """只对控制通道生效的设置，不修改标准库类本身（同进程里的其他服务不受影响）"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ControlChannelServer:
+    """
+    机器人端长连接服务
+    - 每个请求在线程池中执行，长动作不会阻塞同一连接上的其他请求（多路复用）
+    - inline 中的指令（耗时极短且要求保序，如速度流）直接在读线程中执行
+    - 不带 id 的请求视为通知，不回复
+    - broadcast() 向所有已连接客户端推送事件
+    """
+
+    def __init__(self, handlers, host="0.0.0.0", port=6001, max_workers=8, inline=()):
+        """
+        :param handlers: {cmd: fn(data) -> (payload, code)}
+        """
+        self.handlers = handlers
+        self.inline = set(inline)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ctrl")
+        self._clients = {}  # sock -> send lock
+        self._clients_lock = threading.Lock()
+
+        channel = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                channel._serve_connection(self.request)
+
+        self._server = _Server((host, port), Handler)
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever, name="control-channel", daemon=True)
+        t.start()
+        return t
+
+    def shutdown(self):
+        self._server.shutdown()
+
+    def broadcast(self, event, **data):
+        message = {"type": "event", "event": event, "t": time.time(), **data}
+        with self._clients_lock:
+            clients = list(self._clients.items())
+        for sock, lock in clients:
+            try:
+                send_frame(sock, message, lock)
+            except Exception:
+                pass
+
+    def _serve_connection(self, sock):
+        lock = threading.Lock()
+        sock.settimeout(HEARTBEAT_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._clients_lock:
+            self._clients[sock] = lock
+        try:
+            while True:
+                message = recv_frame(sock)
+                kind = message.get("type")
+                if kind == "ping":
+                    send_frame(sock, {"type": "pong", "t": message.get("t"), "server_time": time.time()}, lock)
+                elif kind == "req":
+                    if message.get("cmd") in self.inline:
+                        self._handle_request(sock, lock, message)
+                    else:
+                        self.executor.submit(self._handle_request, sock, lock, message)
+        except Exception:
+            pass
+        finally:
+            with self._clients_lock:
+                self._clients.pop(sock, None)
+
+    def _handle_request(self, sock, lock, message):
+        req_id = message.get("id")
+        cmd = message.get("cmd")
+        handler = self.handlers.get(cmd)
+        if handler is None:
+            payload, code = {"status": "error", "msg": f"Unknown cmd: {cmd}"}, 400
+        else:
+            try:
+                payload, code = handler(message)
+            except Exception as e:
+                payload, code = {"status": "error", "msg": str(e)}, 500
+        if req_id is None:
+            return
+        try:
+            send_frame(sock, {"type": "resp", "id": req_id, "code": code, "result": payload}, lock)
+        except Exception:
+            pass
+
+
+# ================= 客户端 =================
+
+class ChannelResponse:
+    """与 requests.Response 相同的最小接口，便于和 HTTP 回退路径共用调用代码"""
+
+    def __init__(self, code, result):
+        self.status_code = code
+        self._result = result
+
+    def json(self):
+        return self._result
+
+
+class ControlChannelClient:
+    """
+    控制端长连接
+    - 后台线程自动连接 / 断线重连（指数退避）
+    - 请求带 id，多个请求可以同时在途，按 id 匹配响应
+    - 定时心跳，超时未收到数据则主动断开并重连
+    - on_event 注册服务端推送事件的回调
+    """
+
+    def __init__(self, host, port, connect_timeout=2.0):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._connected = threading.Event()
+        self._pending = {}
+        self._next_id = 0
+        self._listeners = []
+        self._last_recv = 0.0
+        self._running = False
+        self.reconnects = 0
+        self.rtt_ms = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        threading.Thread(target=self._connect_loop, name="ctrl-connect", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="ctrl-heartbeat", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self._close()
+
+    def is_connected(self):
+        return self._connected.is_set()
+
+    def on_event(self, callback):
+        self._listeners.append(callback)
+
+    def request(self, command, timeout=3.0):
+        """
+        发送一条指令并等待结果
+        :return: ChannelResponse
+        :raises ChannelUnavailable: 未连接或发送失败（指令未发出，可以改走 HTTP）
+        :raises ChannelRequestLost: 已发出但超时 / 断线（可能已执行，不能重发）
+        """
+        if not self._connected.is_set():
+            raise ChannelUnavailable("not connected")
+
+        future = Future()
+        with self._state_lock:
+            self._next_id += 1
+            req_id = self._next_id
+            self._pending[req_id] = future
+            sock = self._sock
+
+        try:
+            try:
+                send_frame(sock, {"type": "req", "id": req_id, **command}, self._send_lock)
+            except Exception as e:
+                raise ChannelUnavailable(str(e) or type(e).__name__)
+            try:
+                code, result = future.result(timeout=timeout)
+            except Exception as e:
+                raise ChannelRequestLost(str(e) or type(e).__name__)
+            return ChannelResponse(code, result)
+        finally:
+            with self._state_lock:
+                self._pending.pop(req_id, None)
+
+    def notify(self, command):
+        """
+        只发送不等待结果（高频的速度流等）
+        :raises ChannelUnavailable: 未连接或发送失败
+        """
+        sock = self._sock
+        if not self._connected.is_set() or sock is None:
+            raise ChannelUnavailable("not connected")
+        try:
+            send_frame(sock, {"type": "req", "id": None, **command}, self._send_lock)
+        except Exception as e:
+            raise ChannelUnavailable(str(e) or type(e).__name__)
+
+    def _connect_loop(self):
+        backoff = 0.5
+        while self._running:
+            if self._connected.is_set():
+                time.sleep(0.5)
+                continue
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+                sock.settimeout(None)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+                continue
+
+            connected_at = time.time()
+            with self._state_lock:
+                self._sock = sock
+                self._last_recv = connected_at
+            self._connected.set()
+            print(f"🔌 Control channel connected: {self.host}:{self.port}")
+            self._read_loop(sock)
+
+            # 连上后很快又断开（对端异常 / 端口被其他程序占用）时继续退避，避免频繁重连
+            if time.time() - connected_at < HEARTBEAT_TIMEOUT:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+            else:
+                backoff = 0.5
+
+    def _read_loop(self, sock):
+        try:
+            while self._running:
+                message = recv_frame(sock)
+                self._last_recv = time.time()
+                kind = message.get("type")
+                if kind == "resp":
+                    with self._state_lock:
+                        future = self._pending.get(message.get("id"))
+                    if future is not None and not future.done():
+                        future.set_result((message.get("code", 200), message.get("result")))
+                elif kind == "pong":
+                    if message.get("t"):
+                        self.rtt_ms = (time.time() - message["t"]) * 1000
+                elif kind == "event":
+                    for cb in list(self._listeners):
+                        try:
+                            cb(message)
+                        except Exception as e:
+                            print(f"⚠️ Control channel event handler error: {e}")
+        except Exception:
+            pass
+        finally:
+            self._close()
+
+    def _heartbeat_loop(self):
+        while self._running:
+            time.sleep(HEARTBEAT_INTERVAL)
+            if not self._connected.is_set():
+                continue
+            if time.time() - self._last_recv > HEARTBEAT_TIMEOUT:
+                print("⚠️ Control channel heartbeat timeout, reconnecting...")
+                self._close()
+                continue
+            try:
+                send_frame(self._sock, {"type": "ping", "t": time.time()}, self._send_lock)
+            except Exception:
+                self._close()
+
+    def _close(self):
+        with self._state_lock:
+            sock, self._sock = self._sock, None
+            was_connected = self._connected.is_set()
+            self._connected.clear()
+            pending, self._pending = self._pending, {}
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ChannelUnavailable("connection lost"))
+        if was_connected:
+            self.reconnects += 1
+            print("🔌 Control channel disconnected")
@@ -3,20 +3,34 @@ import json
 import queue
 import os
 import time
+import threading
+from collections import deque
 import requests
 import speech_recognition as sr
-from aliyunsdkcore.client import AcsClient
-from aliyunsdkcore.request import CommonRequest
-from config import MIC_DEVICE_INDEX
+from config import MIC_DEVICE_INDEX, ALIYUN_TOKEN_URL, ASR_WORKERS, ASR_MAX_PENDING, ASR_BACKLOG_POLICY, ASR_TIMEOUT
+from config import VAD_MODE, VAD_BASE_SILENCE, VAD_MIN_SILENCE, VAD_MAX_SILENCE
+from config import PARTIAL_ASR, PARTIAL_ASR_SILENCE, PARTIAL_ASR_MIN_SPEECH
+from vad import create_vad, AdaptiveEndpointer, VadSegmenter
+from mic_gate import mic_gate
+from recorder import recorder
+from aliyun_token import AliyunTokenManager, fetch_token_via_sdk, fetch_token_via_http
 
 # ================= 阿里云配置 =================
 ACCESS_KEY_ID = "XXXX"
 ACCESS_KEY_SECRET = "XXXX"
 APPKEY = "XXXX"
 
+# 识别接口返回该状态码表示 Token 无效/过期
+ALIYUN_TOKEN_INVALID_STATUS = 40000001
+
 
 # ============================================
 
+# 自定义 VAD 采集时每帧 30ms (16k 采样率下 480 个采样点)
+VAD_FRAME_MS = 30
+VAD_CHUNK = 16000 * VAD_FRAME_MS // 1000
+
+
 class BackgroundEars:
     def __init__(self):
         """
@@ -25,13 +39,34 @@ class BackgroundEars:
         self.recognizer = sr.Recognizer()
         self.msg_queue = queue.Queue()
         self.stop_listening_func = None
-        self.aliyun_token = None
+        self._capture_running = False
 
-        # 获取阿里云 Token (启动时获取一次)
-        self.aliyun_token = self._get_aliyun_token()
-        if not self.aliyun_token:
-            print("❌ 无法获取阿里云 Token，程序退出")
-            sys.exit(1)
+        # === 识别工作池 ===
+        # 采集线程只负责入队，网络识别在工作线程中并发执行，结果按序交付
+        self._jobs = deque()
+        self._jobs_cond = threading.Condition()
+        # 部分识别优先级低于整句：只保留最新的一个待识别，且同时最多一个在识别中
+        self._partial_job = None
+        self._partial_inflight = False
+        self._asr_gen = 0
+        self._next_submit_seq = 0
+        self._next_deliver_seq = 0
+        self._pending_results = {}
+        self._deliver_lock = threading.Lock()
+        self._start_asr_workers()
+
+        # === 部分识别 ===
+        self._utterance_id = 0
+        self._partial_requested_at = None
+        self._latest_partial = None
+        self._partial_lock = threading.Lock()
+
+        # 阿里云 Token：后台线程缓存并在过期前自动刷新
+        print(">>> 正在初始化阿里云 Token...")
+        self.token_manager = AliyunTokenManager(self._get_aliyun_token)
+        # 只短暂等待：Token 在后台继续获取，不拖住整个启动流程
+        if not self.token_manager.start(wait=2):
+            print("⚠️ 暂未获取到阿里云 Token，将在后台继续重试")
 
         # 1. 声音波动检测灵敏度
         self.recognizer.energy_threshold = 400
@@ -44,36 +79,38 @@ class BackgroundEars:
         self.recognizer.non_speaking_duration = 0.5
         self.recognizer.phrase_threshold = 0.3
 
-    def _get_aliyun_token(self):
-        """获取阿里云访问令牌"""
-        print(">>> 正在初始化阿里云 Token...")
-        client = AcsClient(ACCESS_KEY_ID, ACCESS_KEY_SECRET, "cn-shanghai")
-        request = CommonRequest()
-        request.set_method('POST')
-        request.set_domain('nls-meta.cn-shanghai.aliyuncs.com')
-        request.set_version('2019-02-28')
-        request.set_action_name('CreateToken')
+    @property
+    def aliyun_token(self):
+        return self.token_manager.get_token()
 
-        try:
-            response = client.do_action_with_exception(request)
-            jss = json.loads(response)
-            if 'Token' in jss and 'Id' in jss['Token']:
-                return jss['Token']['Id']
-            else:
-                return None
-        except Exception as e:
-            print(f"❌ Token 获取异常: {e}")
-            return None
+    def _get_aliyun_token(self):
+        """获取阿里云访问令牌，返回 (token, expire_time)"""
+        if ALIYUN_TOKEN_URL:
+            return fetch_token_via_http(ALIYUN_TOKEN_URL)
+        return fetch_token_via_sdk(ACCESS_KEY_ID, ACCESS_KEY_SECRET)
 
     def clear_queue(self):
-        """清空缓存"""
+        """清空缓存（包括尚未识别的音频，以及正在识别中的结果）"""
+        with self._jobs_cond:
+            self._asr_gen += 1
+            dropped = [job[0] for job in self._jobs]
+            self._jobs.clear()
+            self._partial_job = None
+        for seq in dropped:
+            self._deliver(seq, None)
         with self.msg_queue.mutex:
             self.msg_queue.queue.clear()
+        with self._partial_lock:
+            self._latest_partial = None
 
     def start(self):
         """启动后台监听线程"""
         print(f"👂 Initializing Microphone for [ALIYUN] Speech...")
 
+        if VAD_MODE:
+            self._start_vad_capture()
+            return
+
         try:
             # 阿里云通常建议 16000 采样率
             self.mic = sr.Microphone(device_index=MIC_DEVICE_INDEX, sample_rate=16000)
@@ -95,6 +132,109 @@ class BackgroundEars:
             print(f"❌ Microphone Init Error: {e}")
             sys.exit(1)
 
+    def _start_vad_capture(self):
+        """使用自定义 VAD + 自适应断句的采集线程替代 listen_in_background"""
+        try:
+            self.mic = sr.Microphone(device_index=MIC_DEVICE_INDEX, sample_rate=16000, chunk_size=VAD_CHUNK)
+            self.vad_segmenter = VadSegmenter(
+                create_vad(VAD_MODE),
+                AdaptiveEndpointer(frame_ms=VAD_FRAME_MS,
+                                   base_silence=VAD_BASE_SILENCE,
+                                   min_silence=VAD_MIN_SILENCE,
+                                   max_silence=VAD_MAX_SILENCE,
+                                   max_phrase=20),  # 单句最长录音限制，防止一直不结束
+            )
+        except Exception as e:
+            print(f"❌ Microphone Init Error: {e}")
+            sys.exit(1)
+
+        self._capture_running = True
+        self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self._capture_thread.start()
+        self.stop_listening_func = self._stop_vad_capture
+        if not PARTIAL_ASR:
+            print("⚠️ PARTIAL_ASR 已关闭：自适应断句没有部分识别文本，固定使用基础静音窗口")
+        print(f">>> 服务已就绪 (VAD: {VAD_MODE})，请说话...")
+
+    def _stop_vad_capture(self, wait_for_stop=False):
+        self._capture_running = False
+        if wait_for_stop:
+            self._capture_thread.join()
+
+    def _capture_loop(self):
+        """逐帧读取麦克风 -> VAD -> 断句 -> 触发 _callback"""
+        with self.mic as source:
+            while self._capture_running:
+                frame = source.stream.read(source.CHUNK)
+                if not frame:
+                    continue
+                if mic_gate.is_muted():
+                    # 机器人正在说话：丢弃采集帧，说到一半的句子也一并作废
+                    if self.vad_segmenter.in_speech:
+                        self.vad_segmenter.reset()
+                    continue
+                was_in_speech = self.vad_segmenter.in_speech
+                pcm = self.vad_segmenter.feed(frame)
+                if not was_in_speech and self.vad_segmenter.in_speech:
+                    self._utterance_id += 1
+                if pcm:
+                    audio = sr.AudioData(pcm, source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+                    self._callback(self.recognizer, audio)
+                elif PARTIAL_ASR and self._should_request_partial():
+                    self._request_partial()
+
+    # ================= 部分识别 (句中停顿时) =================
+
+    def _should_request_partial(self):
+        """说话中出现短停顿、且这次停顿还没请求过部分识别"""
+        seg = self.vad_segmenter
+        if not seg.in_speech or seg.silence_seconds < PARTIAL_ASR_SILENCE:
+            return False
+        speech_frames = seg.endpointer.speech_frames
+        if speech_frames * VAD_FRAME_MS / 1000.0 < PARTIAL_ASR_MIN_SPEECH:
+            return False
+        return self._partial_requested_at != (self._utterance_id, speech_frames)
+
+    def _request_partial(self):
+        """部分识别交给识别工作池（低优先级）：新的请求替换还没开始的旧请求"""
+        utterance_id = self._utterance_id
+        speech_frames = self.vad_segmenter.endpointer.speech_frames
+        self._partial_requested_at = (utterance_id, speech_frames)
+        pcm = self.vad_segmenter.current_audio()
+        with self._jobs_cond:
+            self._partial_job = (utterance_id, speech_frames, self._asr_gen, pcm)
+            self._jobs_cond.notify()
+
+    def _run_partial(self, utterance_id, speech_frames, gen, pcm):
+        try:
+            text = self._recognize(pcm)
+        except Exception as e:
+            print(f"⚠️ Partial ASR failed: {e}")
+            return
+        if not text or gen != self._asr_gen or utterance_id != self._utterance_id:
+            return
+        seg = self.vad_segmenter
+        if not seg.in_speech:
+            # 已经断句，最终结果马上就到，部分结果没有意义了
+            return
+        self.set_partial_text(text)
+        # 请求发出后用户没有再开口，说明这段部分结果是稳定的
+        stable = seg.endpointer.speech_frames == speech_frames
+        recorder.record("partial", utterance=utterance_id, text=text, stable=stable)
+        with self._partial_lock:
+            self._latest_partial = (utterance_id, text, stable)
+
+    def get_partial(self):
+        """取出最新的部分识别结果 (utterance_id, text, stable)，没有则返回 None"""
+        with self._partial_lock:
+            partial, self._latest_partial = self._latest_partial, None
+            return partial
+
+    def set_partial_text(self, text):
+        """部分识别结果回填给断句器，用于自适应调整静音窗口"""
+        if VAD_MODE:
+            self.vad_segmenter.endpointer.set_partial_text(text)
+
     def stop(self):
         """停止监听"""
         if self.stop_listening_func:
@@ -109,49 +249,150 @@ class BackgroundEars:
 
     def _callback(self, recognizer, audio):
         """
-        回调函数：当检测到说话停止（停顿1s）后触发，上传阿里云
+        回调函数：当检测到说话停止（VAD 断句 / 停顿1s）后触发
+        只负责把音频放入识别任务队列，不做任何网络 I/O，采集线程不会被阻塞
         """
-        start_process_time = time.time()
-
+        if mic_gate.is_muted():
+            return
         try:
-            # --- 1. 获取 WAV 二进制数据 ---
-            # 直接转换成 WAV 格式的 bytes，无需保存文件
-            audio_data = audio.get_wav_data(convert_rate=16000, convert_width=2)
+            pcm = audio.get_raw_data(convert_rate=16000, convert_width=2)
+            if len(pcm) == 0:
+                return
+            self._submit_audio(pcm)
+        except Exception as e:
+            print(f"❌ Unexpected Error in callback: {e}")
+
+    # ================= 识别工作池 =================
+
+    def _start_asr_workers(self):
+        for i in range(ASR_WORKERS):
+            t = threading.Thread(target=self._asr_worker, name=f"asr-worker-{i}", daemon=True)
+            t.start()
+
+    def _submit_audio(self, pcm):
+        """
+        识别任务入队（带序号，保证结果按说话顺序交付）
+        队列积压时按 ASR_BACKLOG_POLICY 处理：
+        - "drop_oldest": 丢弃最早的待识别音频
+        - "coalesce": 把新音频拼接到最后一个待识别任务上，合并成一次识别请求
+        """
+        with self._jobs_cond:
+            if len(self._jobs) >= ASR_MAX_PENDING:
+                if ASR_BACKLOG_POLICY == "coalesce":
+                    seq, gen, old_pcm, t0 = self._jobs[-1]
+                    self._jobs[-1] = (seq, gen, old_pcm + pcm, t0)
+                    recorder.record_audio("utterance", pcm, seq=seq, coalesced=True)
+                    print(f"⚠️ ASR 积压，合并音频到任务 #{seq}")
+                    return
+                seq, _, _, _ = self._jobs.popleft()
+                print(f"⚠️ ASR 积压，丢弃任务 #{seq}")
+                self._deliver(seq, None)
 
-            if len(audio_data) == 0:
+            seq = self._next_submit_seq
+            self._next_submit_seq += 1
+            self._jobs.append((seq, self._asr_gen, pcm, time.time()))
+            recorder.record_audio("utterance", pcm, seq=seq)
+            self._jobs_cond.notify()
+
+    def _next_partial_locked(self):
+        """没有整句任务、且没有部分识别在进行时，取出待做的部分识别"""
+        if self._jobs or self._partial_inflight or self._partial_job is None:
+            return None
+        job, self._partial_job = self._partial_job, None
+        self._partial_inflight = True
+        return job
+
+    def _asr_worker(self):
+        while True:
+            with self._jobs_cond:
+                partial = None
+                while not self._jobs:
+                    partial = self._next_partial_locked()
+                    if partial is not None:
+                        break
+                    self._jobs_cond.wait()
+                if partial is None:
+                    seq, gen, pcm, start_process_time = self._jobs.popleft()
+
+            if partial is not None:
+                try:
+                    self._run_partial(*partial)
+                except Exception as e:
+                    print(f"⚠️ Partial ASR failed: {e}")
+                finally:
+                    with self._jobs_cond:
+                        self._partial_inflight = False
+                        self._jobs_cond.notify()
+                continue
+
+            text = None
+            try:
+                text = self._recognize(pcm)
+                if text:
+                    total_latency = (time.time() - start_process_time) * 1000
+                    print(f"🎤 [ALIYUN] Captured #{seq}: '{text}' (Latency: {total_latency:.1f}ms)")
+            except Exception as e:
+                print(f"❌ Unexpected Error in ASR worker: {e}")
+
+            recorder.record("asr", seq=seq, text=text or "", dropped=gen != self._asr_gen,
+                            latency_ms=round((time.time() - start_process_time) * 1000, 1))
+            # clear_queue 之后完成的识别结果属于旧的一批，直接作废
+            if gen != self._asr_gen:
+                text = None
+            self._deliver(seq, text)
+
+    def _deliver(self, seq, text):
+        """按序号顺序把识别结果放入 msg_queue（乱序完成的结果先暂存）"""
+        with self._deliver_lock:
+            self._pending_results[seq] = text
+            while self._next_deliver_seq in self._pending_results:
+                result = self._pending_results.pop(self._next_deliver_seq)
+                self._next_deliver_seq += 1
+                if result:
+                    self._put_text(result)
+
+    def _put_text(self, text):
+        with self.msg_queue.mutex:
+            pending = self.msg_queue.queue
+            if pending and ASR_BACKLOG_POLICY == "coalesce":
+                # 主循环还没来得及取走上一句，合并成一句
+                pending[-1] = pending[-1] + text
                 return
+            if len(pending) >= ASR_MAX_PENDING:
+                pending.popleft()
+        self.msg_queue.put(text)
 
-            # --- 2. 发送给阿里云 (RESTful API) ---
-            url = f"http://nls-gateway-cn-shanghai.aliyuncs.com/stream/v1/asr"
-            request_url = f"{url}?appkey={APPKEY}&format=wav&sample_rate=16000"
+    def _recognize(self, pcm):
+        """调用阿里云一句话识别 (RESTful API)，返回清理后的文本"""
+        audio_data = sr.AudioData(pcm, 16000, 2).get_wav_data()
 
-            headers = {
-                'X-NLS-Token': self.aliyun_token,
-                'Content-Type': 'application/octet-stream',
-                'Content-Length': str(len(audio_data))
-            }
+        url = f"http://nls-gateway-cn-shanghai.aliyuncs.com/stream/v1/asr"
+        request_url = f"{url}?appkey={APPKEY}&format=wav&sample_rate=16000"
 
-            # print(">>> 正在上传音频至阿里云...") # 调试用，可注释
-            response = requests.post(request_url, headers=headers, data=audio_data)
-            result = response.json()
+        token = self.aliyun_token
+        if not token:
+            print("❌ 阿里云 Token 不可用，跳过本次识别")
+            return ""
 
-            text = ""
-            if response.status_code == 200 and result.get('status') == 20000000:
-                text = result.get('result', '')
-            else:
-                print(f"❌ 阿里云识别失败: {result}")
+        headers = {
+            'X-NLS-Token': token,
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': str(len(audio_data))
+        }
 
-            # 结果清理
-            text = text.strip().replace(" ", "")
+        response = requests.post(request_url, headers=headers, data=audio_data, timeout=ASR_TIMEOUT)
+        result = response.json()
 
-            if text:
-                end_process_time = time.time()
-                total_latency = (end_process_time - start_process_time) * 1000
-                print(f"🎤 [ALIYUN] Captured: '{text}' (Latency: {total_latency:.1f}ms)")
-                self.msg_queue.put(text)
+        text = ""
+        if response.status_code == 200 and result.get('status') == 20000000:
+            text = result.get('result', '')
+        else:
+            print(f"❌ 阿里云识别失败: {result}")
+            if result.get('status') == ALIYUN_TOKEN_INVALID_STATUS:
+                self.token_manager.invalidate()
 
-        except Exception as e:
-            print(f"❌ Unexpected Error in callback: {e}")
+        # 结果清理
+        return text.strip().replace(" ", "")
 
 
 # 测试代码
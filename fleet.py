@@ -0,0 +1,321 @@
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from config import ROBOT_SERVER_URL, ROBOT_CONTROL_PORT
+from config import ROBOT_FLEET, FLEET_SYNC_LEAD, FLEET_CLOCK_SYNC_INTERVAL, BATCH_WINDOW, BATCH_TIMEOUT
+from robot_client import RobotClient, SpeechScheduler, PRIORITY_AUTO
+from mic_gate import mic_gate
+
+CLOCK_SAMPLES = 5          # 每次对时的采样次数，取往返时间最短的一次
+STREAM_QUEUE_CHUNKS = 32   # 多机播放时每台机器人的缓冲块数
+STREAM_PUT_TIMEOUT = 5.0   # 某台机器人接收过慢，超过该时间 (秒) 就不再给它转发
+ACTION_RESULT_TIMEOUT = BATCH_WINDOW + BATCH_TIMEOUT + 1.0  # 单台动作等待合并请求结果的上限 (秒)
+
+
+class GroupSpeech:
+    """
+    一组机器人共用的说话队列（与 RobotClient 的说话队列同一套优先级 / 抢占 / 过期规则）
+    - 每句用 run_synced 同步开说，按估算时长等待说完再说下一句，期间屏蔽麦克风
+    - 更高优先级到来、drop / stop 时打断当前这句并让这组机器人停下
+    """
+
+    def __init__(self, fleet, names):
+        self.fleet = fleet
+        self.names = names
+        self.queue = SpeechScheduler()
+        self.speaking = False
+        threading.Thread(target=self._worker, name=f"group-speech-{'+'.join(names)}", daemon=True).start()
+
+    def stop(self):
+        self.queue.clear()
+        self.queue.preempt_event.set()
+
+    def is_speaking(self):
+        return self.speaking or not self.queue.empty()
+
+    def _worker(self):
+        while True:
+            text, _ = self.queue.get()
+            self.speaking = True
+            muted = False
+            try:
+                results = self.fleet.run_synced([{"cmd": "speak", "text": text}], self.names)
+                if all(result[0] is None or result[0].get("status") == "error" for result in results.values()):
+                    print(f"🔌 [Fleet] Group speak failed, skipped: {text}")
+                    continue
+                # 估算时长与 _speak_worker 一致，另加同步开说前的等待
+                duration = self.fleet.sync_lead + len(text) * RobotClient.seconds_per_char + 0.1
+                mic_gate.mute()
+                muted = True
+                start_time = time.time()
+                while time.time() - start_time < duration:
+                    if self.queue.preempt_event.is_set():
+                        print(f"⏭️ [Fleet] Group speech preempted: {text}")
+                        self.fleet._fan_out(self.names, lambda client: client._post("/cmd/stop"))
+                        break
+                    time.sleep(0.1)
+            except Exception as e:
+                print(f"⚠️ [Fleet] Group speech error: {e}")
+            finally:
+                if muted:
+                    mic_gate.unmute()
+                self.queue.done()
+                self.speaking = False
+
+
+class RobotFleet:
+    """
+    多机器人控制
+    - 成员和分组来自 ROBOT_FLEET；目标可以是 None / "all"、机器人名称、分组名称或它们的列表
+    - 对多台机器人的指令并行下发，结果按机器人名称汇总
+    - 后台定期估计各机器人的时钟偏差，多台同时执行时带上按各自时钟换算的开始时间 (start_at)
+    - 单台目标仍走 RobotClient 原有的说话队列 / 指令合并；多台说话走按目标组合建立的 GroupSpeech 队列
+    """
+
+    def __init__(self, fleet=None, sync_lead=FLEET_SYNC_LEAD, clock_sync_interval=FLEET_CLOCK_SYNC_INTERVAL):
+        fleet = fleet or ROBOT_FLEET or {"default": {"url": ROBOT_SERVER_URL}}
+        self.sync_lead = sync_lead
+        self.clock_sync_interval = clock_sync_interval
+
+        self.members = {}
+        self.groups = {}
+        for name, spec in fleet.items():
+            self.members[name] = RobotClient(spec["url"], spec.get("control_port", ROBOT_CONTROL_PORT), name=name)
+            for group in spec.get("groups", ()):
+                self.groups.setdefault(group, []).append(name)
+        # 主机器人：自动对话只由它回复
+        self.primary = next(iter(self.members.values()))
+
+        self._pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.members)), thread_name_prefix="fleet")
+        self._clock = {name: {"offset": None, "rtt": None, "synced_at": None} for name in self.members}
+        self._clock_lock = threading.Lock()
+        self._group_speech = {}  # 机器人名称元组 -> GroupSpeech
+        self._group_lock = threading.Lock()
+        if len(self.members) > 1:
+            threading.Thread(target=self._clock_loop, name="fleet-clock", daemon=True).start()
+
+    # ---------- 目标解析 ----------
+
+    def resolve(self, target=None):
+        """
+        目标 -> 机器人名称列表（保持配置顺序，去重）
+        :raises ValueError: 未知的机器人或分组
+        """
+        if target is None or target == "all":
+            return list(self.members)
+        if isinstance(target, (list, tuple)):
+            names = [name for t in target for name in self.resolve(t)]
+        elif target in self.members:
+            names = [target]
+        elif target in self.groups:
+            names = self.groups[target]
+        else:
+            raise ValueError(f"Unknown robot or group: {target}")
+        return [name for name in self.members if name in names]
+
+    def _fan_out(self, names, fn):
+        """对每台机器人并行调用 fn(client)，返回 {name: 结果}；单台出错不影响其他机器人"""
+        futures = {name: self._pool.submit(fn, self.members[name]) for name in names}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {"status": "error", "msg": str(e)}
+        return results
+
+    # ---------- 时钟同步 ----------
+
+    def sync_clocks(self, names=None):
+        """并行估计时钟偏差：每台采样 CLOCK_SAMPLES 次，取往返时间最短的一次（偏差估计最准）"""
+        def _measure(client):
+            samples = [s for s in (client.measure_clock_offset() for _ in range(CLOCK_SAMPLES)) if s]
+            return min(samples, key=lambda s: s[1]) if samples else None
+
+        results = self._fan_out(names or list(self.members), _measure)
+        with self._clock_lock:
+            for name, sample in results.items():
+                if isinstance(sample, tuple):
+                    offset, rtt = sample
+                    self._clock[name] = {"offset": offset, "rtt": rtt, "synced_at": time.time()}
+        return results
+
+    def _clock_loop(self):
+        while True:
+            self.sync_clocks()
+            time.sleep(self.clock_sync_interval)
+
+    def run_synced(self, commands, target=None, mode="best_effort"):
+        """
+        多台机器人在同一时刻开始执行同一组指令
+        开始时间 = 当前时间 + 最大往返时间 + sync_lead，再按各自的时钟偏差换算成机器人时钟
+        :return: {name: 结果列表}
+        """
+        names = self.resolve(target)
+        with self._clock_lock:
+            missing = [name for name in names if self._clock[name]["offset"] is None]
+        if missing:
+            self.sync_clocks(missing)
+
+        with self._clock_lock:
+            clocks = {name: dict(self._clock[name]) for name in names}
+        max_rtt = max((c["rtt"] for c in clocks.values() if c["rtt"] is not None), default=0.0)
+        start_local = time.time() + max_rtt + self.sync_lead
+
+        futures = {
+            name: self._pool.submit(self.members[name].send_commands, commands, mode,
+                                    start_local + (clocks[name]["offset"] or 0.0))
+            for name in names
+        }
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = [{"status": "error", "msg": str(e)}] * len(commands)
+        return results
+
+    # ---------- 指令 ----------
+
+    def speak(self, text, priority=PRIORITY_AUTO, target=None):
+        """单台进入该机器人的说话队列；多台进入这组机器人共用的说话队列，逐句同步开说"""
+        names = self.resolve(target)
+        if not text:
+            return {name: {"status": "queued"} for name in names}
+        # 同一台机器人可能同时挂在单台队列和多个多机队列上：更高优先级的话同样要抢占其它队列
+        own = self.members[names[0]].speech_queue if len(names) == 1 else self._group(names).queue
+        others = [self.members[name].speech_queue for name in names] + [g.queue for g in self._groups_touching(names)]
+        for q in others:
+            if q is not own:
+                q.preempt_below(priority)
+        if len(names) == 1:
+            self.members[names[0]].speak(text, priority)
+        else:
+            own.put(text, priority)
+        return {name: {"status": "queued"} for name in names}
+
+    def _group(self, names):
+        key = tuple(names)
+        with self._group_lock:
+            group = self._group_speech.get(key)
+            if group is None:
+                group = self._group_speech[key] = GroupSpeech(self, names)
+            return group
+
+    def _groups_touching(self, names):
+        """包含这些机器人中任意一台的多机说话队列"""
+        with self._group_lock:
+            return [group for key, group in self._group_speech.items() if set(key) & set(names)]
+
+    def perform_action(self, action_data, target=None):
+        """单台走指令合并；多台同步开始动作"""
+        names = self.resolve(target)
+        if len(names) == 1:
+            try:
+                result = self.members[names[0]].perform_action(action_data).result(timeout=ACTION_RESULT_TIMEOUT)
+            except FutureTimeout:
+                result = {"status": "error", "msg": "timeout"}
+            except Exception as e:
+                result = {"status": "error", "msg": str(e)}
+            return {names[0]: result}
+        results = self.run_synced([{"cmd": "action", **action_data}], names)
+        return {name: result[0] for name, result in results.items()}
+
+    def clip(self, clip_data, target=None):
+        """播放机器人本地保存的音频片段，多台同步开始"""
+        results = self.run_synced([{"cmd": "clip", **clip_data}], target)
+        return {name: result[0] for name, result in results.items()}
+
+    def set_velocity(self, vx=0.0, vy=0.0, vyaw=0.0, target=None):
+        names = self.resolve(target)
+        if len(names) == 1:
+            return self.members[names[0]].set_velocity(vx, vy, vyaw)
+        self._fan_out(names, lambda client: client.set_velocity(vx, vy, vyaw))
+
+    def drop_speech(self, priority=PRIORITY_AUTO, target=None):
+        names = self.resolve(target)
+        for name in names:
+            self.members[name].drop_speech(priority)
+        for group in self._groups_touching(names):
+            group.queue.drop(priority)
+
+    def stop_all(self, target=None):
+        names = self.resolve(target)
+        for group in self._groups_touching(names):
+            group.stop()
+        return self._fan_out(names, lambda client: client.stop_all())
+
+    def play_stream(self, pcm_chunks, target=None, channel=None):
+        """
+        同一段 PCM 流同时转发给多台机器人（channel 为机器人端的混音通道，None 表示抢占式播放）
+        每台一个有界队列：慢的机器人会让读取端等待，超过 STREAM_PUT_TIMEOUT 仍跟不上就放弃它
+        :return: {name: 服务端结果}
+        """
+        names = self.resolve(target)
+        if len(names) == 1:
+            return {names[0]: self.members[names[0]].play_stream(pcm_chunks, channel)}
+
+        queues = {name: queue.Queue(maxsize=STREAM_QUEUE_CHUNKS) for name in names}
+
+        def _drain(q):
+            while True:
+                chunk = q.get()
+                if chunk is None:
+                    return
+                yield chunk
+
+        futures = {
+            name: self._pool.submit(self.members[name].play_stream, _drain(queues[name]), channel)
+            for name in names
+        }
+        live = set(names)
+        try:
+            for chunk in pcm_chunks:
+                for name in list(live):
+                    try:
+                        queues[name].put(chunk, timeout=STREAM_PUT_TIMEOUT)
+                    except queue.Full:
+                        print(f"⚠️ [Fleet] {name} is not keeping up, dropping it from the stream")
+                        live.discard(name)
+                if not live:
+                    break
+        finally:
+            for name in names:
+                try:
+                    queues[name].put_nowait(None)
+                except queue.Full:
+                    # 放弃的机器人：清掉积压再结束它的上传
+                    while not queues[name].empty():
+                        queues[name].get_nowait()
+                    queues[name].put_nowait(None)
+
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {"status": "error", "msg": str(e)}
+        return results
+
+    # ---------- 状态 ----------
+
+    def describe(self):
+        """机器人与分组列表（供网页选择控制目标）"""
+        return {"robots": list(self.members), "groups": self.groups, "primary": self.primary.name}
+
+    def status(self):
+        with self._clock_lock:
+            clocks = {name: dict(c) for name, c in self._clock.items()}
+        return {
+            name: {
+                "url": client.server_url,
+                "speaking": client.is_speaking(),
+                "channel": client.channel_status(),
+                "breaker": client.breaker.status(),
+                "clock_offset_ms": round(clocks[name]["offset"] * 1000, 1) if clocks[name]["offset"] is not None else None,
+                "clock_rtt_ms": round(clocks[name]["rtt"] * 1000, 1) if clocks[name]["rtt"] is not None else None,
+            }
+            for name, client in self.members.items()
+        }
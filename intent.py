@@ -0,0 +1,122 @@
+import threading
+
+from config import ACTION_MAP, WAKE_WORDS
+from text_utils import normalize_text, pinyin_syllables, pinyin_key, ngram_vector, cosine
+
+# 礼貌用语 / 语气词：匹配前先去掉，避免拉低覆盖率
+FILLER_WORDS = ["请你", "请", "帮我", "给我", "跟我", "和我", "给大家", "麻烦", "可以", "一下", "一个", "个", "吧", "啊", "呀", "哦", "嘛", "了", "你"]
+
+# 出现这些词时说明不是简单指令（提问、否定），交给大模型处理
+NON_COMMAND_WORDS = ["不要", "别", "不用", "吗", "什么", "怎么", "为什么", "会不会", "能不能", "是不是"]
+
+
+class IntentClassifier:
+    """
+    本地意图识别：把 ACTION_MAP 中的同义词建成拼音索引
+    - 关键词命中：去掉唤醒词、语气词后，按整音节子串匹配，置信度 = 命中音节数 / 剩余音节数
+    - 可选相似度：音节 n-gram 余弦相似度，作为关键词未命中时的兜底
+    """
+
+    def __init__(self, action_map=None, wake_words=None, use_embedding=True):
+        self.action_map = action_map or ACTION_MAP
+        self.use_embedding = use_embedding
+        self._strip_keys = sorted(
+            {pinyin_key(w) for w in list(wake_words or WAKE_WORDS) + FILLER_WORDS if pinyin_key(w)},
+            key=len, reverse=True,
+        )
+
+        # 同义词拼音 -> action_id，长的同义词优先匹配
+        self._keyword_index = []
+        self._vectors = []
+        for aid, info in self.action_map.items():
+            for synonym in info["synonyms"]:
+                syllables = pinyin_syllables(synonym)
+                if not syllables:
+                    continue
+                self._keyword_index.append((" ".join(syllables), len(syllables), aid))
+                self._vectors.append((ngram_vector(syllables), aid))
+        self._keyword_index.sort(key=lambda x: x[1], reverse=True)
+
+    def _strip(self, key):
+        padded = f" {key} "
+        for k in self._strip_keys:
+            padded = padded.replace(f" {k} ", " ")
+        return padded.strip()
+
+    def classify(self, text):
+        """
+        :return: (action_id, confidence)，未识别时 action_id 为 None
+        """
+        normalized = normalize_text(text)
+        if not normalized or any(w in normalized for w in NON_COMMAND_WORDS):
+            return None, 0.0
+
+        key = self._strip(pinyin_key(normalized))
+        if not key:
+            return None, 0.0
+        padded = f" {key} "
+
+        total = len(key.split(" "))
+        hits = {}
+        for synonym_key, n, aid in self._keyword_index:
+            if f" {synonym_key} " in padded:
+                hits[aid] = max(hits.get(aid, 0), n)
+
+        if len(hits) == 1:
+            aid, n = next(iter(hits.items()))
+            return aid, min(1.0, n / total)
+        if len(hits) > 1:
+            # 一句话里命中多个动作，不确定用户要哪个
+            return None, 0.0
+
+        if self.use_embedding:
+            vec = ngram_vector(tuple(key.split(" ")))
+            best_aid, best_score = None, 0.0
+            for syn_vec, aid in self._vectors:
+                score = cosine(vec, syn_vec)
+                if score > best_score:
+                    best_aid, best_score = aid, score
+            # 相似度兜底的可信度打个折扣
+            return best_aid, best_score * 0.8
+        return None, 0.0
+
+
+class IntentStats:
+    """快速通道命中率与节省延迟统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.hits = 0
+        self.fast_path_ms = 0.0
+        # 大模型链路的滑动平均延迟（用来估算每次命中节省的时间）
+        self.llm_avg_ms = None
+
+    def record_fast_path(self, hit, elapsed_ms):
+        with self._lock:
+            self.total += 1
+            if hit:
+                self.hits += 1
+                self.fast_path_ms += elapsed_ms
+
+    def record_llm(self, elapsed_ms):
+        with self._lock:
+            if self.llm_avg_ms is None:
+                self.llm_avg_ms = elapsed_ms
+            else:
+                self.llm_avg_ms = 0.8 * self.llm_avg_ms + 0.2 * elapsed_ms
+
+    def snapshot(self):
+        with self._lock:
+            hit_rate = self.hits / self.total if self.total else 0.0
+            saved_ms = 0.0
+            if self.hits and self.llm_avg_ms is not None:
+                saved_ms = self.hits * self.llm_avg_ms - self.fast_path_ms
+            return {
+                "total": self.total,
+                "hits": self.hits,
+                "hit_rate": round(hit_rate, 3),
+                "llm_avg_ms": round(self.llm_avg_ms or 0.0, 1),
+                "latency_saved_ms": round(saved_ms, 1),
+            }
+
@@ -1,27 +1,101 @@
-import threading
 import time
+
+PROCESS_START = time.time()  # 冷启动计时起点
+
+import threading
 import queue
+import itertools
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
-from openai import OpenAI
-from config import LLM_API_KEY, LLM_BASE_URL
-from pypinyin import lazy_pinyin
+from werkzeug.serving import make_server
 # === 配置导入 ===
-from config import WAKE_WORDS,IS_LLM_CHECK
-from robot_client import RobotClient
-from brain import RobotBrain
-from ears import BackgroundEars
+from config import WAKE_WORDS,IS_LLM_CHECK, ACTION_MAP, INTENT_FAST_PATH, INTENT_MIN_CONFIDENCE
+from config import SPECULATIVE_REPLY, SPECULATIVE_MATCH_THRESHOLD, REPLY_BACKEND
+from robot_client import PRIORITY_DIRECTOR, PRIORITY_AUTO
+from intent import IntentStats
+from speculative import SpeculativeReply, SpeculationStats
+from text_utils import pinyin_syllables
+from audio_stream import iter_pcm_16k_mono, iter_file, UnsupportedAudio
+from audio_prep import iter_trim_leading
+from startup import Subsystem, SubsystemUnavailable, start_all
+from recorder import recorder, new_session_dir
+from config import RECORD_SESSIONS, RECORD_DIR, sessionId
+from sessions import SessionManager, SessionBusy
 import os
-# === 初始化核心模块 ===
-robot = RobotClient()
-brain = RobotBrain()
-ears = BackgroundEars()
+
+
+# === 核心模块：后台并行初始化，网页先启动 ===
+# 各模块在自己的初始化线程里才创建，重量级依赖（openai / pypinyin 词典等）推迟到第一次使用
+def _make_robot():
+    from fleet import RobotFleet
+    return RobotFleet()
+
+
+def _make_brain():
+    from brain import RobotBrain
+    return RobotBrain()
+
+
+def _make_ears():
+    from ears import BackgroundEars
+    return BackgroundEars()
+
+
+def _make_intent_classifier():
+    from intent import IntentClassifier
+    return IntentClassifier()
+
+
+robot_sys = Subsystem("robot", _make_robot)
+brain_sys = Subsystem("brain", _make_brain)
+ears_sys = Subsystem("ears", _make_ears)
+intent_sys = Subsystem("intent", _make_intent_classifier)
+SUBSYSTEMS = [robot_sys, brain_sys, ears_sys, intent_sys]
+
+# 代理对象：用法与实例相同，未就绪时访问会抛出 SubsystemUnavailable（接口返回 503）
+fleet = robot_sys.proxy
+robot = robot_sys.proxy_attr("primary")  # 主机器人：自动对话、唤醒回复都由它播报
+brain = brain_sys.proxy
+ears = ears_sys.proxy
+intent_classifier = intent_sys.proxy
+intent_stats = IntentStats()
+speculation_stats = SpeculationStats()
+
+# 冷启动耗时 (ms)：网页可访问 / 全部子系统就绪
+startup_timings = {"web_ms": None, "ready_ms": None}
+
+# 纠错用的大模型客户端，第一次使用时创建
+_client = None
 
 # === Flask Web Server ===
 app = Flask(__name__)
 CORS(app)
-director_queue = queue.Queue()
-current_mode = "auto"
+
+
+def _on_session_evicted(session_id):
+    if brain_sys.ready:
+        brain.drop_session(session_id)
+
+
+# 会话：按机器人 / 操作员 ID 隔离模式、导演队列与对话记忆；默认会话对应本机麦克风和主机器人
+sessions = SessionManager(sessionId, on_evict=_on_session_evicted)
+
+
+@app.errorhandler(SubsystemUnavailable)
+def subsystem_unavailable(e):
+    return jsonify({"status": "starting", "msg": str(e)}), 503
+
+
+@app.errorhandler(SessionBusy)
+def session_busy(e):
+    return jsonify({"status": "busy", "msg": str(e)}), 429
+
+
+def _request_session(data=None):
+    """请求所属的会话：JSON 字段或查询参数 session，缺省为默认会话；ID 是机器人名时默认控制该机器人"""
+    session_id = (data or {}).get('session') or request.args.get('session')
+    target = session_id if session_id and robot_sys.ready and session_id in fleet.members else None
+    return sessions.get(session_id, target)
 
 
 @app.route('/')
@@ -31,81 +105,363 @@ def index():
 
 @app.route('/api/interrupt', methods=['POST'])
 def api_interrupt():
+    data = request.get_json(silent=True) or {}
+    if data.get('session') or request.args.get('session'):
+        # 只打断指定会话：它的回复流和它控制的机器人
+        session = _request_session(data)
+        if session is sessions.default:
+            ears.clear_queue()
+        brain.cancel_all(session.id)
+        fleet.stop_all(_resolve_target(None, session))
+        return jsonify({"status": "stopped", "session": session.id})
     ears.clear_queue()
-    robot.stop_all()
+    # 立即关闭进行中的回复流，避免打断后连接和服务端生成继续跑
+    brain.cancel_all()
+    fleet.stop_all()
     return jsonify({"status": "stopped"})
 
 
 @app.route('/api/set_mode', methods=['POST'])
 def set_mode():
-    global current_mode
     data = request.json
     mode = data.get('mode')
     if mode in ['auto', 'director']:
-        current_mode = mode
-        ears.clear_queue()
-        return jsonify({"status": "success", "mode": mode})
+        session = _request_session(data)
+        session.mode = mode
+        if session is sessions.default and ears_sys.ready:
+            ears.clear_queue()
+        return jsonify({"status": "success", "mode": mode, "session": session.id})
     return jsonify({"status": "error"}), 400
 
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    return jsonify({"mode": current_mode, "is_replying": robot.is_speaking()})
+    # 未就绪的子系统对应字段为 None，状态接口本身不等待初始化
+    return jsonify({
+        "mode": sessions.default.mode,
+        "startup": {
+            **startup_timings,
+            "subsystems": {sub.name: sub.status() for sub in SUBSYSTEMS},
+        },
+        "is_replying": robot.is_speaking() if robot_sys.ready else False,
+        "intent": intent_stats.snapshot(),
+        "cache": brain.response_cache.stats() if brain_sys.ready and brain.response_cache else None,
+        "speculation": speculation_stats.snapshot(),
+        "streams": brain.stream_stats() if brain_sys.ready else None,
+        "channel": robot.channel_status() if robot_sys.ready else None,
+        "breaker": robot.breaker.status() if robot_sys.ready else None,
+        "fleet": fleet.status() if robot_sys.ready else None,
+        "sessions": sessions.status(),
+    })
+
+
+@app.route('/api/fleet', methods=['GET'])
+def get_fleet():
+    return jsonify(fleet.describe())
+
+
+def _resolve_target(target, session):
+    """
+    网页传来的控制目标（机器人 / 分组 / all）-> 名称列表，未知目标返回 None
+    没有指定时用会话自己的目标，再没有就是主机器人；“全部”必须显式传 all，避免一个会话影响其他会话的机器人
+    """
+    try:
+        return fleet.resolve(target or session.target or fleet.primary.name)
+    except ValueError:
+        return None
 
 
 @app.route('/api/director/speak', methods=['POST'])
 def director_speak():
-    text = request.json.get('text')
-    director_queue.put(('speak', text))
-    return jsonify({"status": "queued"})
+    data = request.json
+    text = data.get('text')
+    session = _request_session(data)
+    names = _resolve_target(data.get('target'), session)
+    if names is None:
+        return jsonify({"status": "error", "msg": f"Unknown target: {data.get('target')}"}), 400
+    # 导演语音直接进入最高优先级队列，抢占正在播报的自动回复，无需等主循环轮询
+    # 只依赖机器人子系统：ears / brain 还在初始化时跳过相关步骤，启动期间也能直接喊话
+    if session is sessions.default and ears_sys.ready:
+        ears.clear_queue()
+    # 被抢占的自动回复整体作废：关闭回复流，并让正在消费它的循环停止入队剩余句子
+    session.reply_generation += 1
+    if brain_sys.ready:
+        brain.cancel_all(session.id)
+        brain.update_history("assistant", text, session.id)
+    fleet.speak(text, PRIORITY_DIRECTOR, names)
+    return jsonify({"status": "queued", "targets": names})
 
 
 @app.route('/api/director/action', methods=['POST'])
 def director_action():
-    data = request.json
-    director_queue.put(('action', data))
-    return jsonify({"status": "queued"})
+    data = dict(request.json)
+    session = _request_session(data)
+    data.pop('session', None)
+    names = _resolve_target(data.pop('target', None), session)
+    if names is None:
+        return jsonify({"status": "error", "msg": "Unknown target"}), 400
+    session.director_queue.put(('action', data, names, session))
+    return jsonify({"status": "queued", "targets": names})
+
+
+@app.route('/api/director/upload_play', methods=['POST'])
+def director_upload_play():
+    """
+    上传音频并播放：边接收边转换（16k 单声道）边转发给机器人，不落盘
+    支持原始请求体（推荐，Content-Type 为音频类型）和 multipart 表单字段 "file"
+    控制目标通过查询参数 ?target= 指定（请求体是音频本身）
+    ?channel=music / speech / effects 时在机器人端混音播放（例如背景音乐），不打断其他声音
+    """
+    session = _request_session()
+    names = _resolve_target(request.args.get('target'), session)
+    if names is None:
+        return jsonify({"status": "error", "msg": "Unknown target"}), 400
+    if request.mimetype == 'multipart/form-data':
+        # 注意：multipart 上传由 werkzeug 解析，较大的文件会先缓存到临时文件
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({"status": "error", "msg": "No file part"}), 400
+        source = iter_file(upload.stream)
+    else:
+        source = iter_file(request.stream)
+
+    # 流式播放只裁掉开头的静音（减少等待），结尾与响度需要完整文件，不在这里处理
+    pcm = iter_trim_leading(iter_pcm_16k_mono(source))
+    try:
+        # 先转换出第一块：格式不支持时在开始播放前就能返回错误
+        first = next(pcm, b"")
+    except UnsupportedAudio as e:
+        return jsonify({"status": "error", "msg": str(e)}), 415
+    if not first:
+        return jsonify({"status": "error", "msg": "Empty audio"}), 400
+
+    try:
+        results = fleet.play_stream(itertools.chain([first], pcm), names, request.args.get('channel'))
+    except UnsupportedAudio as e:
+        return jsonify({"status": "error", "msg": str(e)}), 415
+    except Exception as e:
+        return jsonify({"status": "error", "msg": str(e)}), 502
+    if all(result is None for result in results.values()):
+        return jsonify({"status": "error", "msg": "Robot server has no /cmd/play_stream"}), 501
+    if len(results) == 1:
+        return jsonify(next(iter(results.values())))
+    return jsonify({"status": "done", "results": results})
+
+@app.route('/api/director/velocity', methods=['POST'])
+def director_velocity():
+    # 遥控行走：直接转发最新速度，不经过导演队列（排队会放大延迟）
+    data = request.json or {}
+    names = _resolve_target(data.get('target'), _request_session(data))
+    if names is None:
+        return jsonify({"status": "error", "msg": "Unknown target"}), 400
+    fleet.set_velocity(data.get('vx', 0.0), data.get('vy', 0.0), data.get('vyaw', 0.0), names)
+    return jsonify({"status": "ok"})
+
+
+@app.route('/api/chat', methods=['POST'])
+def api_chat():
+    """
+    其他展台 / 机器人的对话入口：{"session": ID, "text": 识别结果, "target": 可选}
+    回复在共用线程池里生成，按句交给会话的控制目标播报；同一会话的新问题会打断它未说完的回复
+    """
+    data = request.json or {}
+    text = (data.get('text') or "").strip()
+    if not text:
+        return jsonify({"status": "error", "msg": "Empty text"}), 400
+    session = _request_session(data)
+    names = _resolve_target(data.get('target'), session)
+    if names is None:
+        return jsonify({"status": "error", "msg": "Unknown target"}), 400
+    # 新问题作废上一轮：关闭回复流、停止入队剩余句子，并丢弃已在机器人队列里等着说的自动回复
+    session.reply_generation += 1
+    brain.cancel_all(session.id)
+    fleet.drop_speech(PRIORITY_AUTO, names)
+    sessions.submit(session, session_reply, session, text, names)
+    return jsonify({"status": "queued", "session": session.id, "targets": names}), 202
 
 
 def run_flask():
-    app.run(host='0.0.0.0', port=5000, use_reloader=False)
+    server = make_server('0.0.0.0', 5000, app, threaded=True)
+    startup_timings["web_ms"] = round((time.time() - PROCESS_START) * 1000, 1)
+    print(f"🌐 [Startup] Web panel listening on :5000 ({startup_timings['web_ms']:.0f} ms)")
+    server.serve_forever()
+
+
+def get_correction_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key="XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+                         base_url="https://api.rcouyi.com/v1")
+    return _client
+
+
+def wait_for_subsystems():
+    """等待全部子系统初始化结束，记录冷启动总耗时"""
+    for sub in SUBSYSTEMS:
+        sub.wait()
+    startup_timings["ready_ms"] = round((time.time() - PROCESS_START) * 1000, 1)
+    failed = [sub.name for sub in SUBSYSTEMS if not sub.ready]
+    print(f"🚀 [Startup] Subsystems settled in {startup_timings['ready_ms']:.0f} ms"
+          + (f" (failed: {', '.join(failed)})" if failed else ""))
+
+
+def dispatch_action(action_id):
+    """按 ACTION_MAP 的 ID 异步下发动作，不阻塞说话"""
+    info = ACTION_MAP[action_id]
+    action = {"group": info["group"], "name": info["name"]}
+    threading.Thread(target=robot.perform_action, args=(action,), daemon=True).start()
+
+
+def session_reply(session, text, names):
+    """在共用线程池里为一个会话生成回复，按句交给它的控制目标播报"""
+    recorder.record("chat", session=session.id, text=text)
+
+    def _on_action(action_id):
+        info = ACTION_MAP[action_id]
+        action = {"group": info["group"], "name": info["name"]}
+        threading.Thread(target=fleet.perform_action, args=(action, names), daemon=True).start()
+
+    generation = session.reply_generation
+    # 新一轮：清除这些机器人上一轮的打断标记，否则句首的内嵌动作会被丢弃
+    for name in names:
+        fleet.members[name].begin_turn()
+    reply_generator = brain.get_chat_reply(text, session_id=session.id, on_action=_on_action)
+    try:
+        for sentence in reply_generator:
+            if session.reply_generation != generation:
+                break
+            if sentence:
+                fleet.speak(sentence, PRIORITY_AUTO, names)
+    finally:
+        reply_generator.close()
+
+
+def next_director_task():
+    """依次检查各会话的导演队列，取出一条指令；都为空时返回 None"""
+    for session in sessions.sessions():
+        try:
+            return session.director_queue.get_nowait()
+        except queue.Empty:
+            pass
+    return None
+
+
+def try_fast_action(user_text):
+    """
+    本地意图快速通道：高置信度的简单动作指令直接下发 /cmd/action
+    :return: 是否已处理（已处理则不再请求大模型）
+    """
+    start = time.time()
+    action_id, confidence = intent_classifier.classify(user_text)
+    hit = action_id is not None and confidence >= INTENT_MIN_CONFIDENCE
+    intent_stats.record_fast_path(hit, (time.time() - start) * 1000)
+    recorder.record("intent", text=user_text, action_id=action_id, confidence=round(confidence, 3), hit=hit)
+    if not hit:
+        return False
+
+    print(f"⚡ [Intent] '{user_text}' -> {ACTION_MAP[action_id]['name']} (confidence: {confidence:.2f})")
+    dispatch_action(action_id)
+    return True
+
+
+def is_wake_text(text):
+    """唤醒词匹配：转为拼音比较，容忍同音字识别错误"""
+    text_pinyin = "".join(pinyin_syllables(text))
+    return any("".join(pinyin_syllables(kw)) in text_pinyin for kw in WAKE_WORDS)
+
+
+def update_speculation(speculation, partial):
+    """
+    收到稳定的部分识别结果且包含唤醒词时，提前发起回复请求
+    已有推测请求且文本相近时保持不变，否则取消旧的、重新发起
+    """
+    if not partial:
+        return speculation
+    _, text, stable = partial
+    if not stable or not is_wake_text(text):
+        return speculation
+    if speculation is not None:
+        if speculation.matches(text, SPECULATIVE_MATCH_THRESHOLD):
+            return speculation
+        speculation = drop_speculation(speculation)
+
+    print(f"🔮 [Speculative] Prefetch reply for partial: {text}")
+    speculation_stats.record_start()
+    return SpeculativeReply(brain, text)
+
+
+def drop_speculation(speculation):
+    """取消未被采纳的推测请求（计入浪费）"""
+    if speculation is not None:
+        speculation.cancel()
+        speculation_stats.record_waste()
+    return None
 
 
 # === 核心逻辑：主循环 ===
 def main_loop():
+    wait_for_subsystems()
     ears.start()
+    sessions.start()
+    speculation = None
     while True:
         # 1. 检查网页指令 (最高优先级)
-        try:
-            web_task = director_queue.get_nowait()
-            ears.clear_queue()
-            if web_task[0] == 'speak':
-                brain.update_history("assistant", web_task[1])
-                robot.speak(web_task[1])
-            elif web_task[0] == 'action':
-                threading.Thread(target=robot.perform_action, args=(web_task[1],)).start()
+        web_task = next_director_task()
+        if web_task is not None:
+            # 只有默认会话的指令才清空本机麦克风的待处理语音，远程会话的操作不影响本地对话
+            if web_task[3] is sessions.default:
+                ears.clear_queue()
+            if web_task[0] == 'action':
+                threading.Thread(target=fleet.perform_action, args=(web_task[1], web_task[2])).start()
             continue
-        except queue.Empty:
-            pass
 
-        # 2. 检查语音缓存 (Auto Mode)
-        if current_mode == "auto":
+        # 2. 检查语音缓存 (Auto Mode，本机麦克风属于默认会话)
+        if sessions.default.mode == "auto":
             if robot.is_speaking():
                 ears.clear_queue()
                 time.sleep(0.1)
                 continue
 
+            # 推测式回复：根据部分识别结果提前请求（外部接口的上下文在服务端，推测请求会写进去，只用于 llm）
+            if SPECULATIVE_REPLY and REPLY_BACKEND == "llm":
+                speculation = update_speculation(speculation, ears.get_partial())
+
             user_text = ears.get_latest_text()
 
             if user_text:
-                user_pinyin = "".join(lazy_pinyin(user_text))
+                final_text_time = time.time()
 
                 # 2. 遍历唤醒词，同样转为拼音进行匹配
-                is_woken_up = any("".join(lazy_pinyin(kw)) in user_pinyin for kw in WAKE_WORDS)
+                is_woken_up = is_wake_text(user_text)
+                recorder.record("wake", text=user_text, woken=is_woken_up)
+
+                if not is_woken_up:
+                    speculation = drop_speculation(speculation)
 
                 if is_woken_up:
+                    # 新一轮：上一轮的打断不应影响本轮的快速动作和内嵌动作
+                    robot.begin_turn()
+                    if INTENT_FAST_PATH and try_fast_action(user_text):
+                        speculation = drop_speculation(speculation)
+                        continue
+
                     try:
-                        if IS_LLM_CHECK == True:
+                        llm_start_time = time.time()
+                        generation = sessions.default.reply_generation
+                        if speculation is not None and speculation.matches(user_text, SPECULATIVE_MATCH_THRESHOLD):
+                            # 推测请求基于未纠错的部分文本发出，采纳时不再走 IS_LLM_CHECK 纠错
+                            print(f"🔮 [Speculative] Adopted: '{speculation.text}' ~ '{user_text}'")
+                            speculation_stats.record_adopt()
+                            reply_kind = "speculative"
+                            reply_generator = speculation.adopt(user_text, on_action=dispatch_action)
+                            speculation = None
+                        else:
+                            speculation = drop_speculation(speculation)
+                            reply_kind = "normal"
+                            reply_generator = None
+
+                        if reply_generator is None and IS_LLM_CHECK == True:
                             try:
                                 # 1. 构建符合 OpenAI 标准的消息格式
                                 # 建议将提示词放入 system 角色，用户语音放入 user 角色
@@ -115,30 +471,49 @@ def main_loop():
                                 ]
 
                                 # 2. 调用 API
-                                response = _client.chat.completions.create(
+                                response = get_correction_client().chat.completions.create(
                                     model="gpt-4o",
                                     messages=messages_payload,  # 这里传入列表，而不是字符串
                                     temperature=0.7,
                                 )
 
                                 # 3. 更新 user_text
-                                user_text = response.choices[0].message.content.strip()
+                                corrected = response.choices[0].message.content.strip()
+                                recorder.record("correction", source=user_text, text=corrected,
+                                                ms=round((time.time() - llm_start_time) * 1000, 1))
+                                user_text = corrected
                                 print("修正后的句子：", user_text)
 
                             except Exception as e:
                                 print(f"❌ LLM API Error: {str(e)}")
                                 pass
 
-                        reply_generator = brain.get_chat_reply(user_text)
+                        # 回复中内嵌的动作与语音在同一轮并行执行
+                        if reply_generator is None:
+                            reply_generator = brain.get_chat_reply(user_text, on_action=dispatch_action)
 
+                        first_sentence = True
                         for sentence in reply_generator:
                             if not sentence: continue
 
+                            if first_sentence:
+                                first_sentence = False
+                                speculation_stats.record_ttfs(reply_kind, (time.time() - final_text_time) * 1000)
+                                if reply_kind == "normal":
+                                    # 记录大模型链路首句延迟，用于估算快速通道节省的时间
+                                    intent_stats.record_llm((time.time() - llm_start_time) * 1000)
+
                             if robot.interrupt_event.is_set():
                                 break
+                            if sessions.default.reply_generation != generation:
+                                # 导演插话抢占了本轮回复，剩余句子不再播报
+                                break
 
                             robot.speak(sentence)
 
+                        # 被打断时立刻关闭生成器，释放底层连接
+                        reply_generator.close()
+
                     except Exception:
                         pass
 
@@ -146,10 +521,12 @@ def main_loop():
 
 
 if __name__ == "__main__":
-    _client = OpenAI(api_key="XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
-                     base_url="https://api.rcouyi.com/v1")
+    # 网页先起来，子系统在后台并行初始化
     t_flask = threading.Thread(target=run_flask, daemon=True)
     t_flask.start()
+    if RECORD_SESSIONS:
+        recorder.open(new_session_dir(RECORD_DIR))
+    start_all(SUBSYSTEMS)
     try:
         main_loop()
     except KeyboardInterrupt:
@@ -0,0 +1,152 @@
+import re
+import threading
+from collections import deque
+
+# 可选：安装了 tiktoken 时使用精确计数，否则按字符估算
+try:
+    import tiktoken
+
+    _ENCODER = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODER = None
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+# 每条消息的固定开销 (role、分隔符等)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """估算文本的 token 数：中文约 1 字 1 token，其他字符约 4 个 1 token"""
+    if not text:
+        return 0
+    if _ENCODER is not None:
+        return len(_ENCODER.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ConversationMemory:
+    """
+    单个会话的对话记忆
+    - deque 环形缓冲，追加/淘汰均为 O(1)
+    - 每条消息入队时计算一次 token 数并缓存
+    - 同时受 max_turns（消息条数）与 max_tokens（token 总数）约束
+    - 可选 summarizer：被淘汰的旧消息在后台压缩成一段摘要
+    """
+
+    def __init__(self, max_tokens=1200, max_turns=20, summarizer=None, summary_max_tokens=200):
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.summarizer = summarizer
+        self.summary_max_tokens = summary_max_tokens
+
+        self._items = deque()  # (message, tokens)
+        self._total_tokens = 0
+        self._lock = threading.Lock()
+
+        self.summary = ""
+        self._evicted = []
+        self._summarizing = False
+
+    def add(self, role, content):
+        if not content:
+            return
+        tokens = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        with self._lock:
+            self._items.append(({"role": role, "content": content}, tokens))
+            self._total_tokens += tokens
+            while self._items and (len(self._items) > self.max_turns or self._total_tokens > self.max_tokens):
+                message, old_tokens = self._items.popleft()
+                self._total_tokens -= old_tokens
+                if self.summarizer:
+                    self._evicted.append(message)
+        self._maybe_summarize()
+
+    def messages(self):
+        """全部记忆（按时间顺序）"""
+        with self._lock:
+            return [m for m, _ in self._items]
+
+    def context(self, budget=None):
+        """
+        组装上下文：从最新的消息往前取，直到用完 token 预算
+        有摘要时放在最前面（作为 system 消息）
+        """
+        budget = self.max_tokens if budget is None else budget
+        picked = []
+        with self._lock:
+            summary = self.summary
+            if summary:
+                budget -= estimate_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+            for message, tokens in reversed(self._items):
+                if tokens > budget:
+                    break
+                picked.append(message)
+                budget -= tokens
+        picked.reverse()
+        if summary:
+            picked.insert(0, {"role": "system", "content": f"【之前的对话摘要】{summary}"})
+        return picked
+
+    def total_tokens(self):
+        with self._lock:
+            return self._total_tokens
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._total_tokens = 0
+            self._evicted = []
+            self.summary = ""
+
+    def _maybe_summarize(self):
+        """淘汰的消息攒够一轮后，在后台线程里生成摘要，不阻塞调用方"""
+        with self._lock:
+            if self._summarizing or len(self._evicted) < 2:
+                return
+            evicted, self._evicted = self._evicted, []
+            previous = self.summary
+            self._summarizing = True
+
+        def _worker():
+            try:
+                summary = self.summarizer(previous, evicted)
+                if summary:
+                    # 摘要本身也要受预算约束
+                    while estimate_tokens(summary) > self.summary_max_tokens:
+                        summary = summary[len(summary) // 4:]
+                    with self._lock:
+                        self.summary = summary
+            except Exception as e:
+                print(f"⚠️ Memory summarize failed: {e}")
+            finally:
+                with self._lock:
+                    self._summarizing = False
+
+        threading.Thread(target=_worker, daemon=True).start()
+
+
+class MemoryStore:
+    """按会话 ID 隔离的记忆集合"""
+
+    def __init__(self, **memory_kwargs):
+        self._memory_kwargs = memory_kwargs
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            memory = self._sessions.get(session_id)
+            if memory is None:
+                memory = ConversationMemory(**self._memory_kwargs)
+                self._sessions[session_id] = memory
+            return memory
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def session_ids(self):
+        with self._lock:
+            return list(self._sessions)
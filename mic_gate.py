@@ -0,0 +1,79 @@
+import sys
+import threading
+
+from config import MIC_GATE_MODE
+
+
+class MicGate:
+    """
+    麦克风输入闸门（机器人说话时屏蔽自己的声音）
+    - 软件闸门：任何平台都可用，BackgroundEars 在静音期间直接丢弃采集到的音频帧
+    - 系统静音：仅 Windows，按线程缓存 pycaw 的设备接口，只在第一次调用时枚举设备
+    - mute/unmute 成对调用并计数：多台机器人同时说话时，全部说完才恢复
+    mode: "auto"（Windows 上同时使用系统静音）/ "software" / "os"
+    """
+
+    def __init__(self, mode="auto"):
+        self.mode = mode
+        self.use_os_mute = mode == "os" or (mode == "auto" and sys.platform == "win32")
+        self._muted = False
+        self._holds = 0
+        self._lock = threading.Lock()
+        # COM 接口不能跨线程使用，按线程缓存
+        self._local = threading.local()
+
+    def is_muted(self):
+        return self._muted
+
+    def mute(self):
+        with self._lock:
+            self._holds += 1
+        self.set_muted(True)
+
+    def unmute(self):
+        with self._lock:
+            self._holds = max(0, self._holds - 1)
+            holds = self._holds
+        if holds == 0:
+            self.set_muted(False)
+
+    def set_muted(self, muted):
+        with self._lock:
+            if muted == self._muted:
+                return
+            self._muted = muted
+        if self.use_os_mute:
+            self._set_os_mute(muted)
+
+    def _endpoint_volume(self):
+        volume = getattr(self._local, "volume", None)
+        if volume is None:
+            # 延迟导入：非 Windows 环境不需要安装 pycaw / comtypes
+            from comtypes import CLSCTX_ALL
+            from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+
+            # 注意：GetMicrophone() 需要较新版本的 pycaw
+            device = AudioUtilities.GetMicrophone()
+            interface = device.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+            volume = interface.QueryInterface(IAudioEndpointVolume)
+            self._local.volume = volume
+        return volume
+
+    def _set_os_mute(self, muted):
+        for attempt in range(2):
+            try:
+                self._endpoint_volume().SetMute(muted, None)
+                return
+            except ImportError as e:
+                print(f"⚠️ pycaw 不可用，改用软件静音: {e}")
+                self.use_os_mute = False
+                return
+            except Exception as e:
+                # 设备被拔出/切换后缓存的接口失效，重新获取一次
+                self._local.volume = None
+                if attempt:
+                    print(f"⚠️ 麦克风控制失败: {e}")
+
+
+# 进程内共享：RobotClient 负责开关，BackgroundEars 负责丢帧
+mic_gate = MicGate(MIC_GATE_MODE)
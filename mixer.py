@@ -0,0 +1,313 @@
+import time
+import threading
+
+import numpy as np
+
+# 16k 单声道 16bit PCM（VoicePlayer 的输入格式）
+SAMPLE_RATE = 16000
+BLOCK_SAMPLES = 1600           # 每次混音 100ms（= wav.CHUNK_SIZE 字节）
+CHANNEL_BUFFER_SECONDS = 5     # 每个通道的缓冲时长，写满后阻塞写入方（上传流随之减速）
+LEAD_SECONDS = 0.2             # 发送进度领先实际播放的时间，保持机器人缓冲区充盈
+
+# 通道名称与默认增益
+MIX_CHANNELS = {"music": 0.6, "speech": 1.0, "effects": 0.8}
+
+# 闪避（ducking）：speech 通道有声音时把 music 压低
+DUCK_GAIN = 0.25               # 闪避时 music 的增益倍数
+DUCK_ATTACK = 0.05             # 压低所用时间 (秒)
+DUCK_RELEASE = 0.5             # 恢复所用时间 (秒)
+
+
+class _Channel:
+    """单个混音通道：预分配的 int16 环形缓冲区"""
+
+    def __init__(self, name, gain, capacity):
+        self.name = name
+        self.gain = gain
+        self.capacity = capacity
+        self.buf = np.zeros(capacity, dtype=np.int16)
+        self.read_pos = 0
+        self.size = 0
+        # clear() 时 +1，正在写入的一方据此放弃剩余数据
+        self.generation = 0
+        self.cond = threading.Condition()
+
+    def write(self, samples, should_stop=None):
+        """写入 int16 样本，缓冲区满时等待；被清空或 should_stop 时返回已写入的样本数"""
+        written = 0
+        with self.cond:
+            generation = self.generation
+            while written < len(samples):
+                while self.size == self.capacity:
+                    self.cond.wait(0.1)
+                    if generation != self.generation or (should_stop is not None and should_stop()):
+                        return written
+                if generation != self.generation:
+                    return written
+                n = min(len(samples) - written, self.capacity - self.size)
+                start = (self.read_pos + self.size) % self.capacity
+                first = min(n, self.capacity - start)
+                self.buf[start:start + first] = samples[written:written + first]
+                self.buf[:n - first] = samples[written + first:written + n]
+                self.size += n
+                written += n
+        return written
+
+    def read_into(self, out):
+        """读出最多 len(out) 个样本到 out（float32），不足部分补 0，返回实际样本数"""
+        with self.cond:
+            n = min(self.size, len(out))
+            first = min(n, self.capacity - self.read_pos)
+            out[:first] = self.buf[self.read_pos:self.read_pos + first]
+            out[first:n] = self.buf[:n - first]
+            self.read_pos = (self.read_pos + n) % self.capacity
+            self.size -= n
+            if n:
+                self.cond.notify_all()
+        out[n:] = 0
+        return n
+
+    def clear(self):
+        with self.cond:
+            self.generation += 1
+            self.size = 0
+            self.cond.notify_all()
+
+    def wait_empty(self, timeout=None, should_stop=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.size:
+                if should_stop is not None and should_stop():
+                    return False
+                remaining = 0.1 if deadline is None else min(0.1, deadline - time.time())
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+
+class AudioMixer:
+    """
+    实时混音器（NumPy）：多个命名通道逐块混合后送给 VoicePlayer
+    - 每个通道一个预分配的环形缓冲区，混音过程不分配新的数组（除了最终交给 SDK 的 bytes）
+    - 每个通道独立增益；speech 通道有声音（或 duck_for 期间）时 music 自动闪避，增益按块内斜坡平滑变化
+    - 所有通道都为空时不发送任何数据（不占用机器人扬声器）
+    - pause/resume 成对调用并计数：抢占式播放期间暂停输出，通道内容保留，写入方按缓冲区满等待
+    """
+
+    def __init__(self, send, channels=None, block_samples=BLOCK_SAMPLES,
+                 buffer_seconds=CHANNEL_BUFFER_SECONDS, lead=LEAD_SECONDS, on_underrun=None,
+                 duck_gain=DUCK_GAIN, attack=DUCK_ATTACK, release=DUCK_RELEASE):
+        """
+        :param send: fn(bytes)，把混好的 PCM 块交给机器人（例如 VoicePlayer）
+        :param channels: {name: 默认增益}，默认 MIX_CHANNELS
+        :param on_underrun: 发送落后于播放（缓冲区放空）时的回调，参数为落后的秒数
+        """
+        self.send = send
+        self.block_samples = block_samples
+        self.lead = lead
+        self.on_underrun = on_underrun
+        self.duck_gain = duck_gain
+        self.attack = attack
+        self.release = release
+
+        capacity = int(buffer_seconds * SAMPLE_RATE)
+        self.channels = {name: _Channel(name, gain, capacity) for name, gain in (channels or MIX_CHANNELS).items()}
+
+        # 预分配的工作缓冲区
+        self._mix = np.zeros(block_samples, dtype=np.float32)
+        self._scratch = np.zeros(block_samples, dtype=np.float32)
+        self._envelope = np.zeros(block_samples, dtype=np.float32)
+        self._ramp = np.arange(1, block_samples + 1, dtype=np.float32) / block_samples
+        self._out = np.zeros(block_samples, dtype=np.int16)
+
+        self._duck = 1.0          # 当前 music 的闪避增益
+        self._duck_until = 0.0    # duck_for() 设置的闪避截止时间
+        self._wake = threading.Event()
+        self._pauses = 0
+        self._pause_lock = threading.Lock()
+        self._running = False
+        self.stats = {"blocks": 0, "underruns": 0}
+
+    # ---------- 控制接口 ----------
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            threading.Thread(target=self._loop, name="audio-mixer", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+    def pause(self):
+        """暂停输出（其他音频独占扬声器期间）；正在发送的一块送完后才返回"""
+        with self._pause_lock:
+            self._pauses += 1
+
+    def resume(self):
+        with self._pause_lock:
+            self._pauses = max(0, self._pauses - 1)
+        self._wake.set()
+
+    def is_paused(self):
+        return self._pauses > 0
+
+    def channel(self, name):
+        """:raises ValueError: 未知通道"""
+        if name not in self.channels:
+            raise ValueError(f"Unknown mixer channel: {name} (available: {', '.join(self.channels)})")
+        return self.channels[name]
+
+    def set_gain(self, name, gain):
+        self.channel(name).gain = max(0.0, float(gain))
+
+    def duck_for(self, seconds):
+        """在 speech 通道之外发声时（例如 TTS）手动闪避一段时间"""
+        self._duck_until = max(self._duck_until, time.time() + seconds)
+
+    def clear(self, name=None):
+        """清空一个通道（默认全部），正在写入该通道的一方随即结束"""
+        for channel in ([self.channel(name)] if name else self.channels.values()):
+            channel.clear()
+
+    def play(self, name, chunks, should_stop=None, wait=True):
+        """
+        把 PCM 块（bytes，任意大小）写入通道，缓冲区满时阻塞（对上传流形成背压）
+        :param wait: 写完后是否等待该通道播放完
+        :return: 写入的字节数
+        """
+        channel = self.channel(name)
+        generation = channel.generation
+        written = 0
+        pending = b""
+        for data in chunks:
+            pending += data
+            usable = len(pending) - len(pending) % 2
+            if not usable:
+                continue
+            samples = np.frombuffer(pending[:usable], dtype=np.int16)
+            pending = pending[usable:]
+            self._wake.set()
+            n = channel.write(samples, should_stop)
+            written += n * 2
+            if n < len(samples) or generation != channel.generation:
+                return written
+        if wait:
+            channel.wait_empty(should_stop=should_stop)
+        return written
+
+    def status(self):
+        return {
+            "channels": {
+                name: {"gain": ch.gain, "buffered_s": round(ch.size / SAMPLE_RATE, 2)}
+                for name, ch in self.channels.items()
+            },
+            "duck": round(self._duck, 2),
+            "paused": self.is_paused(),
+            **self.stats,
+        }
+
+    # ---------- 混音 ----------
+
+    def _ducking(self):
+        speech = self.channels.get("speech")
+        return time.time() < self._duck_until or (speech is not None and speech.size > 0)
+
+    def mix_block(self):
+        """
+        混合一块音频到 self._out
+        :return: 有效样本数（各通道中最长的一段），全部为空时返回 0
+        """
+        block_seconds = self.block_samples / SAMPLE_RATE
+        target = self.duck_gain if self._ducking() else 1.0
+        previous = self._duck
+        if target < previous:
+            step = (1.0 - self.duck_gain) * block_seconds / self.attack
+            self._duck = max(target, previous - step)
+        elif target > previous:
+            step = (1.0 - self.duck_gain) * block_seconds / self.release
+            self._duck = min(target, previous + step)
+        # 块内从上一块的增益线性过渡到本块的增益，避免增益跳变产生爆音
+        np.multiply(self._ramp, self._duck - previous, out=self._envelope)
+        self._envelope += previous
+
+        self._mix.fill(0)
+        produced = 0
+        for name, channel in self.channels.items():
+            n = channel.read_into(self._scratch)
+            if not n:
+                continue
+            produced = max(produced, n)
+            self._scratch *= channel.gain
+            if name == "music":
+                self._scratch *= self._envelope
+            self._mix += self._scratch
+
+        if produced:
+            np.clip(self._mix, -32768, 32767, out=self._mix)
+            np.copyto(self._out, self._mix, casting="unsafe")
+            self.stats["blocks"] += 1
+        return produced
+
+    def _loop(self):
+        start_time = None
+        sent = 0
+        while self._running:
+            # 暂停检查与发送在同一把锁内：pause() 返回后不会再有块送出
+            with self._pause_lock:
+                if self._pauses:
+                    # 暂停期间不算断流：恢复后重新计时
+                    start_time = None
+                    n = 0
+                else:
+                    n = self.mix_block()
+                    if not n:
+                        # 已发送的音频播完后才算空闲（下次有数据时重新计时）；
+                        # 写入方只是暂时没跟上时保留计时基准，否则会以远超实时的速度发送
+                        if start_time is not None and time.time() - start_time > sent / SAMPLE_RATE:
+                            start_time = None
+                    else:
+                        now = time.time()
+                        if start_time is None:
+                            start_time, sent = now, 0
+                        lag = (now - start_time) - sent / SAMPLE_RATE
+                        if sent and lag > 0:
+                            self.stats["underruns"] += 1
+                            if self.on_underrun is not None:
+                                self.on_underrun(lag)
+                            start_time += lag
+
+                        try:
+                            self.send(self._out[:n].tobytes())
+                        except Exception as e:
+                            print(f"[Mixer] send failed: {e}")
+                        sent += n
+            if not n:
+                self._wake.wait(0.05)
+                self._wake.clear()
+                continue
+
+            ahead = sent / SAMPLE_RATE - (time.time() - start_time)
+            if ahead > self.lead:
+                time.sleep(ahead - self.lead)
+
+
+if __name__ == "__main__":
+    # 基准测试：三个通道满载混音（含闪避）的 CPU 开销，不做实时节拍
+    seconds = 60
+    mixer = AudioMixer(send=lambda data: None, buffer_seconds=seconds)
+    rng = np.random.default_rng(0)
+    for name in mixer.channels:
+        mixer.channel(name).write(rng.integers(-8000, 8000, seconds * SAMPLE_RATE, dtype=np.int16))
+
+    started = time.process_time()
+    blocks = 0
+    while mixer.mix_block():
+        mixer.send(mixer._out.tobytes())
+        blocks += 1
+    cpu = time.process_time() - started
+    audio_seconds = blocks * mixer.block_samples / SAMPLE_RATE
+    print(f"Mixed {audio_seconds:.0f}s of audio x {len(mixer.channels)} channels in {cpu * 1000:.1f} ms CPU "
+          f"({cpu / audio_seconds * 1000:.3f} ms per audio second, final duck gain {mixer._duck:.2f})")
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import queue
+import threading
+
+EVENTS_FILE = "events.jsonl"
+AUDIO_FILE = "audio.pcm"    # 16k 单声道 16bit，所有句子首尾相接，事件里记录 [offset, length]
+
+
+class Recorder:
+    """
+    对话录制（只追加写入，供 replay.py 离线回放）
+    - 事件：{"t": 相对开始的秒数, "kind": ..., ...}，一行一个 JSON
+    - 音频：句子的 PCM 依次追加到 audio.pcm，事件中只记录偏移和长度
+    - record() 只把事件放进队列，文件写入在后台线程中完成，不拖慢采集 / 回复链路
+    未开启（directory 为 None）时所有调用直接返回
+    """
+
+    def __init__(self, directory=None):
+        self.directory = None
+        self.started_at = None
+        self._queue = None
+        self._audio_size = 0
+        self._lock = threading.Lock()
+        self.last_event_at = None
+        if directory:
+            self.open(directory)
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def open(self, directory):
+        """开始录制到 directory（应为新目录：事件时间从本次 open 算起）"""
+        self.close()
+        os.makedirs(directory, exist_ok=True)
+        audio_path = os.path.join(directory, AUDIO_FILE)
+        self._audio_size = os.path.getsize(audio_path) if os.path.exists(audio_path) else 0
+        self._queue = queue.Queue()
+        self.started_at = time.time()
+        self.directory = directory
+        threading.Thread(target=self._writer, args=(directory, self._queue), name="recorder", daemon=True).start()
+        self.record("session", started_at=self.started_at)
+        print(f"⏺️ [Recorder] Recording to {directory}")
+
+    def close(self):
+        """停止录制，等待已记录的事件写完"""
+        if self._queue is not None:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait(5)
+        self.directory = None
+        self._queue = None
+
+    def record(self, kind, **data):
+        if self._queue is None:
+            return
+        self.last_event_at = time.time()
+        self._queue.put(({"t": round(time.time() - self.started_at, 4), "kind": kind, **data}, None))
+
+    def record_audio(self, kind, pcm, **data):
+        """记录一段音频（例如断句后的整句），偏移在入队时分配，保证与事件顺序一致"""
+        if self._queue is None:
+            return
+        with self._lock:
+            offset = self._audio_size
+            self._audio_size += len(pcm)
+        self.last_event_at = time.time()
+        self._queue.put(({"t": round(time.time() - self.started_at, 4), "kind": kind,
+                          "audio": [offset, len(pcm)], **data}, pcm))
+
+    @staticmethod
+    def _writer(directory, q):
+        with open(os.path.join(directory, EVENTS_FILE), "a", encoding="utf-8") as events, \
+                open(os.path.join(directory, AUDIO_FILE), "ab") as audio:
+            while True:
+                item = q.get()
+                if isinstance(item, threading.Event):
+                    events.flush()
+                    audio.flush()
+                    item.set()
+                    return
+                event, pcm = item
+                if pcm is not None:
+                    audio.write(pcm)
+                events.write(json.dumps(event, ensure_ascii=False) + "\n")
+                if q.empty():
+                    # 空闲时才刷盘：突发的 token 事件合并成一次写入
+                    events.flush()
+                    audio.flush()
+
+
+def load_recording(directory):
+    """
+    读取一次录制
+    :return: (events, read_audio)，read_audio(event) 返回该事件对应的 PCM
+    """
+    with open(os.path.join(directory, EVENTS_FILE), encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    audio_path = os.path.join(directory, AUDIO_FILE)
+
+    def read_audio(event):
+        offset, length = event["audio"]
+        with open(audio_path, "rb") as audio:
+            audio.seek(offset)
+            return audio.read(length)
+
+    return events, read_audio
+
+
+def new_session_dir(root):
+    return os.path.join(root, time.strftime("%Y%m%d-%H%M%S"))
+
+
+# 进程内共享：ears / main / brain / robot_client 往同一个录制里写；main.py 按 RECORD_SESSIONS 开启
+recorder = Recorder()
@@ -0,0 +1,349 @@
+"""
+对话录制的离线回放（基准测试用）
+用法: python replay.py recordings/20260101-120000 [--speed 4] [--out replays]
+
+按录制的时间把句子音频送进 ears 的识别工作池，经 main_loop -> brain -> robot_client 走完整条链路：
+- 阿里云识别、外部问答接口 / 大模型、纠错请求都换成录制的结果，按录制的耗时（除以 speed）返回
+- 机器人换成本地桩服务（HTTP，立即返回）
+- 回放过程本身也会被录制，结束后对比原始录制与回放的各阶段耗时
+"""
+import time
+import logging
+import argparse
+import statistics
+import threading
+from types import SimpleNamespace
+
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+
+import robot_client
+from recorder import recorder, load_recording, new_session_dir
+from brain import RobotBrain, SentenceSplitter
+from ears import BackgroundEars
+from fleet import RobotFleet
+
+# 回放结束判定：全部句子送完后，这么久 (秒) 没有新事件就结束
+IDLE_SECONDS = 3.0
+
+# (阶段, 起点, 终点)
+STAGES = [
+    ("asr_ms", "t_utterance", "t_asr"),           # 识别
+    ("pickup_ms", "t_asr", "t_wake"),             # 主循环取走识别结果
+    ("first_chunk_ms", "t_wake", "t_chunk"),      # 回复首包
+    ("first_speak_ms", "t_wake", "t_speak"),      # 首句进入说话队列
+    ("robot_ms", "t_speak", "t_speak_sent"),      # 首句下发到机器人
+    ("action_ms", "t_wake", "t_action"),          # 动作下发
+    ("e2e_ms", "t_utterance", "t_done"),          # 端到端：句子结束 -> 首句 / 动作下发
+]
+
+
+class Timeline:
+    """按录制时间轴（可加速）等待"""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.started_at = time.time()
+
+    def sleep_until(self, t):
+        delay = self.started_at + t / self.speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+
+
+class ReplayEars(BackgroundEars):
+    """按录制时间提交句子音频（以及部分识别结果）；识别返回录制的文本，耗时为录制耗时 / speed"""
+
+    def __init__(self, events, read_audio, timeline):
+        self.timeline = timeline
+        self.done = threading.Event()
+        self._feed_events = [e for e in events if e["kind"] in ("utterance", "partial")]
+        self._read_audio = read_audio
+        asr = {e["seq"]: e for e in events if e["kind"] == "asr"}
+        # 按音频内容找回识别结果（合并的音频以原句开头）
+        self._asr_by_audio = [(read_audio(e), asr.get(e["seq"])) for e in events
+                              if e["kind"] == "utterance" and not e.get("coalesced")]
+        super().__init__()
+
+    def _get_aliyun_token(self):
+        return "replay", time.time() + 86400
+
+    def start(self):
+        threading.Thread(target=self._feed, name="replay-ears", daemon=True).start()
+
+    def stop(self):
+        pass
+
+    def _feed(self):
+        for event in self._feed_events:
+            self.timeline.sleep_until(event["t"])
+            if event["kind"] == "utterance":
+                self._submit_audio(self._read_audio(event))
+            else:
+                with self._partial_lock:
+                    self._latest_partial = (event["utterance"], event["text"], event["stable"])
+        self.done.set()
+
+    def _recognize(self, pcm):
+        for audio, result in self._asr_by_audio:
+            if result is not None and pcm.startswith(audio):
+                self.timeline.sleep(result["latency_ms"] / 1000.0)
+                return result["text"]
+        return ""
+
+
+class _ReplayCache:
+    """回复缓存的替身：只回放录制时命中缓存的回复，不读写缓存文件"""
+
+    def __init__(self, replies):
+        self.replies = replies
+
+    def lookup(self, text, scope=None):
+        reply = self.replies.get(text)
+        if reply and reply["cached"]:
+            return {"question": text, "sentences": reply["sentences"], "actions": reply["actions"]}, "replay"
+        return None
+
+    def store(self, *args, **kwargs):
+        pass
+
+    def record_miss_latency(self, elapsed_ms):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class _ReplayStream:
+    """大模型流式响应的替身：按录制的到达间隔吐出 chunk"""
+
+    def __init__(self, chunks, timeline):
+        self.chunks = chunks
+        self.timeline = timeline
+        self.closed = False
+
+    def __iter__(self):
+        for delay, data in self.chunks:
+            self.timeline.sleep(delay)
+            if self.closed:
+                return
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=data))])
+
+    def close(self):
+        self.closed = True
+
+
+class ReplayBrain(RobotBrain):
+    """回复流换成录制的 chunk（保留到达间隔），句子切分 / 动作标签解析等仍走原有代码"""
+
+    def __init__(self, events, timeline):
+        super().__init__()
+        self.timeline = timeline
+        self.replies = _collect_replies(events)
+        self.response_cache = _ReplayCache(self.replies)
+        completions = SimpleNamespace(create=self._create)
+        self._client = SimpleNamespace(with_options=lambda **kw: self._client,
+                                       chat=SimpleNamespace(completions=completions))
+
+    def _chunks(self, text):
+        reply = self.replies.get(text)
+        return reply["chunks"] if reply else []
+
+    def _create(self, model, messages, temperature=0.7, stream=False):
+        if stream:
+            return _ReplayStream(self._chunks(messages[-1]["content"]), self.timeline)
+        # 摘要等非流式请求：回放中不产生内容
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=""))])
+
+    def _call_external_api_stream(self, text, cancel_token=None, session_id=None):
+        splitter = SentenceSplitter()
+        for delay, data in self._chunks(text):
+            self.timeline.sleep(delay)
+            if cancel_token is not None and cancel_token.is_cancelled():
+                return
+            recorder.record("chunk", request=text, data=data)
+            yield from splitter.feed(data)
+        yield from splitter.flush()
+        if cancel_token is not None:
+            cancel_token.completed = True
+
+
+def _collect_replies(events):
+    """按请求文本整理录制的回复：{text: {"cached", "sentences", "actions", "chunks": [(间隔秒, data)]}}"""
+    replies = {}
+    last_t = {}
+    for e in events:
+        if e["kind"] == "reply_start":
+            replies[e["text"]] = {"cached": e["cached"], "sentences": e.get("sentences", []),
+                                  "actions": e.get("actions", []), "chunks": []}
+            last_t[e["text"]] = e["t"]
+        elif e["kind"] == "chunk" and e["request"] in replies:
+            replies[e["request"]]["chunks"].append((e["t"] - last_t[e["request"]], e["data"]))
+            last_t[e["request"]] = e["t"]
+    return replies
+
+
+def _replay_corrections(events, timeline):
+    """纠错请求的替身（main.get_correction_client 的返回值）"""
+    corrections = {e["source"]: e for e in events if e["kind"] == "correction"}
+
+    def create(model, messages, temperature=0.7):
+        source = messages[-1]["content"]
+        recorded = corrections.get(source)
+        if recorded:
+            timeline.sleep(recorded["ms"] / 1000.0)
+        text = recorded["text"] if recorded else source
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def start_stub_robot():
+    """本地机器人桩服务：所有指令立即成功，到达时间记入录制"""
+    app = Flask("robot-stub")
+
+    @app.route("/cmd/<path:cmd>", methods=["POST"])
+    def command(cmd):
+        data = request.get_json(silent=True) or {}
+        if cmd == "batch":
+            for item in data.get("commands", []):
+                recorder.record("robot_received", cmd=item.get("cmd"))
+            return jsonify({"status": "success", "results": [{"status": "success"} for _ in data.get("commands", [])]})
+        recorder.record("robot_received", cmd=cmd)
+        return jsonify({"status": "success"})
+
+    @app.route("/time", methods=["GET", "POST"])
+    def clock():
+        return jsonify({"time": time.time()})
+
+    @app.route("/status")
+    def status():
+        return jsonify({"status": "online"})
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def stage_timings(events):
+    """
+    把事件流切分成一轮轮对话（以主循环取到识别文本的 wake 事件为界），计算各阶段耗时 (ms)
+    只统计被唤醒的轮次
+    """
+    utterances = {}
+    asr = []
+    turns = []
+    for e in events:
+        kind = e["kind"]
+        if kind == "utterance":
+            utterances.setdefault(e["seq"], e["t"])
+        elif kind == "asr" and e["text"] and not e.get("dropped"):
+            asr.append(e)
+        elif kind == "wake":
+            source = next((a for a in reversed(asr) if e["text"].endswith(a["text"])), None)
+            turns.append({
+                "text": e["text"], "woken": e["woken"], "t_wake": e["t"],
+                "t_asr": source["t"] if source else None,
+                "t_utterance": utterances.get(source["seq"]) if source else None,
+            })
+        elif turns and kind in ("chunk", "speak", "speak_sent", "action"):
+            turns[-1].setdefault(f"t_{kind}", e["t"])
+
+    results = []
+    for turn in turns:
+        if not turn["woken"]:
+            continue
+        # 端到端：第一句下发或第一个动作下发，取先到的
+        done = [turn[k] for k in ("t_speak_sent", "t_action") if k in turn]
+        turn["t_done"] = min(done) if done else None
+        row = {"text": turn["text"]}
+        for key, start, end in STAGES:
+            a, b = turn.get(start), turn.get(end)
+            row[key] = round((b - a) * 1000, 1) if a is not None and b is not None else None
+        results.append(row)
+    return results
+
+
+def summarize(rows):
+    summary = {}
+    for key, _, _ in STAGES:
+        values = sorted(r[key] for r in rows if r[key] is not None)
+        if values:
+            summary[key] = {
+                "n": len(values),
+                "median": round(statistics.median(values), 1),
+                "p90": values[min(len(values) - 1, int(len(values) * 0.9))],
+            }
+    return summary
+
+
+def print_report(original, replayed, speed):
+    print(f"\n📊 Stage timings (ms)  original vs replay (speed x{speed}; recorded network time is divided by speed)")
+    print(f"{'stage':<16}{'orig n':>8}{'orig med':>10}{'orig p90':>10}{'replay n':>10}{'replay med':>12}{'replay p90':>12}")
+    a, b = summarize(original), summarize(replayed)
+    for key, _, _ in STAGES:
+        x, y = a.get(key, {}), b.get(key, {})
+        print(f"{key:<16}{x.get('n', 0):>8}{x.get('median', '-'):>10}{x.get('p90', '-'):>10}"
+              f"{y.get('n', 0):>10}{y.get('median', '-'):>12}{y.get('p90', '-'):>12}")
+
+
+def replay(directory, speed=1.0, out_root="replays"):
+    import main
+
+    events, read_audio = load_recording(directory)
+    timeline = Timeline(speed)
+
+    # 机器人：本地桩服务，不走长连接；播报时长按回放速度缩短
+    robot_client.USE_CONTROL_CHANNEL = False
+    robot_client.RobotClient.seconds_per_char /= speed
+    stub_url = start_stub_robot()
+
+    ears = None
+
+    def _make_ears():
+        nonlocal ears
+        ears = ReplayEars(events, read_audio, timeline)
+        return ears
+
+    main.robot_sys.factory = lambda: RobotFleet({"replay": {"url": stub_url}})
+    main.brain_sys.factory = lambda: ReplayBrain(events, timeline)
+    main.ears_sys.factory = _make_ears
+    main._client = _replay_corrections(events, timeline)
+
+    out_dir = new_session_dir(out_root)
+    recorder.open(out_dir)
+    main.start_all(main.SUBSYSTEMS)
+    for sub in main.SUBSYSTEMS:
+        sub.wait()
+    timeline.started_at = time.time()
+    threading.Thread(target=main.main_loop, name="replay-main", daemon=True).start()
+
+    # 送完全部句子并且一段时间没有新事件后结束
+    ears_ready = main.ears_sys.wait()
+    if not ears_ready:
+        raise RuntimeError(f"ears failed to start: {main.ears_sys.error}")
+    ears.done.wait()
+    idle = IDLE_SECONDS / max(speed, 1.0)
+    while time.time() - recorder.last_event_at < idle or main.robot.is_speaking():
+        time.sleep(0.1)
+    recorder.close()
+
+    replay_events, _ = load_recording(out_dir)
+    original, replayed = stage_timings(events), stage_timings(replay_events)
+    print_report(original, replayed, speed)
+    print(f"\nReplay recorded to {out_dir}")
+    return original, replayed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded conversation through the pipeline")
+    parser.add_argument("recording", help="recording directory (recordings/<timestamp>)")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed multiplier")
+    parser.add_argument("--out", default="replays", help="where to record the replay itself")
+    args = parser.parse_args()
+    replay(args.recording, args.speed, args.out)
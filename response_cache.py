@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from text_utils import pinyin_key, ngram_vector, cosine
+
+# 语气词 / 客套词不影响问题本身，计算 key 时去掉
+FILLER_WORDS = ["请问", "呀", "啊", "呢", "吧", "哦", "嘛"]
+
+# 答案随时间 / 上文变化的问题不缓存（例如 “今天几号” 的回复第二天就错了）
+NO_CACHE_WORDS = ["今天", "明天", "昨天", "现在", "几点", "几号", "星期", "周几", "天气",
+                  "刚才", "刚刚", "上一个", "那个", "这个", "他", "她", "它", "再说"]
+
+
+class ResponseCache:
+    """
+    高频问题回复缓存
+    - 查找顺序：原文精确匹配 -> 拼音归一化匹配（去掉唤醒词、标点，同音字视为相同）-> 可选 n-gram 相似度
+    - 按 scope（会话）隔离：一个会话的回复不会提供给另一个会话
+    - 只缓存高频问题：同一问题在 TTL 内完整回答过 min_asks 次后才写入；含 NO_CACHE_WORDS 的问题不缓存
+    - TTL 过期 + LRU 淘汰
+    - 持久化到本地 JSON 文件，重启后仍然有效
+    """
+
+    def __init__(self, path=None, ttl=24 * 3600, max_entries=500, similarity_threshold=0.85,
+                 use_embedding=True, strip_words=None, min_asks=2, no_cache_words=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.use_embedding = use_embedding
+        self.min_asks = min_asks
+        self.no_cache_words = NO_CACHE_WORDS if no_cache_words is None else list(no_cache_words)
+        self._strip_keys = sorted({pinyin_key(w) for w in list(strip_words or []) + FILLER_WORDS if pinyin_key(w)},
+                                  key=len, reverse=True)
+
+        # (scope, 拼音 key) -> {"question", "scope", "sentences", "actions", "created"}
+        self._entries = OrderedDict()
+        self._exact = {}    # (scope, 原文) -> key
+        self._vectors = {}  # key -> n-gram 向量
+        self._asks = OrderedDict()  # key -> [未命中时完整回答的次数, 第一次的时间]
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = {"exact": 0, "pinyin": 0, "similar": 0}
+        self.miss_latency_ms = None  # 未命中时首句延迟的滑动平均
+        self.hit_latency_ms = 0.0
+
+        self._load()
+
+    def _key(self, text):
+        padded = f" {pinyin_key(text)} "
+        for k in self._strip_keys:
+            padded = padded.replace(f" {k} ", " ")
+        return padded.strip()
+
+    def cacheable(self, text):
+        return not any(w in text for w in self.no_cache_words)
+
+    def lookup(self, text, scope=None):
+        """:return: (entry, kind) 或 None"""
+        start = time.time()
+        with self._lock:
+            self.lookups += 1
+            if not self.cacheable(text):
+                return None
+            result = self._lookup_locked(text, scope)
+            if result:
+                self.hits[result[1]] += 1
+                self.hit_latency_ms += (time.time() - start) * 1000
+                return result
+        return None
+
+    def _lookup_locked(self, text, scope):
+        now = time.time()
+        key = self._exact.get((scope, text))
+        kind = "exact"
+        if key is None:
+            key = (scope, self._key(text))
+            kind = "pinyin"
+
+        if key[1] and key not in self._entries and self.use_embedding:
+            vec = ngram_vector(tuple(key[1].split(" ")))
+            best_key, best_score = None, 0.0
+            for k, v in self._vectors.items():
+                if k[0] != scope:
+                    continue
+                score = cosine(vec, v)
+                if score > best_score:
+                    best_key, best_score = k, score
+            if best_score >= self.similarity_threshold:
+                key, kind = best_key, "similar"
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry["created"] > self.ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry, kind
+
+    def store(self, text, sentences, actions=None, scope=None):
+        """记录一次完整回答；同一问题回答满 min_asks 次才真正写入缓存"""
+        if not sentences or not self.cacheable(text):
+            return
+        pkey = self._key(text)
+        if not pkey:
+            return
+        key = (scope, pkey)
+        with self._lock:
+            now = time.time()
+            asks = self._asks.get(key)
+            if asks is None or now - asks[1] > self.ttl:
+                asks = self._asks[key] = [0, now]
+            asks[0] += 1
+            self._asks.move_to_end(key)
+            while len(self._asks) > self.max_entries * 4:
+                self._asks.popitem(last=False)
+            if asks[0] < self.min_asks:
+                return
+            del self._asks[key]
+
+            self._entries[key] = {
+                "question": text,
+                "scope": scope,
+                "sentences": list(sentences),
+                "actions": list(actions or []),
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            self._exact[(scope, text)] = key
+            self._vectors[key] = ngram_vector(tuple(pkey.split(" ")))
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            snapshot = list(self._entries.values())
+        self._save(snapshot)
+
+    def record_miss_latency(self, elapsed_ms):
+        with self._lock:
+            if self.miss_latency_ms is None:
+                self.miss_latency_ms = elapsed_ms
+            else:
+                self.miss_latency_ms = 0.8 * self.miss_latency_ms + 0.2 * elapsed_ms
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            saved = hits * self.miss_latency_ms - self.hit_latency_ms if self.miss_latency_ms else 0.0
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": dict(self.hits),
+                "hit_ratio": round(hits / self.lookups, 3) if self.lookups else 0.0,
+                "latency_saved_ms": round(saved, 1),
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        self._vectors.pop(key, None)
+        if entry and self._exact.get((key[0], entry["question"])) == key:
+            del self._exact[(key[0], entry["question"])]
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Response cache load failed: {e}")
+            return
+        now = time.time()
+        for entry in entries:
+            if now - entry.get("created", 0) > self.ttl or not self.cacheable(entry["question"]):
+                continue
+            scope = entry.get("scope")
+            pkey = self._key(entry["question"])
+            if pkey:
+                key = (scope, pkey)
+                self._entries[key] = entry
+                self._exact[(scope, entry["question"])] = key
+                self._vectors[key] = ngram_vector(tuple(pkey.split(" ")))
+        print(f"💾 Response cache loaded: {len(self._entries)} entries")
+
+    def _save(self, entries):
+        """先写临时文件再原子替换，避免写一半时断电导致文件损坏"""
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with self._save_lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"⚠️ Response cache save failed: {e}")
@@ -2,37 +2,204 @@ import os
 import requests
 import threading
 import time
-import queue  # 引入队列
-from config import ROBOT_SERVER_URL
-from tool import safe_upload_wav
-from comtypes import CLSCTX_ALL
-from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+import heapq
+import itertools
+from urllib.parse import urlparse
+from concurrent.futures import Future
+from config import ROBOT_SERVER_URL, SPEECH_COALESCE_MAX_CHARS, SPEECH_MAX_AGE
+from config import BATCH_WINDOW, BATCH_TIMEOUT
+from config import USE_CONTROL_CHANNEL, ROBOT_CONTROL_PORT
+from config import ROBOT_BREAKER_WINDOW, ROBOT_BREAKER_FAILURE_RATE, ROBOT_BREAKER_MIN_FAILURES
+from config import ROBOT_BREAKER_COOLDOWN, ROBOT_BREAKER_MAX_COOLDOWN, ROBOT_SPEECH_WHEN_OPEN
+from circuit_breaker import CircuitBreaker
+from control_channel import ControlChannelClient, ChannelUnavailable, ChannelRequestLost
+from tool import safe_upload_wav, convert_to_16k_mono
+from audio_stream import iter_pcm_16k_mono, iter_file
+from mic_gate import mic_gate
+from recorder import recorder
 
-def set_windows_mic_mute(mute: bool):
+# === 说话优先级（数字越小越优先）===
+PRIORITY_DIRECTOR = 0  # 导演（网页）指令
+PRIORITY_ALERT = 1     # 系统提示
+PRIORITY_AUTO = 2      # 自动对话回复
+
+
+class SpeechScheduler:
+    """
+    带优先级的说话队列
+    - 高优先级先说；高优先级到来时抢占正在说的低优先级内容，并丢弃排队中的低优先级内容
+    - 同优先级、相邻的短句合并成一次 /cmd/speak
+    - 排队太久（按优先级的 SPEECH_MAX_AGE）的内容直接丢弃
+    """
+
+    def __init__(self, coalesce_max_chars=SPEECH_COALESCE_MAX_CHARS, max_age=None):
+        self.coalesce_max_chars = coalesce_max_chars
+        self.max_age = max_age if max_age is not None else SPEECH_MAX_AGE
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.current_priority = None
+        self.preempt_event = threading.Event()
+
+    def put(self, text, priority=PRIORITY_AUTO):
+        with self._cond:
+            self._preempt_below_locked(priority)
+            heapq.heappush(self._heap, (priority, next(self._seq), text, time.time()))
+            self._cond.notify()
+
+    def get(self):
+        """阻塞直到取到一条（可能是合并后的）待说内容，返回 (text, priority)"""
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                priority, _, text, enqueued_at = heapq.heappop(self._heap)
+                if self._is_stale(priority, enqueued_at):
+                    print(f"🗑️ [Speech] Drop stale: {text}")
+                    continue
+
+                while self._heap and self._heap[0][0] == priority:
+                    next_text = self._heap[0][2]
+                    if len(text) + len(next_text) > self.coalesce_max_chars:
+                        break
+                    heapq.heappop(self._heap)
+                    text += next_text
+
+                self.current_priority = priority
+                self.preempt_event.clear()
+                return text, priority
+
+    def done(self):
+        with self._cond:
+            self.current_priority = None
+
+    def clear(self):
+        with self._cond:
+            self._heap = []
+            self.current_priority = None
+
+    def preempt_below(self, priority):
+        """别的队列要在同一台机器人上说该优先级的内容：打断并丢弃这里更低优先级的内容"""
+        with self._cond:
+            self._preempt_below_locked(priority)
+
+    def _preempt_below_locked(self, priority):
+        if self.current_priority is not None and priority < self.current_priority:
+            self.preempt_event.set()
+        if any(p > priority for p, _, _, _ in self._heap):
+            self._heap = [item for item in self._heap if item[0] <= priority]
+            heapq.heapify(self._heap)
+
+    def drop(self, priority):
+        """丢弃排队中该优先级的内容；正在说的也是该优先级时请求打断"""
+        with self._cond:
+            self._heap = [item for item in self._heap if item[0] != priority]
+            heapq.heapify(self._heap)
+            if self.current_priority == priority:
+                self.preempt_event.set()
+
+    def empty(self):
+        with self._cond:
+            return not self._heap
+
+    def _is_stale(self, priority, enqueued_at):
+        max_age = self.max_age.get(priority)
+        return max_age is not None and time.time() - enqueued_at > max_age
+
+
+# 可以走长连接的接口 -> 长连接指令名
+CHANNEL_COMMANDS = {
+    "/cmd/speak": "speak",
+    "/cmd/stop": "stop",
+    "/cmd/action": "action",
+    "/cmd/batch": "batch",
+    "/time": "time",
+}
+
+# 单条指令对应的独立接口（服务端不支持 /cmd/batch 时回退使用）
+SINGLE_COMMAND_ENDPOINTS = {
+    "speak": "/cmd/speak",
+    "stop": "/cmd/stop",
+    "action": "/cmd/action",
+}
+
+
+class CommandBatcher:
     """
-    控制 Windows 系统默认麦克风的静音状态
-    :param mute: True 为静音, False 为取消静音
+    指令自动合并：BATCH_WINDOW 秒内提交的指令合并成一次 /cmd/batch 请求
+    每条指令返回一个 Future，结果为服务端返回的该条指令结果 (dict)，通信失败时为 None
     """
-    try:
-        # 获取系统默认的音频输入设备（麦克风）
-        # 注意：GetMicrophone() 需要较新版本的 pycaw，如果报错请看底部的替代写法
-        devices = AudioUtilities.GetMicrophone()
-        interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-        volume = interface.QueryInterface(IAudioEndpointVolume)
-        volume.SetMute(mute, None)
-    except Exception as e:
-        print(f"⚠️ 麦克风控制失败: {e}")
+
+    def __init__(self, client, window=BATCH_WINDOW):
+        self.client = client
+        self.window = window
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def submit(self, command):
+        future = Future()
+        with self._lock:
+            self._pending.append((command, future))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._timer = None
+        if not pending:
+            return
+
+        commands = [cmd for cmd, _ in pending]
+        try:
+            results = self.client.send_commands(commands)
+        except Exception as e:
+            # Timer 线程里的异常没人接，必须落到 Future 上，否则等待结果的调用方会一直挂住
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        # 结果条数不足时补 None，保证每个 Future 都有结果
+        for (_, future), result in itertools.zip_longest(pending, (results or [])[:len(pending)]):
+            future.set_result(result)
+
 
 class RobotClient:
-    def __init__(self):
+    # 估算播报时长用的语速 (秒/字)，回放加速时按倍数调小
+    seconds_per_char = 0.22
+
+    def __init__(self, server_url=ROBOT_SERVER_URL, control_port=ROBOT_CONTROL_PORT, name="default"):
+        self.name = name
+        self.server_url = server_url
         self.session = requests.Session()
         self.interrupt_event = threading.Event()
         self._disable_proxies()
 
         # === 语音队列系统 ===
-        self.speech_queue = queue.Queue()
+        self.speech_queue = SpeechScheduler()
         self.is_speaking_flag = False  # 标记机器人是否正在忙碌（说话中）
 
+        # === 指令合并 ===
+        self.batcher = CommandBatcher(self)
+        self.batch_supported = True
+
+        # === 熔断：服务不可达时立即失败，不再每次等超时 ===
+        self.breaker = CircuitBreaker(
+            self._probe, window=ROBOT_BREAKER_WINDOW, failure_rate=ROBOT_BREAKER_FAILURE_RATE,
+            min_calls=ROBOT_BREAKER_MIN_FAILURES, cooldown=ROBOT_BREAKER_COOLDOWN,
+            max_cooldown=ROBOT_BREAKER_MAX_COOLDOWN, on_change=self._on_breaker_change)
+        self.speech_when_open = ROBOT_SPEECH_WHEN_OPEN
+
+        # === 长连接控制通道 ===
+        self.channel = None
+        if USE_CONTROL_CHANNEL:
+            self.channel = ControlChannelClient(urlparse(server_url).hostname, control_port)
+            self.channel.on_event(self._on_event)
+            self.channel.start()
+
         # 启动后台线程处理说话任务
         self.worker_thread = threading.Thread(target=self._speak_worker, daemon=True)
         self.worker_thread.start()
@@ -42,12 +209,124 @@ class RobotClient:
         for p in proxies:
             if p in os.environ: del os.environ[p]
 
-    def _post(self, endpoint, json_data=None):
+    def _post(self, endpoint, json_data=None, timeout=3):
+        """
+        优先走长连接，未连接或发送失败时回退到 HTTP
+        已经发出但超时 / 断线的指令不回退（服务端可能已执行，重发会让动作和台词重复），直接返回 None
+        """
+        cmd = CHANNEL_COMMANDS.get(endpoint)
+        if cmd and self.channel is not None and self.channel.is_connected():
+            try:
+                resp = self.channel.request({"cmd": cmd, **(json_data or {})}, timeout=timeout)
+                self.breaker.record_success()
+                return resp
+            except ChannelUnavailable as e:
+                print(f"⚠️ Control channel failed ({e}), falling back to HTTP")
+            except ChannelRequestLost as e:
+                print(f"⚠️ Control channel: no result for {endpoint} ({e}), not resending")
+                return None
+        if not self.breaker.allow():
+            # 熔断中：直接失败，恢复由后台探测负责
+            return None
         try:
-            url = f"{ROBOT_SERVER_URL.rstrip('/')}/{endpoint.lstrip('/')}"
-            return self.session.post(url, json=json_data, timeout=3)
+            url = f"{self.server_url.rstrip('/')}/{endpoint.lstrip('/')}"
+            resp = self.session.post(url, json=json_data, timeout=timeout)
+            self.breaker.record_success()
+            return resp
         except Exception as e:
-            print(f"Robot Comm Error: {e}")
+            print(f"Robot Comm Error [{self.name}]: {e}")
+            self.breaker.record_failure()
+            return None
+
+    def _probe(self):
+        """熔断后的探测：能拿到 /status 就算恢复（SDK 未就绪返回 500 也说明服务可达）"""
+        try:
+            self.session.get(f"{self.server_url.rstrip('/')}/status", timeout=1)
+            return True
+        except Exception:
+            return False
+
+    def _on_breaker_change(self, state):
+        if state == "open":
+            print(f"🔌 [Robot {self.name}] Unreachable, failing fast until it recovers")
+            if self.speech_when_open == "drop":
+                self.speech_queue.clear()
+        else:
+            print(f"✅ [Robot {self.name}] Reachable again")
+        recorder.record("breaker", robot=self.name, state=state)
+
+    def _on_event(self, event):
+        """
+        服务端推送的事件（speech_started / action_done / playback_done / playback_underrun）
+        SDK 的 TtsMaker 是异步的且没有播放结束通知，说话时长仍由 _speak_worker 按字数估算
+        """
+        if event.get("event") == "playback_underrun":
+            print(f"⚠️ [Robot] Playback underrun: {event.get('lag')}s")
+
+    def channel_status(self):
+        if self.channel is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "connected": self.channel.is_connected(),
+            "reconnects": self.channel.reconnects,
+            "rtt_ms": round(self.channel.rtt_ms, 1) if self.channel.rtt_ms is not None else None,
+        }
+
+    def send_commands(self, commands, mode="best_effort", start_at=None):
+        """
+        一次请求按顺序执行多条指令（speak / stop / action / clip）
+        :param mode: "best_effort" 逐条执行 / "atomic" 全部有效才执行，失败即停止
+        :param start_at: 按机器人时钟的开始执行时间（多机同步用），只能通过 /cmd/batch 实现
+        :return: 与 commands 等长的结果列表，通信失败的项为 None
+        """
+        if not commands:
+            return []
+        if start_at is None and (len(commands) == 1 or not self.batch_supported):
+            return [self._send_single(cmd) for cmd in commands]
+
+        payload = {"commands": commands, "mode": mode}
+        if start_at is not None:
+            payload["start_at"] = start_at
+        resp = self._post("/cmd/batch", payload, timeout=BATCH_TIMEOUT)
+        if resp is not None and resp.status_code == 404:
+            # 旧版服务端没有 /cmd/batch，之后都逐条发送
+            print("⚠️ Robot server has no /cmd/batch, falling back to single commands")
+            self.batch_supported = False
+            return [self._send_single(cmd) for cmd in commands]
+        try:
+            return resp.json().get("results", [None] * len(commands))
+        except Exception:
+            return [None] * len(commands)
+
+    def measure_clock_offset(self):
+        """
+        读取一次机器人时钟（NTP 式估计：假设往返路径对称）
+        :return: (offset, rtt)，offset = 机器人时钟 - 本机时钟；失败时返回 None
+        """
+        t0 = time.time()
+        resp = self._post("/time", timeout=1)
+        t1 = time.time()
+        try:
+            return resp.json()["time"] - (t0 + t1) / 2, t1 - t0
+        except Exception:
+            return None
+
+    def _send_single(self, command):
+        endpoint = SINGLE_COMMAND_ENDPOINTS.get(command.get("cmd"))
+        if endpoint is None:
+            # clip 等只能通过 /cmd/batch 执行
+            resp = self._post("/cmd/batch", {"commands": [command]}, timeout=BATCH_TIMEOUT)
+            try:
+                return resp.json()["results"][0]
+            except Exception:
+                return None
+        payload = {k: v for k, v in command.items() if k != "cmd"}
+        # 动作在服务端串行执行（含自动放手延时），可能超过默认的 3 秒
+        resp = self._post(endpoint, payload or None, timeout=BATCH_TIMEOUT)
+        try:
+            return resp.json()
+        except Exception:
             return None
 
     def stop_all(self):
@@ -55,23 +334,30 @@ class RobotClient:
         self.interrupt_event.set()
 
         # 1. 清空等待说的队列
-        with self.speech_queue.mutex:
-            self.speech_queue.queue.clear()
+        self.speech_queue.clear()
 
         self.is_speaking_flag = False
 
-        # 2. 发送物理停止指令
-        self._post("/cmd/stop")
-        self._post("/cmd/action", {"group": "loco", "name": "damp"})
+        # 2. 发送物理停止指令（一次请求，按顺序执行）
+        self.send_commands([
+            {"cmd": "stop"},
+            {"cmd": "velocity", "stop": True},
+            {"cmd": "action", "group": "loco", "name": "damp"},
+        ])
 
-    def speak(self, text):
+    def speak(self, text, priority=PRIORITY_AUTO):
         """
-        非阻塞说话：只把文字放入队列。
+        非阻塞说话：只把文字放入优先级队列。
         """
         if not text: return
         self.interrupt_event.clear()
+        recorder.record("speak", robot=self.name, text=text, priority=priority)
         # print(f"📥 [Client] 入队: {text}")
-        self.speech_queue.put(text)
+        self.speech_queue.put(text, priority)
+
+    def drop_speech(self, priority=PRIORITY_AUTO):
+        """丢弃该优先级排队中和正在说的内容（例如同一会话来了新问题，上一轮的回复不再需要）"""
+        self.speech_queue.drop(priority)
 
     def is_speaking(self):
         """判断机器人是否正在说话或有话没说完"""
@@ -80,20 +366,43 @@ class RobotClient:
 
     def _speak_worker(self):
         while True:
+            muted = False  # 本次循环自己持有的静音，异常时只释放自己拿到的
             try:
-                text = self.speech_queue.get()
+                text, priority = self.speech_queue.get()
                 self.is_speaking_flag = True
 
                 if self.interrupt_event.is_set():
-                    self.speech_queue.task_done()
+                    self.speech_queue.done()
                     self.is_speaking_flag = False
                     continue
 
+                if not self.breaker.allow():
+                    if self.speech_when_open == "drop":
+                        print(f"🔌 [Robot] Unreachable, dropped: {text}")
+                        self.speech_queue.done()
+                        self.is_speaking_flag = not self.speech_queue.empty()
+                        continue
+                    # buffer：等恢复或被打断，期间不屏蔽麦克风
+                    while not self.breaker.wait_closed(0.2):
+                        if self.interrupt_event.is_set() or self.speech_queue.preempt_event.is_set():
+                            break
+                    if self.interrupt_event.is_set():
+                        self.speech_queue.done()
+                        self.is_speaking_flag = False
+                        continue
+
                 print(f"🤖 [Robot] Playing: {text}")
-                self._post("/cmd/speak", {"text": text})
+                resp = self._post("/cmd/speak", {"text": text})
+                if resp is None:
+                    # 没发出去就不必按估算时长等待（也不必屏蔽麦克风）
+                    print(f"🔌 [Robot] Speak failed, skipped: {text}")
+                    self.speech_queue.done()
+                    self.is_speaking_flag = not self.speech_queue.empty()
+                    continue
+                recorder.record("speak_sent", robot=self.name, text=text)
 
                 # === 估算等待时间 ===
-                duration = len(text) * 0.22 + 0.1
+                duration = len(text) * self.seconds_per_char + 0.1
                 print("duration:", duration)
 
                 # ===============================================
@@ -101,37 +410,107 @@ class RobotClient:
                 # ===============================================
 
                 # 1. 马上静音
-                set_windows_mic_mute(True)
+                mic_gate.mute()
+                muted = True
 
                 try:
                     start_time = time.time()
                     while time.time() - start_time < duration:
                         if self.interrupt_event.is_set():
                             break
+                        if self.speech_queue.preempt_event.is_set():
+                            # 更高优先级的内容到来，打断当前播报
+                            print(f"⏭️ [Robot] Preempted: {text}")
+                            self._post("/cmd/stop")
+                            break
                         time.sleep(0.1)
                 finally:
                     # 2. 无论时间到没到，还是被打断，最后必须恢复麦克风
-                    set_windows_mic_mute(False)
+                    mic_gate.unmute()
+                    muted = False
 
                 # ===============================================
                 # 👆 修改结束
                 # ===============================================
 
-                self.speech_queue.task_done()
+                self.speech_queue.done()
 
                 if self.speech_queue.empty():
                     self.is_speaking_flag = False
 
             except Exception as e:
                 print(f"Worker Error: {e}")
+                self.speech_queue.done()
                 self.is_speaking_flag = False
-                # 异常保护：防止报错导致麦克风一直静音
-                set_windows_mic_mute(False)
+                # 异常保护：防止报错导致麦克风一直静音（只释放本次持有的，不能减掉别人的计数）
+                if muted:
+                    mic_gate.unmute()
+
+    def begin_turn(self):
+        """
+        新一轮对话开始：清除上一轮的打断标记
+        打断后标记会一直保留到下一次 speak()，而回复的内嵌动作在句首、先于 speak() 下发，不清除会被 perform_action 丢弃
+        """
+        self.interrupt_event.clear()
 
     def perform_action(self, action_data):
-        if self.interrupt_event.is_set(): return
+        """
+        下发动作；短时间内的多个指令会被自动合并成一次请求
+        :return: Future；打断期间不下发，直接返回结果为 None 的 Future
+        """
+        if self.interrupt_event.is_set():
+            future = Future()
+            future.set_result(None)
+            return future
         print(f"🦾 Executing Action: {action_data}")
-        self._post("/cmd/action", action_data)
+        recorder.record("action", robot=self.name, action=action_data)
+        return self.batcher.submit({"cmd": "action", **action_data})
+
+    def set_velocity(self, vx=0.0, vy=0.0, vyaw=0.0):
+        """
+        遥控速度（可高频调用）：服务端只保留最新值，停止发送超过 deadman 时间后机器人自动停止
+        """
+        command = {"cmd": "velocity", "vx": vx, "vy": vy, "vyaw": vyaw}
+        if self.channel is not None and self.channel.is_connected():
+            try:
+                self.channel.notify(command)
+                return
+            except ChannelUnavailable:
+                pass
+        self._post("/cmd/velocity", {k: v for k, v in command.items() if k != "cmd"}, timeout=0.5)
+
+    def play_stream(self, pcm_chunks, channel=None):
+        """
+        把 16k 单声道 16bit PCM 块流式转发到机器人 /cmd/play_stream（chunked 上传，边传边播）
+        阻塞到播放结束
+        :param channel: 混音通道（music / speech / effects），None 表示抢占式播放
+        :return: 服务端结果 dict；服务端不支持流式接口时返回 None
+        """
+        if not self.breaker.allow():
+            raise ConnectionError(f"robot {self.name} unreachable (circuit open)")
+        url = f"{self.server_url.rstrip('/')}/cmd/play_stream"
+        try:
+            resp = self.session.post(url, data=pcm_chunks, headers={"Content-Type": "application/octet-stream"},
+                                     params={"channel": channel} if channel else None, timeout=(3, 30))
+        except requests.ConnectionError:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        if resp.status_code == 404:
+            return None
+        return resp.json()
 
     def play_wav(self, filepath):
-        safe_upload_wav(self.session, ROBOT_SERVER_URL, filepath)
\ No newline at end of file
+        """
+        播放本地音频文件：先做入库预处理（裁剪静音、响度归一化，按内容缓存），再边读边上传
+        旧版服务端回退到整文件上传
+        """
+        try:
+            with open(convert_to_16k_mono(filepath), "rb") as f:
+                result = self.play_stream(iter_pcm_16k_mono(iter_file(f)))
+            if result is not None:
+                return result
+        except Exception as e:
+            print(f"⚠️ Streaming playback failed: {e}")
+            return None
+        safe_upload_wav(self.session, self.server_url, filepath)
\ No newline at end of file
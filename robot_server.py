@@ -15,29 +15,89 @@ from unitree_sdk2py.g1.arm.g1_arm_action_client import G1ArmActionClient, action
 # 运动控制（运动模式）
 from unitree_sdk2py.g1.loco.g1_loco_client import LocoClient
 
+from action_registry import get_registry
+from client_supervisor import ClientSupervisor, probe_call
+
 # ================= 可选音频辅助模块 =================
 try:
-    from wav import read_wav, play_pcm_stream
+    from wav import read_wav, play_pcm_stream, play_pcm_chunks
 
     WAV_MODULE_LOADED = True
 except ImportError:
     print("Warning: wav.py module not found. WAV playback will be unavailable.")
     WAV_MODULE_LOADED = False
 
+# ================= 可选音频预处理（裁剪静音 + 响度归一化） =================
+try:
+    from audio_prep import PrepCache
+
+    PREP_LOADED = True
+except ImportError:
+    print("Warning: audio_prep.py module not found. Clips are played without preprocessing.")
+    PREP_LOADED = False
+
+# ================= 可选混音器（需要 numpy） =================
+try:
+    from mixer import AudioMixer
+
+    MIXER_LOADED = True
+except ImportError:
+    print("Warning: mixer.py (or numpy) not available. Mixed playback channels will be unavailable.")
+    MIXER_LOADED = False
+
+# ================= 可选长连接控制通道 =================
+try:
+    from control_channel import ControlChannelServer
+
+    CONTROL_CHANNEL_LOADED = True
+except ImportError:
+    print("Warning: control_channel.py module not found. Only HTTP control is available.")
+    CONTROL_CHANNEL_LOADED = False
+
+CONTROL_CHANNEL_PORT = 6001
+
 # ================= Flask 配置 =================
 app = Flask(__name__)
 UPLOAD_FOLDER = "server_uploads"
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+# 预处理后的音频按内容哈希缓存，同一片段重复上传 / 播放时不再处理
+prep_cache = PrepCache("server_audio_cache") if PREP_LOADED else None
 
 # ================= 全局客户端与锁 =================
+# 由 ClientSupervisor 维护：重建期间为 None
 audio_client = None
 armAction_client = None
 loco_client = None
 
+SDK_PROBE_INTERVAL = 5.0     # 健康检查间隔 (秒)
+SDK_FAILURE_THRESHOLD = 2    # 连续失败多少次后重建客户端
+SDK_COMMAND_WAIT = 1.5       # 指令到达时客户端正在重建，最多等待的时间 (秒)，超时则立即失败
+
+sdk_supervisor = None
+
 speech_lock = threading.Lock()
-action_lock = threading.Lock()
+
+# 长连接服务（启动后才有值），用于向控制端推送事件
+control_server = None
+
+
+def _await_client(name):
+    """客户端正在重建时短暂等待（让指令排队片刻而不是直接失败）"""
+    if sdk_supervisor is not None:
+        sdk_supervisor.wait_ready(name, SDK_COMMAND_WAIT)
+
+
+def _report_sdk_failure(name, error):
+    if sdk_supervisor is not None:
+        sdk_supervisor.report_failure(name, error)
+
+
+def _emit_event(event, **data):
+    """向所有长连接客户端推送事件（speech_started / action_done / playback_done / playback_underrun）"""
+    if control_server is not None:
+        control_server.broadcast(event, **data)
 
 # ================= 音频：支持立即中断 =================
 # WAV 播放使用此 app_name（与现有代码行为保持一致）。
@@ -119,6 +179,8 @@ def _stop_and_preempt_audio():
     同时推进音频代数计数器，使待启动的播放失效。
     """
     _bump_audio_gen()
+    if mixer is not None:
+        mixer.clear()
     _try_audio_stop_now()
 
 
@@ -130,6 +192,7 @@ def _start_wav_playback_async(pcm_list):
     global _playback_thread, audio_client
 
     def _worker(gen_snapshot: int):
+        _await_client("audio")
         # 用 speech_lock 串行化音频启动；停止操作为非阻塞尽力而为。
         with speech_lock:
             # 防止 stop/抢占后陈旧线程仍然启动。
@@ -137,7 +200,17 @@ def _start_wav_playback_async(pcm_list):
                 return
             if audio_client is None:
                 return
-            play_pcm_stream(audio_client, pcm_list, WAV_APP_NAME)
+            _pause_mixer()
+            try:
+                play_pcm_stream(
+                    audio_client, pcm_list, WAV_APP_NAME,
+                    on_underrun=lambda lag: _emit_event("playback_underrun", lag=round(lag, 3)),
+                )
+            finally:
+                _resume_mixer()
+            # 被 stop/抢占的播放不算正常结束
+            _emit_event("playback_done", interrupted=gen_snapshot != _get_audio_gen(),
+                        duration=round(len(pcm_list) / 32000.0, 2))
 
     with _playback_lock:
         # 抢占当前播放并使之前待启动的音频全部失效。
@@ -149,71 +222,353 @@ def _start_wav_playback_async(pcm_list):
         t.start()
 
 
-# ================= 机械臂动作选项 =================
-ARM_ACTION_OPTIONS = [
-    {"name": "release arm", "id": 0},
-    {"name": "shake hand", "id": 1},
-    {"name": "high five", "id": 2},
-    {"name": "hug", "id": 3},
-    {"name": "high wave", "id": 4},
-    {"name": "clap", "id": 5},
-    {"name": "face wave", "id": 6},
-    {"name": "left kiss", "id": 7},
-    {"name": "heart", "id": 8},
-    {"name": "right heart", "id": 9},
-    {"name": "hands up", "id": 10},
-    {"name": "x-ray", "id": 11},
-    {"name": "right hand up", "id": 12},
-    {"name": "reject", "id": 13},
-    {"name": "right kiss", "id": 14},
-    {"name": "two-hand kiss", "id": 15},
-]
-ARM_ID_TO_NAME = {x["id"]: x["name"] for x in ARM_ACTION_OPTIONS}
-ARM_NAME_SET = {x["name"] for x in ARM_ACTION_OPTIONS}
-
-# 这些动作在短暂延时后应该跟随执行 “release arm”
-ARM_RELEASE_AFTER_2S_IDS = {1, 2, 3, 8, 9, 10, 11, 12, 13}
-
-# ================= 运动控制（sport）选项 =================
-LOCO_ACTION_OPTIONS = [
-    {"name": "damp", "id": 0},
-    {"name": "Squat2StandUp", "id": 1},
-    {"name": "StandUp2Squat", "id": 2},
-    {"name": "move forward", "id": 3},
-    {"name": "move lateral", "id": 4},
-    {"name": "move rotate", "id": 5},
-    {"name": "low stand", "id": 6},
-    {"name": "high stand", "id": 7},
-    {"name": "zero torque", "id": 8},
-    {"name": "wave hand1", "id": 9},   # 挥手但不转身
-    {"name": "wave hand2", "id": 10},  # 挥手并伴随转身
-    {"name": "shake hand", "id": 11},
-    {"name": "Lie2StandUp", "id": 12},
-]
-LOCO_ID_TO_NAME = {x["id"]: x["name"] for x in LOCO_ACTION_OPTIONS}
-LOCO_NAME_SET = {x["name"] for x in LOCO_ACTION_OPTIONS}
+# ================= 混音播放 =================
+# 指定 channel（music / speech / effects）的播放进入混音器，与其他通道同时发声，不抢占；
+# 不指定 channel 的播放保持原有行为（抢占一切：清空混音器，并在整段播放期间暂停混音器输出）。
+# TTS 由 SDK 自己合成，不经过混音器，播报期间按估算时长闪避 music。
+TTS_SECONDS_PER_CHAR = 0.22
+
+
+# 混音器线程独占的发送锁：不与 speech_lock 竞争。speech_lock 会在整段抢占式播放 / TtsMaker 期间被持有，
+# 混音器每 100ms 一块，等它就会断流，并把断流记在自己头上。
+# 抢占式播放与混音器的互斥由 _pause_mixer / _resume_mixer 负责：播放期间混音器暂停输出
+_mixer_send_lock = threading.Lock()
+
+
+def _mixer_send(data):
+    client = audio_client
+    if client is None:
+        return
+    with _mixer_send_lock:
+        client.VoicePlayer(data, len(data))
+
+
+mixer = AudioMixer(
+    _mixer_send, on_underrun=lambda lag: _emit_event("playback_underrun", lag=round(lag, 3))
+) if MIXER_LOADED else None
+
+
+def _pause_mixer():
+    """抢占式播放开始：暂停混音器输出（返回时混音器已不再发送），之后扬声器只属于这段播放"""
+    if mixer is not None:
+        mixer.pause()
+
+
+def _resume_mixer():
+    if mixer is not None:
+        mixer.resume()
+
+
+def _start_mixer_playback_async(channel, pcm_data):
+    """把整段 PCM 放入混音通道（后台写入，写满时等待），播放完后推送 playback_done"""
+    def _worker():
+        sent = mixer.play(channel, [pcm_data])
+        _emit_event("playback_done", channel=channel, interrupted=sent < len(pcm_data),
+                    duration=round(sent / 32000.0, 2))
+
+    threading.Thread(target=_worker, daemon=True).start()
+
+
+def _check_mix_channel(channel):
+    """校验混音通道，返回错误信息或 None"""
+    if channel is None:
+        return None
+    if mixer is None:
+        return "Mixer not available (mixer.py / numpy missing)"
+    if channel not in mixer.channels:
+        return f"Unknown mixer channel: {channel}"
+    return None
+
+
+# ================= 动作表 =================
+# 机械臂 / 运动动作统一在 actions.json 中声明（与控制端共用），启动时加载一次
+ACTIONS = get_registry()
+ARM_ACTION_OPTIONS = ACTIONS.options("arm")
+LOCO_ACTION_OPTIONS = ACTIONS.options("loco")
+
+# 每个资源通道一把锁：占用不同通道的动作（如手臂动作和行走）可以同时执行
+LANE_LOCKS = {lane: threading.Lock() for entry in ACTIONS.by_id.values() for lane in entry["lanes"]}
+
+
+class _LaneGuard:
+    """按名称顺序获取动作所需的全部通道锁，避免死锁"""
+
+    def __init__(self, lanes):
+        self.locks = [LANE_LOCKS[lane] for lane in lanes]
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def __exit__(self, *exc):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+# ================= 速度流控制 =================
+VELOCITY_HZ = 50                  # 控制循环频率
+VELOCITY_DEADMAN = 0.5            # 超过该时间 (秒) 没有收到速度指令则自动停止
+VELOCITY_MAX = (0.6, 0.4, 1.0)    # vx, vy (m/s), vyaw (rad/s) 限幅
+VELOCITY_MAX_ACCEL = (1.0, 1.0, 2.0)  # 每秒最大变化量（限速率）
+VELOCITY_SMOOTHING = 0.3          # 指数平滑系数，越小越平滑
+VELOCITY_KEEPALIVE = 0.5          # 速度不变时重发 Move 的间隔 (秒)
+
+
+class VelocityController:
+    """
+    连续速度控制（遥控行走）
+    - set_target 只更新“最新值”槽位，高频指令自动合并
+    - 控制线程以 VELOCITY_HZ 运行：限幅 -> 指数平滑 -> 限速率 -> LocoClient.Move
+    - 超过 VELOCITY_DEADMAN 没有新指令时立即停止（不经过平滑），与急停相同
+    - _control_lock 串行化一次控制步和 halt，急停不会被同时进行中的 Move 覆盖
+    """
+
+    def __init__(self, hz=VELOCITY_HZ, deadman=VELOCITY_DEADMAN):
+        self.dt = 1.0 / hz
+        self.deadman = deadman
+        self._lock = threading.Lock()          # 目标 / 当前值
+        self._control_lock = threading.Lock()  # 控制步与急停（含 SDK 调用）
+        self._target = (0.0, 0.0, 0.0)
+        self._last_update = 0.0
+        self._current = [0.0, 0.0, 0.0]
+        self._sent = (0.0, 0.0, 0.0)
+        self._last_sent_at = 0.0
+        self._moving = False
+        self._thread = None
+        self.updates = 0
+        self.deadman_stops = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="velocity", daemon=True)
+            self._thread.start()
+
+    def set_target(self, vx, vy, vyaw):
+        target = tuple(max(-m, min(m, float(v))) for v, m in zip((vx, vy, vyaw), VELOCITY_MAX))
+        with self._lock:
+            self._target = target
+            self._last_update = time.time()
+            self.updates += 1
+
+    def halt(self):
+        """立即停止（急停），不经过平滑"""
+        with self._control_lock:
+            self._halt_locked()
+
+    def _halt_locked(self):
+        with self._lock:
+            self._target = (0.0, 0.0, 0.0)
+            self._current = [0.0, 0.0, 0.0]
+        self._stop_move()
+
+    def status(self):
+        with self._lock:
+            return {
+                "target": list(self._target),
+                "current": [round(v, 3) for v in self._current],
+                "moving": self._moving,
+                "updates": self.updates,
+                "deadman_stops": self.deadman_stops,
+            }
+
+    def _loop(self):
+        while True:
+            started = time.time()
+            try:
+                self._step(started)
+            except Exception as e:
+                print(f"Velocity loop error: {e}")
+            time.sleep(max(0.0, self.dt - (time.time() - started)))
+
+    def _step(self, now):
+        with self._control_lock:
+            self._step_locked(now)
+
+    def _step_locked(self, now):
+        with self._lock:
+            target = self._target
+            deadman = any(target) and now - self._last_update > self.deadman
+            if deadman:
+                self.deadman_stops += 1
+        if deadman:
+            # 指令断了就必须马上停，不能再按平滑曲线慢慢减速
+            print("Velocity deadman timeout, stopping")
+            self._halt_locked()
+            return
+
+        with self._lock:
+            for i, (goal, max_accel) in enumerate(zip(target, VELOCITY_MAX_ACCEL)):
+                smoothed = self._current[i] + VELOCITY_SMOOTHING * (goal - self._current[i])
+                step = max_accel * self.dt
+                value = max(self._current[i] - step, min(self._current[i] + step, smoothed))
+                # 足够接近目标时直接对齐，避免指数平滑无限逼近
+                self._current[i] = goal if abs(value - goal) < 1e-3 else value
+            current = tuple(self._current)
+
+        if any(current):
+            changed = any(abs(a - b) > 0.01 for a, b in zip(current, self._sent))
+            if changed or now - self._last_sent_at > VELOCITY_KEEPALIVE:
+                self._move(current)
+        elif self._moving:
+            self._stop_move()
+
+    def _move(self, velocity):
+        # 正在执行的腿部动作优先，不抢占
+        legs_lock = LANE_LOCKS["legs"]
+        if loco_client is None or not legs_lock.acquire(blocking=False):
+            return
+        try:
+            # 非连续模式下每次 Move 只维持约 1 秒，控制端断线时机器人也会自己停下
+            loco_client.Move(*velocity)
+        finally:
+            legs_lock.release()
+        self._sent = velocity
+        self._last_sent_at = time.time()
+        self._moving = True
+
+    def _stop_move(self):
+        if loco_client is not None:
+            _safe_call(loco_client.StopMove)
+        self._sent = (0.0, 0.0, 0.0)
+        self._moving = False
+
+
+velocity_controller = VelocityController()
 
 
 # ================= 核心接口 =================
 
 # robot_server.py (片段)
 
-@app.route("/cmd/speak", methods=["POST"])
-def handle_speak():
-    """文本转语音（TTS）接口。"""
+# 每个指令的实现都返回 (payload, http_code)，供单独接口和 /cmd/batch 共用
+
+def _do_speak(data):
+    """文本转语音（TTS）。"""
     global audio_client
-    data = request.json or {}
     text = data.get("text", "")
     if not text:
-        return jsonify({"status": "error", "msg": "No text provided"}), 400
+        return {"status": "error", "msg": "No text provided"}, 400
+
+    _await_client("audio")
 
     # 保持原有的串行调用行为。
     with speech_lock:
         if audio_client:
-            ret = audio_client.TtsMaker(text, 0)
-            return jsonify({"status": "success", "ret": ret})
+            try:
+                ret = audio_client.TtsMaker(text, 0)
+            except Exception as e:
+                _report_sdk_failure("audio", e)
+                return {"status": "error", "msg": str(e)}, 500
+            if mixer is not None:
+                mixer.duck_for(len(text) * TTS_SECONDS_PER_CHAR)
+            # TtsMaker 只是把文本交给 SDK 异步合成播放，SDK 没有播放结束的通知，这里只能报告“已开始”
+            _emit_event("speech_started", text=text, ret=ret)
+            return {"status": "success", "ret": ret}, 200
+
+    return {"status": "error", "msg": "Audio client not ready"}, 500
+
+
+def _do_stop(data=None):
+    """停止音频流播放（并尽力停止 TTS）。"""
+    # 先让任何“尚未开始”的待播放线程失效，然后尝试立即停止。
+    _bump_audio_gen()
+    if mixer is not None:
+        mixer.clear()
+    _try_audio_stop_now()
+    return {"status": "success"}, 200
+
+
+def _decode_16k_mono(filepath):
+    pcm, sample_rate, num_channels, is_ok = read_wav(filepath)
+    if (not is_ok) or sample_rate != 16000 or num_channels != 1:
+        return None
+    return pcm
+
+
+def _play_wav_file(filepath, channel=None):
+    if prep_cache is not None:
+        # 格式不对或全是静音时返回 None，按原文件处理（格式错误由下面的校验报告）
+        filepath = prep_cache.process(filepath, _decode_16k_mono) or filepath
+    pcm_list, sample_rate, num_channels, is_ok = read_wav(filepath)
+    if (not is_ok) or sample_rate != 16000 or num_channels != 1:
+        return {"status": "error", "msg": "Invalid wav format (need 16k mono)"}, 400
+
+    if channel is not None:
+        _start_mixer_playback_async(channel, pcm_list)
+        return {"status": "success", "channel": channel}, 200
+
+    # 启动异步播放；抢占逻辑在 helper 内部已处理。
+    _start_wav_playback_async(pcm_list)
+    return {"status": "success"}, 200
+
+
+def _do_mix(data):
+    """
+    混音通道控制：设置增益 / 清空通道
+    {"channel": "music", "gain": 0.5} / {"channel": "music", "stop": true} / {"stop": true}（全部通道）
+    """
+    channel = data.get("channel")
+    if mixer is None:
+        return {"status": "error", "msg": "Mixer not available (mixer.py / numpy missing)"}, 500
+    err = _check_mix_channel(channel)
+    if err:
+        return {"status": "error", "msg": err}, 400
+    if data.get("stop"):
+        mixer.clear(channel)
+    if "gain" in data:
+        if channel is None:
+            return {"status": "error", "msg": "gain requires a channel"}, 400
+        try:
+            mixer.set_gain(channel, data["gain"])
+        except (TypeError, ValueError):
+            return {"status": "error", "msg": "Invalid gain"}, 400
+    return {"status": "success", "mixer": mixer.status()}, 200
 
-    return jsonify({"status": "error", "msg": "Audio client not ready"}), 500
+
+def _do_velocity(data):
+    """更新遥控速度（vx, vy, vyaw），stop=True 时立即停止。"""
+    if data.get("stop"):
+        velocity_controller.halt()
+        return {"status": "success"}, 200
+    if loco_client is None:
+        return {"status": "error", "msg": "Loco client not ready"}, 500
+    try:
+        velocity_controller.set_target(data.get("vx", 0.0), data.get("vy", 0.0), data.get("vyaw", 0.0))
+    except (TypeError, ValueError):
+        return {"status": "error", "msg": "Invalid velocity"}, 400
+    return {"status": "success"}, 200
+
+
+def _clip_path(data):
+    """已上传音频片段的路径（按文件名），不存在时返回 None"""
+    filename = secure_filename(data.get("file") or data.get("name") or "")
+    filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+    if not filename or not os.path.isfile(filepath):
+        return None
+    return filepath
+
+
+def _do_clip(data):
+    """播放之前上传过的音频片段。"""
+    if not WAV_MODULE_LOADED:
+        return {"status": "error", "msg": "wav.py module missing"}, 500
+    filepath = _clip_path(data)
+    if filepath is None:
+        return {"status": "error", "msg": f"Clip not found: {data.get('file') or data.get('name')}"}, 400
+    err = _check_mix_channel(data.get("channel"))
+    if err:
+        return {"status": "error", "msg": err}, 400
+    try:
+        return _play_wav_file(filepath, data.get("channel"))
+    except Exception as e:
+        return {"status": "error", "msg": str(e)}, 500
+
+
+@app.route("/cmd/speak", methods=["POST"])
+def handle_speak():
+    """文本转语音（TTS）接口。"""
+    payload, code = _do_speak(request.json or {})
+    return jsonify(payload), code
 
 @app.route("/cmd/play_wav", methods=["POST"])
 def handle_play_wav():
@@ -230,86 +585,192 @@ def handle_play_wav():
     file.save(filepath)
 
     try:
-        pcm_list, sample_rate, num_channels, is_ok = read_wav(filepath)
-        if (not is_ok) or sample_rate != 16000 or num_channels != 1:
-            return jsonify({"status": "error", "msg": "Invalid wav format (need 16k mono)"}), 400
-
-        # 启动异步播放；抢占逻辑在 helper 内部已处理。
-        _start_wav_playback_async(pcm_list)
-
-        return jsonify({"status": "success"})
+        payload, code = _play_wav_file(filepath)
+        return jsonify(payload), code
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)}), 500
 
 
+@app.route("/cmd/play_stream", methods=["POST"])
+def handle_play_stream():
+    """
+    流式播放原始 PCM（16 kHz，单声道，16bit，支持 chunked 上传）。
+    边接收边播放，不写文件；请求在播放结束（或被 stop/抢占）后才返回。
+    ?channel=music / speech / effects 时进入混音器，与其他通道同时播放。
+    """
+    channel = request.args.get("channel")
+    if channel is not None:
+        err = _check_mix_channel(channel)
+        if err:
+            return jsonify({"status": "error", "msg": err}), 400
+        sent = mixer.play(channel, iter(lambda: request.stream.read(3200), b""))
+        _emit_event("playback_done", channel=channel, duration=round(sent / 32000.0, 2))
+        return jsonify({"status": "success", "channel": channel, "bytes": sent})
+
+    if not WAV_MODULE_LOADED:
+        return jsonify({"status": "error", "msg": "wav.py module missing"}), 500
+
+    with _playback_lock:
+        _stop_and_preempt_audio()
+        gen_snapshot = _get_audio_gen()
+
+    def _interrupted():
+        return gen_snapshot != _get_audio_gen()
+
+    def _chunks():
+        while True:
+            data = request.stream.read(3200)
+            if not data:
+                break
+            yield data
+
+    _await_client("audio")
+    with speech_lock:
+        if _interrupted():
+            return jsonify({"status": "interrupted", "bytes": 0})
+        if audio_client is None:
+            return jsonify({"status": "error", "msg": "Audio client not ready"}), 500
+        _pause_mixer()
+        try:
+            sent = play_pcm_chunks(
+                audio_client, _chunks(), WAV_APP_NAME,
+                on_underrun=lambda lag: _emit_event("playback_underrun", lag=round(lag, 3)),
+                should_stop=_interrupted,
+            )
+        finally:
+            _resume_mixer()
+
+    interrupted = _interrupted()
+    _emit_event("playback_done", interrupted=interrupted, duration=round(sent / 32000.0, 2))
+    return jsonify({"status": "interrupted" if interrupted else "success", "bytes": sent})
+
+
+@app.route("/cmd/velocity", methods=["POST"])
+def handle_velocity():
+    """遥控速度接口（高频时建议走长连接）。"""
+    payload, code = _do_velocity(request.json or {})
+    return jsonify(payload), code
+
+
 @app.route("/cmd/stop", methods=["POST"])
 def handle_stop():
     """停止音频流播放接口（并尽力停止 TTS）。"""
-    # 先让任何“尚未开始”的待播放线程失效，然后尝试立即停止。
-    _bump_audio_gen()
-    _try_audio_stop_now()
-    return jsonify({"status": "success"})
+    payload, code = _do_stop()
+    return jsonify(payload), code
+
+
+def _arm_handler(entry):
+    """机械臂动作：ExecuteAction，按 release_after 自动放下手臂。"""
+    release_after = entry["release_after"]
+
+    def run():
+        _await_client("arm")
+        if armAction_client is None:
+            raise RuntimeError("Arm action client not ready")
+        act = action_map.get(entry["name"])
+        if act is None:
+            raise RuntimeError(f"action_map not found for: {entry['name']}")
+        armAction_client.ExecuteAction(act)
+        if release_after:
+            time.sleep(release_after)
+            armAction_client.ExecuteAction(action_map.get("release arm"))
+
+    return run
+
+
+def _loco_handler(entry):
+    """运动动作：按 steps 依次调用 LocoClient 方法，["sleep", 秒] 表示等待。"""
+    steps = [(step[0], tuple(step[1:])) for step in entry.get("steps", [])]
+    for method, _ in steps:
+        if method != "sleep" and not hasattr(LocoClient, method):
+            raise ValueError(f"Unknown LocoClient method in action '{entry['name']}': {method}")
+
+    def run():
+        _await_client("loco")
+        if loco_client is None:
+            raise RuntimeError("Loco client not ready")
+        for method, args in steps:
+            if method == "sleep":
+                time.sleep(*args)
+            else:
+                getattr(loco_client, method)(*args)
 
+    return run
 
-def _execute_arm_action(action_id: int, action_name: str):
-    """使用 G1ArmActionClient 执行一个机械臂动作。"""
-    global armAction_client
-    if armAction_client is None:
-        raise RuntimeError("Arm action client not ready")
 
-    act = action_map.get(action_name)
-    if act is None:
-        raise RuntimeError(f"action_map not found for: {action_name}")
+# (group, id) -> 执行函数，启动时生成
+ACTION_HANDLERS = {
+    key: (_arm_handler if entry["group"] == "arm" else _loco_handler)(entry)
+    for key, entry in ACTIONS.by_id.items()
+}
 
-    armAction_client.ExecuteAction(act)
 
-    if action_id in ARM_RELEASE_AFTER_2S_IDS:
-        time.sleep(2)
-        armAction_client.ExecuteAction(action_map.get("release arm"))
+def _resolve_action(data):
+    """
+    解析动作请求中的 group/name/id
+    :return: 动作表中的条目 (dict)
+    :raises ValueError: 请求无效（信息即错误提示）
+    """
+    group = data.get("group") or data.get("type")  # 允许 "type" 作为别名
+    action_id = data.get("id", None)
+    action_name = data.get("name", None)
 
+    # 如果未显式提供 group，则尝试自动判断
+    if not group:
+        if action_name:
+            groups = ACTIONS.name_groups.get(action_name)
+            if not groups:
+                raise ValueError(f"Unknown action name: {action_name}")
+            if len(groups) > 1:
+                raise ValueError("Action name is ambiguous; please specify group='arm' or group='loco'.")
+            group = groups[0]
+        else:
+            # 默认行为：仅提供 id 的请求按机械臂动作处理，以保持兼容性。
+            group = "arm"
+
+    if group not in ACTIONS.groups:
+        raise ValueError("Invalid group; expected 'arm' or 'loco'.")
+
+    # 在选定 group 内解析 name/id
+    if action_name:
+        entry = ACTIONS.by_name.get((group, action_name))
+        if entry is None:
+            raise ValueError(f"Unknown {group} action name: {action_name}")
+        return entry
+
+    if action_id is None:
+        raise ValueError("No action id or name provided")
+    try:
+        resolved_id = int(action_id)
+    except Exception:
+        raise ValueError("Invalid action id")
+    entry = ACTIONS.by_id.get((group, resolved_id))
+    if entry is None:
+        raise ValueError(f"Unknown {group} action id: {resolved_id}")
+    return entry
 
-def _execute_loco_action(action_id: int, action_name: str):
-    """使用 LocoClient 执行一个运动（sport）动作。"""
-    global loco_client
-    if loco_client is None:
-        raise RuntimeError("Loco client not ready")
-
-    # 以下行为与提供的终端示例保持一致。
-    if action_id == 0:
-        loco_client.Damp()
-    elif action_id == 1:
-        loco_client.Damp()
-        time.sleep(0.5)
-        loco_client.Squat2StandUp()
-    elif action_id == 2:
-        loco_client.StandUp2Squat()
-    elif action_id == 3:
-        loco_client.Move(0.3, 0.0, 0.0)
-    elif action_id == 4:
-        loco_client.Move(0.0, 0.3, 0.0)
-    elif action_id == 5:
-        loco_client.Move(0.0, 0.0, 0.3)
-    elif action_id == 6:
-        loco_client.LowStand()
-    elif action_id == 7:
-        loco_client.HighStand()
-    elif action_id == 8:
-        loco_client.ZeroTorque()
-    elif action_id == 9:
-        loco_client.WaveHand()
-    elif action_id == 10:
-        loco_client.WaveHand(True)
-    elif action_id == 11:
-        loco_client.ShakeHand()
-        time.sleep(3)
-        loco_client.ShakeHand()
-    elif action_id == 12:
-        loco_client.Damp()
-        time.sleep(0.5)
-        # 安全提示：使用 Lie2StandUp 时，请确保机器人面朝上，且地面坚硬、平整并具有一定粗糙度。
-        loco_client.Lie2StandUp()
-    else:
-        raise ValueError(f"Unknown loco action id: {action_id}")
+
+def _do_action(data):
+    """执行一个机械臂 / 运动动作。"""
+    try:
+        entry = _resolve_action(data)
+    except ValueError as e:
+        return {"status": "error", "msg": str(e)}, 400
+
+    group, resolved_id, resolved_name = entry["group"], entry["id"], entry["name"]
+    try:
+        with _LaneGuard(entry["lanes"]):
+            ACTION_HANDLERS[(group, resolved_id)]()
+    except Exception as e:
+        if not isinstance(e, RuntimeError):
+            # SDK 调用本身出错（非“未就绪”），可能是通信异常
+            _report_sdk_failure(group, e)
+        _emit_event("action_done", group=group, id=resolved_id, action=resolved_name, status="error", msg=str(e))
+        return {"status": "error", "msg": str(e)}, 500
+
+    _emit_event("action_done", group=group, id=resolved_id, action=resolved_name, status="success")
+    return {"status": "success", "group": group, "action": resolved_name, "id": resolved_id,
+            "duration": entry["duration"]}, 200
 
 
 @app.route("/cmd/action", methods=["POST"])
@@ -326,80 +787,129 @@ def handle_action():
             return jsonify({"status": "success", "group": "loco", "actions": LOCO_ACTION_OPTIONS})
         return jsonify({"status": "success", "actions": {"arm": ARM_ACTION_OPTIONS, "loco": LOCO_ACTION_OPTIONS}})
 
-    action_id = data.get("id", None)
-    action_name = data.get("name", None)
+    payload, code = _do_action(data)
+    return jsonify(payload), code
 
-    # 如果未显式提供 group，则尝试自动判断
-    if not group:
-        if action_name:
-            in_arm = action_name in ARM_NAME_SET
-            in_loco = action_name in LOCO_NAME_SET
-            if in_arm and in_loco:
-                return jsonify(
-                    {"status": "error", "msg": "Action name is ambiguous; please specify group='arm' or group='loco'."}
-                ), 400
-            if in_arm:
-                group = "arm"
-            elif in_loco:
-                group = "loco"
-            else:
-                return jsonify({"status": "error", "msg": f"Unknown action name: {action_name}"}), 400
-        else:
-            # 默认行为：仅提供 id 的请求按机械臂动作处理，以保持兼容性。
-            group = "arm"
 
-    # 在选定 group 内解析 name/id
-    if group == "arm":
-        if action_name:
-            if action_name not in ARM_NAME_SET:
-                return jsonify({"status": "error", "msg": f"Unknown arm action name: {action_name}"}), 400
-            resolved_id = next((x["id"] for x in ARM_ACTION_OPTIONS if x["name"] == action_name), None)
-            resolved_name = action_name
-        else:
-            try:
-                if action_id is None:
-                    return jsonify({"status": "error", "msg": "No action id or name provided"}), 400
-                resolved_id = int(action_id)
-            except Exception:
-                return jsonify({"status": "error", "msg": "Invalid action id"}), 400
-            if resolved_id not in ARM_ID_TO_NAME:
-                return jsonify({"status": "error", "msg": f"Unknown arm action id: {resolved_id}"}), 400
-            resolved_name = ARM_ID_TO_NAME[resolved_id]
+# ================= 批量指令 =================
 
-        try:
-            with action_lock:
-                _execute_arm_action(resolved_id, resolved_name)
-            return jsonify({"status": "success", "group": "arm", "action": resolved_name, "id": resolved_id})
-        except Exception as e:
-            return jsonify({"status": "error", "msg": str(e)}), 500
+# start_at 最多允许提前多久 (秒)：防止时钟错乱时指令被长时间挂起
+BATCH_MAX_START_DELAY = 10.0
+
+COMMAND_HANDLERS = {
+    "speak": _do_speak,
+    "stop": _do_stop,
+    "action": _do_action,
+    "clip": _do_clip,
+    "velocity": _do_velocity,
+    "mix": _do_mix,
+}
 
-    if group == "loco":
-        if action_name:
-            if action_name not in LOCO_NAME_SET:
-                return jsonify({"status": "error", "msg": f"Unknown loco action name: {action_name}"}), 400
-            resolved_id = next((x["id"] for x in LOCO_ACTION_OPTIONS if x["name"] == action_name), None)
-            resolved_name = action_name
-        else:
-            try:
-                if action_id is None:
-                    return jsonify({"status": "error", "msg": "No action id or name provided"}), 400
-                resolved_id = int(action_id)
-            except Exception:
-                return jsonify({"status": "error", "msg": "Invalid action id"}), 400
-            if resolved_id not in LOCO_ID_TO_NAME:
-                return jsonify({"status": "error", "msg": f"Unknown loco action id: {resolved_id}"}), 400
-            resolved_name = LOCO_ID_TO_NAME[resolved_id]
 
+def _validate_command(cmd):
+    """执行前的静态校验（atomic 模式下先整体校验），返回错误信息或 None"""
+    if not isinstance(cmd, dict):
+        return "Command must be an object"
+    kind = cmd.get("cmd")
+    if kind not in COMMAND_HANDLERS:
+        return f"Unknown cmd: {kind}"
+    if kind == "speak" and not cmd.get("text"):
+        return "No text provided"
+    if kind == "action":
         try:
-            with action_lock:
-                _execute_loco_action(resolved_id, resolved_name)
-            return jsonify({"status": "success", "group": "loco", "action": resolved_name, "id": resolved_id})
+            _resolve_action(cmd)
         except ValueError as e:
-            return jsonify({"status": "error", "msg": str(e)}), 400
-        except Exception as e:
-            return jsonify({"status": "error", "msg": str(e)}), 500
+            return str(e)
+    if kind == "clip" and _clip_path(cmd) is None:
+        return f"Clip not found: {cmd.get('file') or cmd.get('name')}"
+    return None
+
 
-    return jsonify({"status": "error", "msg": "Invalid group; expected 'arm' or 'loco'."}), 400
+def _do_batch(data):
+    """
+    按顺序执行一组指令（speak / stop / action / clip），返回每条指令的结果。
+    - mode="best_effort"（默认）：逐条执行，失败不影响后续指令
+    - mode="atomic"：先整体校验，有任何无效指令则一条都不执行；执行中遇到失败则跳过剩余指令
+    - start_at：本机时钟的开始时间 (time.time())，多台机器人同步开始时使用；已过期则立即执行
+    """
+    commands = data.get("commands")
+    mode = data.get("mode", "best_effort")
+    start_at = data.get("start_at")
+    if not isinstance(commands, list):
+        return {"status": "error", "msg": "commands must be a list"}, 400
+    if mode not in ("best_effort", "atomic"):
+        return {"status": "error", "msg": "mode must be 'best_effort' or 'atomic'"}, 400
+    if start_at is not None and not isinstance(start_at, (int, float)):
+        return {"status": "error", "msg": "start_at must be a timestamp"}, 400
+
+    if mode == "atomic":
+        errors = [_validate_command(cmd) for cmd in commands]
+        if any(errors):
+            results = [
+                {"status": "error", "msg": err} if err else {"status": "skipped"}
+                for err in errors
+            ]
+            return {"status": "error", "mode": mode, "results": results}, 400
+
+    if start_at is not None:
+        delay = start_at - time.time()
+        if delay > BATCH_MAX_START_DELAY:
+            return {"status": "error", "msg": f"start_at is more than {BATCH_MAX_START_DELAY}s ahead"}, 400
+        if delay > 0:
+            time.sleep(delay)
+    started_at = time.time()
+
+    results = []
+    failed = False
+    for cmd in commands:
+        if failed and mode == "atomic":
+            results.append({"status": "skipped"})
+            continue
+
+        err = _validate_command(cmd)
+        if err:
+            payload, code = {"status": "error", "msg": err}, 400
+        else:
+            payload, code = COMMAND_HANDLERS[cmd["cmd"]](cmd)
+        payload["code"] = code
+        results.append(payload)
+        if code != 200:
+            failed = True
+
+    status = "success" if not failed else ("error" if mode == "atomic" else "partial")
+    return {"status": status, "mode": mode, "started_at": started_at, "results": results}, 200
+
+
+@app.route("/cmd/batch", methods=["POST"])
+def handle_batch():
+    payload, code = _do_batch(request.json or {})
+    return jsonify(payload), code
+
+
+def _do_time(data=None):
+    """返回本机时钟，控制端据此估计时钟偏差"""
+    return {"time": time.time()}, 200
+
+
+@app.route("/time", methods=["GET", "POST"])
+def handle_time():
+    payload, code = _do_time()
+    return jsonify(payload), code
+
+
+# 长连接上可用的指令：单条指令 + batch + 对时
+CHANNEL_HANDLERS = {**COMMAND_HANDLERS, "batch": _do_batch, "time": _do_time}
+
+
+@app.route("/cmd/mix", methods=["GET", "POST"])
+def handle_mix():
+    """混音通道增益 / 清空；GET 返回各通道状态。"""
+    if request.method == "GET":
+        if mixer is None:
+            return jsonify({"status": "error", "msg": "Mixer not available"}), 500
+        return jsonify({"status": "success", "mixer": mixer.status()})
+    payload, code = _do_mix(request.json or {})
+    return jsonify(payload), code
 
 
 @app.route("/status", methods=["GET"])
@@ -411,10 +921,49 @@ def health_check():
             "sdk_ready": audio_client is not None,
             "arm_ready": armAction_client is not None,
             "loco_ready": loco_client is not None,
+            "clients": sdk_supervisor.status() if sdk_supervisor is not None else None,
+            "control_channel": control_server is not None,
+            "velocity": velocity_controller.status(),
+            "mixer": mixer.status() if mixer is not None else None,
+            "prep_cache": prep_cache.stats() if prep_cache is not None else None,
         }
     )
 
 
+# ================= SDK 客户端 =================
+
+def _create_audio_client():
+    client = AudioClient()
+    client.Init()
+    client.SetVolume(100)
+    return client
+
+
+def _create_arm_client():
+    client = G1ArmActionClient()
+    client.SetTimeout(10.0)
+    client.Init()
+    return client
+
+
+def _create_loco_client():
+    client = LocoClient()
+    client.SetTimeout(10.0)
+    client.Init()
+    return client
+
+
+def _set_sdk_client(name, client):
+    """ClientSupervisor 回调：更新全局客户端（None 表示正在重建）"""
+    global audio_client, armAction_client, loco_client
+    if name == "audio":
+        audio_client = client
+    elif name == "arm":
+        armAction_client = client
+    elif name == "loco":
+        loco_client = client
+
+
 # ================= 启动 =================
 if __name__ == "__main__":
     if len(sys.argv) < 2:
@@ -425,20 +974,28 @@ if __name__ == "__main__":
     print("Initializing Unitree communication channel...")
     ChannelFactoryInitialize(0, sys.argv[1])
 
-    # 音频客户端初始化
-    audio_client = AudioClient()
-    audio_client.Init()
-    audio_client.SetVolume(100)
-
-    # 机械臂动作客户端初始化
-    armAction_client = G1ArmActionClient()
-    armAction_client.SetTimeout(10.0)
-    armAction_client.Init()
-
-    # 运动客户端初始化
-    loco_client = LocoClient()
-    loco_client.SetTimeout(10.0)
-    loco_client.Init()
+    # SDK 客户端并行初始化，之后由守护线程定期检查并在异常时重建
+    sdk_supervisor = ClientSupervisor(
+        {
+            "audio": {"factory": _create_audio_client, "probe": lambda c: probe_call(c, "GetVolume")},
+            "arm": {"factory": _create_arm_client, "probe": lambda c: probe_call(c, "GetActionList")},
+            "loco": {"factory": _create_loco_client, "probe": lambda c: probe_call(c, "GetFsmId")},
+        },
+        on_change=_set_sdk_client,
+        probe_interval=SDK_PROBE_INTERVAL,
+        failure_threshold=SDK_FAILURE_THRESHOLD,
+    )
+    if not sdk_supervisor.start(wait=15):
+        print("Warning: some SDK clients are not ready yet; they keep retrying in the background.")
+    velocity_controller.start()
+    if mixer is not None:
+        mixer.start()
+
+    # 长连接控制通道（HTTP 接口仍然可用，作为回退）
+    if CONTROL_CHANNEL_LOADED:
+        control_server = ControlChannelServer(CHANNEL_HANDLERS, port=CONTROL_CHANNEL_PORT, inline=("velocity",))
+        control_server.start()
+        print(f"Control channel listening on 0.0.0.0:{CONTROL_CHANNEL_PORT} ...")
 
     print("Server starting on 0.0.0.0:6000 ...")
     app.run(host="0.0.0.0", port=6000, debug=False, use_reloader=False)
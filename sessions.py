@@ -0,0 +1,163 @@
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import SESSION_IDLE_TIMEOUT, SESSION_MAX, REPLY_POOL_SIZE, REPLY_POOL_QUEUE
+
+
+class SessionBusy(Exception):
+    """会话数或排队的回复数达到上限（接口返回 429）"""
+
+
+class Session:
+    """
+    一个对话会话（一台机器人或一个操作员 / 展台）
+    - 模式、导演指令队列按会话隔离；对话记忆在 brain 里按同一个 ID 隔离
+    - target 为该会话播报 / 动作的控制目标（机器人 / 分组），None 表示主机器人（由 main._resolve_target 解析）
+    """
+
+    def __init__(self, session_id, target=None):
+        self.id = session_id
+        self.target = target
+        self.mode = "auto"
+        self.director_queue = queue.Queue()
+        self.created_at = time.time()
+        self.last_active = self.created_at
+        self.pending = 0  # 排队或进行中的回复数
+        self.reply_generation = 0  # 导演插话 / 新问题时加一：进行中的自动回复发现变化后不再继续播报
+
+    def touch(self):
+        self.last_active = time.time()
+
+    def is_busy(self):
+        return self.pending > 0 or not self.director_queue.empty()
+
+    def status(self):
+        return {
+            "target": self.target,
+            "mode": self.mode,
+            "pending": self.pending,
+            "idle_s": round(time.time() - self.last_active, 1),
+        }
+
+
+class SessionManager:
+    """
+    会话表 + 共用的回复线程池
+    - get() 按 ID 取会话，不存在则创建；超过 max_sessions 时淘汰最久未活动的空闲会话
+    - submit() 把回复任务放进共用线程池，同时进行 pool_size 个，排队超过 pool_queue 个时拒绝
+    - 后台线程定期淘汰空闲超过 idle_timeout 的会话，并通过 on_evict(session_id) 释放其它模块里的会话状态
+    默认会话（本机麦克风对应的主机器人）不会被淘汰
+    """
+
+    def __init__(self, default_id, idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=SESSION_MAX,
+                 pool_size=REPLY_POOL_SIZE, pool_queue=REPLY_POOL_QUEUE, on_evict=None):
+        self.default_id = default_id
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.on_evict = on_evict
+        self._sessions = {default_id: Session(default_id)}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="reply")
+        self._slots = threading.BoundedSemaphore(pool_size + pool_queue)
+        self.evicted = 0
+        self.rejected = 0
+
+    @property
+    def default(self):
+        return self._sessions[self.default_id]
+
+    def start(self):
+        threading.Thread(target=self._evict_loop, name="session-evict", daemon=True).start()
+
+    def get(self, session_id=None, target=None):
+        """
+        :param target: 新建会话时的控制目标；已有会话传入时更新
+        """
+        session_id = session_id or self.default_id
+        evicted = []
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    evicted = self._evict_locked(1)
+                    if not evicted:
+                        self.rejected += 1
+                        raise SessionBusy(f"Too many active sessions ({self.max_sessions})")
+                session = Session(session_id, target)
+                self._sessions[session_id] = session
+            elif target is not None:
+                session.target = target
+            session.touch()
+        self._notify_evicted(evicted)
+        return session
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def submit(self, session, fn, *args):
+        """在共用线程池里执行 fn(*args)，计入该会话的 pending；池满时抛出 SessionBusy"""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise SessionBusy("Reply pool is full")
+        with self._lock:
+            session.pending += 1
+        session.touch()
+
+        def _run():
+            try:
+                return fn(*args)
+            except Exception as e:
+                print(f"❌ [Session {session.id}] Reply failed: {e}")
+            finally:
+                with self._lock:
+                    session.pending -= 1
+                session.touch()
+                self._slots.release()
+
+        return self._pool.submit(_run)
+
+    def evict_idle(self):
+        """淘汰空闲超时的会话，返回被淘汰的 ID"""
+        with self._lock:
+            evicted = self._evict_locked(None, time.time() - self.idle_timeout)
+        self._notify_evicted(evicted)
+        return evicted
+
+    def _evict_locked(self, limit, idle_before=None):
+        candidates = sorted(
+            (s for s in self._sessions.values()
+             if s.id != self.default_id and not s.is_busy()
+             and (idle_before is None or s.last_active < idle_before)),
+            key=lambda s: s.last_active)
+        if limit is not None:
+            candidates = candidates[:limit]
+        for session in candidates:
+            del self._sessions[session.id]
+        self.evicted += len(candidates)
+        return [session.id for session in candidates]
+
+    def _notify_evicted(self, evicted):
+        for session_id in evicted:
+            print(f"🧹 [Session] Evicted idle session: {session_id}")
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(session_id)
+                except Exception as e:
+                    print(f"⚠️ [Session] Evict callback failed: {e}")
+
+    def _evict_loop(self):
+        while True:
+            time.sleep(max(1.0, min(60.0, self.idle_timeout / 4)))
+            self.evict_idle()
+
+    def status(self):
+        sessions = self.sessions()
+        return {
+            "count": len(sessions),
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+            "pending": sum(s.pending for s in sessions),
+            "sessions": {s.id: s.status() for s in sessions},
+        }
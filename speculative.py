@@ -0,0 +1,136 @@
+import time
+import queue
+import threading
+from difflib import SequenceMatcher
+
+from brain import CancelToken
+from text_utils import normalize_text
+
+_DONE = object()
+
+
+def text_similarity(a, b):
+    return SequenceMatcher(None, normalize_text(a), normalize_text(b)).ratio()
+
+
+class SpeculativeReply:
+    """
+    基于部分识别结果提前发起的回复请求
+    - 后台线程消费 brain.get_chat_reply，句子先缓存在队列里
+    - 采纳前产生的动作先暂存，采纳时再触发；取消时全部丢弃
+    - 只适用于本地保存上下文的 llm 后端（record_history=False，取消后不留痕迹）；
+      外部接口的上下文保存在服务端，被丢弃的推测问题也会写进去
+    """
+
+    def __init__(self, brain, text):
+        self.brain = brain
+        self.text = text
+        self.started_at = time.time()
+
+        self._queue = queue.Queue()
+        self._cancel = CancelToken()
+        self._lock = threading.Lock()
+        self._actions = []
+        self._on_action = None
+        self._sentences = []
+        self.completed = False
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _handle_action(self, action_id):
+        with self._lock:
+            if self._on_action is None:
+                self._actions.append(action_id)
+                return
+            on_action = self._on_action
+        on_action(action_id)
+
+    def _run(self):
+        gen = self.brain.get_chat_reply(self.text, on_action=self._handle_action, record_history=False,
+                                        cancel_token=self._cancel)
+        try:
+            for sentence in gen:
+                if self._cancel.is_cancelled():
+                    break
+                self._queue.put(sentence)
+            else:
+                self.completed = not self._cancel.is_cancelled()
+        except Exception as e:
+            print(f"⚠️ Speculative reply error: {e}")
+        finally:
+            gen.close()
+            self._queue.put(_DONE)
+
+    def matches(self, text, threshold):
+        return text_similarity(self.text, text) >= threshold
+
+    def cancel(self):
+        """取消推测请求，底层连接立即关闭"""
+        self._cancel.cancel()
+
+    def adopt(self, final_text, on_action=None):
+        """
+        采纳推测结果：先触发暂存的动作，再按顺序 yield 句子
+        结束后把“最终文本 + 回复”写入对话历史
+        """
+        with self._lock:
+            self._on_action = on_action or (lambda _: None)
+            pending_actions, self._actions = self._actions, []
+        for action_id in pending_actions:
+            self._on_action(action_id)
+
+        try:
+            while True:
+                sentence = self._queue.get()
+                if sentence is _DONE:
+                    break
+                self._sentences.append(sentence)
+                yield sentence
+        finally:
+            # 调用方中途停止（被打断）时，同时中止后台请求
+            if not self.completed:
+                self.cancel()
+
+        if self.completed:
+            self.brain.update_history("user", final_text)
+            self.brain.update_history("assistant", "".join(self._sentences))
+
+
+class SpeculationStats:
+    """推测式回复统计：用于调整阈值策略"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.adopted = 0
+        self.wasted = 0
+        # 最终文本到达 -> 第一句开始播报 (ms) 的滑动平均
+        self.ttfs_ms = {"speculative": None, "normal": None}
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def record_adopt(self):
+        with self._lock:
+            self.adopted += 1
+
+    def record_waste(self):
+        with self._lock:
+            self.wasted += 1
+
+    def record_ttfs(self, kind, elapsed_ms):
+        with self._lock:
+            old = self.ttfs_ms[kind]
+            self.ttfs_ms[kind] = elapsed_ms if old is None else 0.8 * old + 0.2 * elapsed_ms
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "adopted": self.adopted,
+                "wasted": self.wasted,
+                "wasted_ratio": round(self.wasted / self.started, 3) if self.started else 0.0,
+                "ttfs_ms": {k: round(v, 1) if v is not None else None for k, v in self.ttfs_ms.items()},
+            }
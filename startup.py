@@ -0,0 +1,99 @@
+import time
+import threading
+import traceback
+
+
+class SubsystemUnavailable(Exception):
+    """子系统尚未就绪或初始化失败"""
+
+
+class Subsystem:
+    """
+    后台初始化的子系统
+    - start() 在独立线程中调用 factory，多个子系统并行初始化
+    - get() 等待初始化完成并返回实例；proxy 可以像实例本身一样直接使用
+    - status() 返回 pending / starting / ready / failed 以及耗时，供 /api/status 展示
+    """
+
+    def __init__(self, name, factory, wait_timeout=2.0):
+        self.name = name
+        self.factory = factory
+        self.wait_timeout = wait_timeout
+        self.state = "pending"
+        self.error = None
+        self.elapsed_ms = None
+        self._instance = None
+        self._done = threading.Event()
+        self._thread = None
+        self.proxy = _LazyProxy(self)
+
+    def proxy_attr(self, attr):
+        """实例某个属性的代理（例如 fleet.primary），每次访问时重新取，属性被替换后也能跟上"""
+        return _LazyProxy(self, attr)
+
+    def start(self):
+        if self._thread is None:
+            self.state = "starting"
+            self._thread = threading.Thread(target=self._run, name=f"init-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        started = time.time()
+        try:
+            self._instance = self.factory()
+            self.state = "ready"
+            print(f"✅ [Startup] {self.name} ready ({(time.time() - started) * 1000:.0f} ms)")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = "failed"
+            print(f"❌ [Startup] {self.name} failed: {self.error}")
+            traceback.print_exc()
+        finally:
+            self.elapsed_ms = round((time.time() - started) * 1000, 1)
+            self._done.set()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def wait(self, timeout=None):
+        """等待初始化结束（成功或失败），返回是否已就绪"""
+        self._done.wait(timeout)
+        return self.ready
+
+    def get(self, timeout=None):
+        if self.ready:
+            return self._instance
+        if self._thread is None:
+            raise SubsystemUnavailable(f"{self.name} not started")
+        self.wait(self.wait_timeout if timeout is None else timeout)
+        if not self.ready:
+            raise SubsystemUnavailable(f"{self.name} {self.state}" + (f": {self.error}" if self.error else ""))
+        return self._instance
+
+    def status(self):
+        return {"state": self.state, "elapsed_ms": self.elapsed_ms, "error": self.error}
+
+
+class _LazyProxy:
+    """属性访问时才去取子系统实例，未就绪时抛出 SubsystemUnavailable"""
+
+    def __init__(self, subsystem, attr=None):
+        object.__setattr__(self, "_subsystem", subsystem)
+        object.__setattr__(self, "_attr", attr)
+
+    def _target(self):
+        instance = self._subsystem.get()
+        return instance if self._attr is None else getattr(instance, self._attr)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target(), name, value)
+
+
+def start_all(subsystems):
+    for subsystem in subsystems:
+        subsystem.start()
@@ -0,0 +1,46 @@
+import re
+import math
+from collections import Counter
+from functools import lru_cache
+
+# 去掉标点、空白，只保留中文、字母和数字
+_STRIP_PATTERN = re.compile(r'[^\u4e00-\u9fffA-Za-z0-9]+')
+
+
+def normalize_text(text):
+    """去掉标点与空白，英文转小写"""
+    if not text:
+        return ""
+    return _STRIP_PATTERN.sub("", text).lower()
+
+
+@lru_cache(maxsize=4096)
+def pinyin_syllables(text):
+    """文本 -> 拼音音节元组（不带声调），同音字/错别字映射到同一个 key"""
+    # pypinyin 导入时要加载词典，推迟到第一次使用
+    from pypinyin import lazy_pinyin
+    return tuple(s for s in lazy_pinyin(normalize_text(text)) if s)
+
+
+def pinyin_key(text):
+    """文本 -> 拼音 key，音节之间用空格分隔，便于按整音节做子串匹配"""
+    return " ".join(pinyin_syllables(text))
+
+
+def ngram_vector(syllables, n=2):
+    """音节 n-gram 词袋向量（含 unigram），作为轻量的本地“嵌入”"""
+    grams = Counter(syllables)
+    for i in range(len(syllables) - n + 1):
+        grams[" ".join(syllables[i:i + n])] += 1
+    return grams
+
+
+def cosine(a, b):
+    if not a or not b:
+        return 0.0
+    dot = sum(v * b.get(k, 0) for k, v in a.items())
+    if dot == 0:
+        return 0.0
+    na = math.sqrt(sum(v * v for v in a.values()))
+    nb = math.sqrt(sum(v * v for v in b.values()))
+    return dot / (na * nb)
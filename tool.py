@@ -1,49 +1,34 @@
-import wave
-import audioop
 import os
 import requests
 
+from audio_prep import PrepCache
+from audio_stream import iter_pcm_16k_mono, iter_file
 
-def convert_to_16k_mono(src_path):
-    """
-    (内部工具) 将任意 WAV 转换为 16kHz、单声道、16bit
-    """
-    try:
-        temp_path = src_path + ".converted.wav"
-
-        with wave.open(src_path, 'rb') as s:
-            params = s.getparams()
-            n_channels = params.nchannels
-            sampwidth = params.sampwidth
-            framerate = params.framerate
-            content = s.readframes(params.nframes)
 
-        # 已经是完美格式，直接返回
-        if n_channels == 1 and framerate == 16000 and sampwidth == 2:
-            return src_path
+# 预处理结果缓存（裁剪静音 + 响度归一化），第一次使用时创建
+_prep_cache = None
 
-        print(f"🔄 Auto-converting audio: {framerate}Hz/{n_channels}ch/{sampwidth * 8}bit -> 16k/Mono/16bit")
 
-        # 1. 立体声转单声道
-        if n_channels != 1:
-            content = audioop.tomono(content, sampwidth, 0.5, 0.5)
+def _get_prep_cache():
+    global _prep_cache
+    if _prep_cache is None:
+        _prep_cache = PrepCache()
+    return _prep_cache
 
-        # 2. 重采样到 16000Hz
-        if framerate != 16000:
-            content, _ = audioop.ratecv(content, sampwidth, 1, framerate, 16000, None)
 
-        # 3. 确保 16bit
-        if sampwidth != 2:
-            content = audioop.lin2lin(content, sampwidth, 2)
+def _decode_16k_mono(src_path):
+    """任意音频文件（PCM WAV 直接转换，其他格式走 ffmpeg）-> 16kHz、单声道、16bit 的 PCM 数据"""
+    with open(src_path, 'rb') as f:
+        return b"".join(iter_pcm_16k_mono(iter_file(f)))
 
-        with wave.open(temp_path, 'wb') as d:
-            d.setnchannels(1)
-            d.setsampwidth(2)
-            d.setframerate(16000)
-            d.writeframes(content)
-
-        return temp_path
 
+def convert_to_16k_mono(src_path):
+    """
+    (内部工具) 将音频文件转换为 16kHz、单声道、16bit WAV，并裁剪首尾静音、归一化响度
+    结果按文件内容缓存在 audio_cache/ 中，同一文件再次上传时不再处理
+    """
+    try:
+        return _get_prep_cache().process(src_path, _decode_16k_mono) or src_path
     except Exception as e:
         print(f"⚠️ Audio conversion warning: {e}")
         return src_path
@@ -57,9 +42,8 @@ def safe_upload_wav(session, base_url, filepath):
         print(f"❌ File not found: {filepath}")
         return
 
-    # 1. 转换格式
+    # 1. 转换格式（结果在缓存目录中，不需要清理）
     upload_path = convert_to_16k_mono(filepath)
-    is_converted = (upload_path != filepath)
 
     print(f"📤 Uploading WAV: {upload_path} ...")
 
@@ -76,12 +60,4 @@ def safe_upload_wav(session, base_url, filepath):
             print(f"❌ Upload failed (Code: {resp.status_code}): {resp.text}")
 
     except Exception as e:
-        print(f"❌ Error playing wav: {e}")
-
-    finally:
-        # 3. 清理临时文件
-        if is_converted and os.path.exists(upload_path):
-            try:
-                os.remove(upload_path)
-            except:
-                pass
\ No newline at end of file
+        print(f"❌ Error playing wav: {e}")
\ No newline at end of file
@@ -0,0 +1,330 @@
+import re
+import sys
+import json
+import os
+import wave
+import audioop
+from collections import deque
+
+import numpy as np
+
+# 句末语气词 / 标点：出现在结尾时认为一句话大概率已经说完
+_COMPLETE_ENDINGS = re.compile(r'([。！？.!?]|[吗呢吧啊呀嘛啦哦了])$')
+# 连接词 / 犹豫词：出现在结尾时认为话还没说完
+_INCOMPLETE_ENDINGS = re.compile(r'([，,、]|的|和|跟|与|还有|然后|就是|因为|所以|但是|如果|那个|这个|嗯|呃|额)$')
+
+
+def looks_complete(text):
+    """
+    判断一段（部分）识别文本是否像一句完整的话
+    :return: True 完整 / False 明显没说完 / None 无法判断
+    """
+    if not text:
+        return None
+    text = text.strip()
+    if _INCOMPLETE_ENDINGS.search(text):
+        return False
+    if _COMPLETE_ENDINGS.search(text):
+        return True
+    return None
+
+
+class EnergySpectralVAD:
+    """
+    能量 + 频谱平坦度的轻量 VAD（无需额外依赖）
+    - 能量：相对自适应噪声底噪的 dB 差
+    - 频谱平坦度：语音谐波明显，平坦度低；白噪声/风扇声平坦度高
+    """
+
+    def __init__(self, sample_rate=16000, energy_margin_db=10.0, flatness_threshold=0.45, noise_adapt=0.05):
+        self.sample_rate = sample_rate
+        self.energy_margin_db = energy_margin_db
+        self.flatness_threshold = flatness_threshold
+        self.noise_adapt = noise_adapt
+        self.noise_floor_db = None
+
+    def reset(self):
+        self.noise_floor_db = None
+
+    def is_speech(self, frame):
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        if samples.size == 0:
+            return False
+
+        rms = np.sqrt(np.mean(samples * samples)) + 1e-6
+        energy_db = 20.0 * np.log10(rms)
+
+        if self.noise_floor_db is None:
+            self.noise_floor_db = energy_db
+
+        spectrum = np.abs(np.fft.rfft(samples * np.hanning(samples.size))) + 1e-6
+        flatness = np.exp(np.mean(np.log(spectrum))) / np.mean(spectrum)
+
+        speech = energy_db > self.noise_floor_db + self.energy_margin_db and flatness < self.flatness_threshold
+
+        # 只在非语音帧上跟踪底噪，避免把人声当成噪声
+        if not speech:
+            self.noise_floor_db += self.noise_adapt * (energy_db - self.noise_floor_db)
+        return bool(speech)
+
+
+class WebRtcVAD:
+    """webrtcvad 封装（可选依赖，帧长须为 10/20/30ms）"""
+
+    def __init__(self, sample_rate=16000, aggressiveness=2):
+        import webrtcvad
+        self.sample_rate = sample_rate
+        self._vad = webrtcvad.Vad(aggressiveness)
+
+    def reset(self):
+        pass
+
+    def is_speech(self, frame):
+        return self._vad.is_speech(frame, self.sample_rate)
+
+
+def create_vad(kind="energy", sample_rate=16000):
+    """按名称创建 VAD，webrtcvad 不可用时回退到能量 VAD"""
+    if kind == "webrtc":
+        try:
+            return WebRtcVAD(sample_rate)
+        except ImportError:
+            print("⚠️ webrtcvad 未安装，回退到 energy VAD")
+    return EnergySpectralVAD(sample_rate)
+
+
+class AdaptiveEndpointer:
+    """
+    自适应断句：根据部分识别文本动态调整静音窗口
+    - 文本看起来已说完 -> 使用短窗口 (min_silence)
+    - 文本明显没说完 -> 使用长窗口 (max_silence)
+    - 无法判断 / 没有部分文本 -> 使用基础窗口 (base_silence)
+    部分文本由 BackgroundEars 的句中部分识别（config.PARTIAL_ASR）通过 set_partial_text 回填；
+    关闭部分识别时始终使用基础窗口，即与固定窗口断句相同
+    """
+
+    def __init__(self, frame_ms=30, base_silence=0.6, min_silence=0.3, max_silence=1.2,
+                 min_speech=0.25, max_phrase=20.0):
+        self.frame_ms = frame_ms
+        self.base_silence = base_silence
+        self.min_silence = min_silence
+        self.max_silence = max_silence
+        self.min_speech = min_speech
+        self.max_phrase = max_phrase
+        self.reset()
+
+    def reset(self):
+        self.in_speech = False
+        self.speech_frames = 0
+        self.silence_frames = 0
+        self.total_frames = 0
+        self.partial_text = None
+
+    def set_partial_text(self, text):
+        """由外部（部分识别结果）更新当前文本"""
+        self.partial_text = text
+
+    def silence_window(self):
+        complete = looks_complete(self.partial_text)
+        if complete is True:
+            return self.min_silence
+        if complete is False:
+            return self.max_silence
+        return self.base_silence
+
+    def process(self, is_speech):
+        """
+        输入一帧的 VAD 结果
+        :return: "start" / "end" / None
+        """
+        frame_s = self.frame_ms / 1000.0
+
+        if not self.in_speech:
+            if is_speech:
+                self.in_speech = True
+                self.speech_frames = 1
+                self.silence_frames = 0
+                self.total_frames = 1
+                return "start"
+            return None
+
+        self.total_frames += 1
+        if is_speech:
+            self.speech_frames += 1
+            self.silence_frames = 0
+        else:
+            self.silence_frames += 1
+
+        if self.total_frames * frame_s >= self.max_phrase:
+            return "end"
+
+        if self.silence_frames * frame_s >= self.silence_window():
+            return "end"
+        return None
+
+
+class VadSegmenter:
+    """
+    把连续的音频帧切分成一句一句的话（带预录 pre-roll）
+    每次 feed() 返回 None 或者一句完整语音的 PCM bytes
+    """
+
+    def __init__(self, vad, endpointer, preroll=0.3):
+        self.vad = vad
+        self.endpointer = endpointer
+        preroll_frames = max(1, int(preroll * 1000 / endpointer.frame_ms))
+        self._preroll = deque(maxlen=preroll_frames)
+        self._frames = []
+        # 上一句结尾的静音帧数，用于统计断句延迟
+        self.trailing_silence_frames = 0
+
+    def reset(self):
+        self._preroll.clear()
+        self._frames = []
+        self.endpointer.reset()
+
+    @property
+    def in_speech(self):
+        return self.endpointer.in_speech
+
+    @property
+    def silence_seconds(self):
+        return self.endpointer.silence_frames * self.endpointer.frame_ms / 1000.0
+
+    def current_audio(self):
+        """当前正在录制的句子（用于部分识别）"""
+        return b"".join(self._frames)
+
+    def feed(self, frame):
+        speech = self.vad.is_speech(frame)
+        event = self.endpointer.process(speech)
+
+        if event == "start":
+            self._frames = list(self._preroll)
+            self._preroll.clear()
+
+        if self.endpointer.in_speech:
+            self._frames.append(frame)
+        else:
+            self._preroll.append(frame)
+
+        if event == "end":
+            too_short = self.endpointer.speech_frames * self.endpointer.frame_ms / 1000.0 < self.endpointer.min_speech
+            pcm = b"".join(self._frames)
+            self.trailing_silence_frames = self.endpointer.silence_frames
+            self._frames = []
+            self.endpointer.reset()
+            if too_short:
+                return None
+            return pcm
+        return None
+
+
+# ================= 离线评测 =================
+
+def _load_pcm_16k(path):
+    with wave.open(path, 'rb') as wf:
+        n_channels = wf.getnchannels()
+        sampwidth = wf.getsampwidth()
+        framerate = wf.getframerate()
+        content = wf.readframes(wf.getnframes())
+    if n_channels != 1:
+        content = audioop.tomono(content, sampwidth, 0.5, 0.5)
+    if framerate != 16000:
+        content, _ = audioop.ratecv(content, sampwidth, 1, framerate, 16000, None)
+    if sampwidth != 2:
+        content = audioop.lin2lin(content, sampwidth, 2)
+    return content
+
+
+def _run_segmenter(pcm, endpointer, vad_kind, labels=None, frame_ms=30):
+    """
+    逐帧跑一遍断句，返回 [(start_s, last_speech_s, end_s), ...]
+    labels 提供时，用标注文本按时间比例模拟部分识别结果
+    """
+    frame_bytes = int(16000 * frame_ms / 1000) * 2
+    segmenter = VadSegmenter(create_vad(vad_kind), endpointer)
+    results = []
+    seg_start = None
+
+    for i in range(0, len(pcm) - frame_bytes + 1, frame_bytes):
+        t = (i // frame_bytes) * frame_ms / 1000.0
+        was_in_speech = segmenter.in_speech
+
+        if labels and was_in_speech and segmenter.silence_seconds > 0:
+            endpointer.set_partial_text(_simulated_partial(labels, t))
+
+        out = segmenter.feed(pcm[i:i + frame_bytes])
+        if not was_in_speech and segmenter.in_speech:
+            seg_start = t
+        if out is not None:
+            end_t = t + frame_ms / 1000.0
+            last_speech = end_t - segmenter.trailing_silence_frames * frame_ms / 1000.0
+            results.append((seg_start, last_speech, end_t))
+    return results
+
+
+def _simulated_partial(labels, t):
+    for u in labels:
+        if u["start"] <= t <= u["end"] + 2.0:
+            text = u.get("text", "")
+            span = max(u["end"] - u["start"], 1e-3)
+            ratio = min(1.0, (t - u["start"]) / span)
+            return text[:int(round(len(text) * ratio))]
+    return None
+
+
+def evaluate_fixture(path, vad_kind="energy"):
+    """
+    评测一个录音样本：
+    - 断句延迟：句末最后一个语音帧 -> 触发断句的时间
+    - 误切率：断句点落在一句话内部（把一句话切成两段）的比例
+    可选的同名 .json 标注：{"utterances": [{"start": 0.5, "end": 2.1, "text": "..."}]}
+    没有标注时，以固定 1.0s 静音窗口（旧行为）切出的句子作为参考
+    """
+    pcm = _load_pcm_16k(path)
+
+    label_path = os.path.splitext(path)[0] + ".json"
+    labels = None
+    if os.path.exists(label_path):
+        with open(label_path, "r", encoding="utf-8") as f:
+            labels = json.load(f).get("utterances")
+
+    if labels:
+        reference = [(u["start"], u["end"]) for u in labels]
+    else:
+        legacy = AdaptiveEndpointer(base_silence=1.0, min_silence=1.0, max_silence=1.0)
+        reference = [(s, e) for s, e, _ in _run_segmenter(pcm, legacy, vad_kind)]
+
+    report = {}
+    for mode, endpointer in (
+            ("fixed_1.0s", AdaptiveEndpointer(base_silence=1.0, min_silence=1.0, max_silence=1.0)),
+            ("adaptive", AdaptiveEndpointer()),
+    ):
+        segments = _run_segmenter(pcm, endpointer, vad_kind, labels=labels)
+        delays = [end - last for _, last, end in segments]
+        # 在参考句子结束之前（留 0.15s 容差）就断句，视为误切
+        false_cuts = sum(
+            1 for _, _, end in segments
+            if any(rs < end < re_ - 0.15 for rs, re_ in reference)
+        )
+        report[mode] = {
+            "segments": len(segments),
+            "avg_delay_ms": (sum(delays) / len(delays) * 1000) if delays else 0.0,
+            "false_cut_rate": (false_cuts / len(segments)) if segments else 0.0,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <fixture.wav> [more.wav ...] [--webrtc]")
+        sys.exit(-1)
+
+    kind = "webrtc" if "--webrtc" in sys.argv else "energy"
+    for fixture in [a for a in sys.argv[1:] if not a.startswith("--")]:
+        result = evaluate_fixture(fixture, kind)
+        print(f"📊 {fixture}")
+        for mode, r in result.items():
+            print(f"   [{mode:>10}] segments={r['segments']:<3} "
+                  f"endpoint_delay={r['avg_delay_ms']:.0f}ms false_cut_rate={r['false_cut_rate']:.1%}")
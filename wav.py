@@ -31,47 +31,85 @@ def read_wav(wav_path):
         return b"", 0, 0, False
 
 
-def play_pcm_stream(client, pcm_data, name="default"):
+# 分片大小 (字节)，取决于机器人的缓冲区大小
+# 通常 16k 采样率下，20ms-100ms 的数据块比较合适
+# 16000 Hz * 2 bytes * 0.1s = 3200 bytes
+CHUNK_SIZE = 3200
+
+
+def play_pcm_stream(client, pcm_data, name="default", on_underrun=None):
     """
     分块播放 PCM 数据流
     :param client: AudioClient 实例
     :param pcm_data: 二进制音频数据 (bytes)
     :param name: 播放任务名称 (可选)
+    :param on_underrun: 发送进度落后于实际播放进度（机器人缓冲区已放空）时的回调，参数为落后的秒数
     """
     if not pcm_data:
         return
 
-    # 分片大小 (字节)，取决于机器人的缓冲区大小
-    # 通常 16k 采样率下，20ms-100ms 的数据块比较合适
-    # 16000 Hz * 2 bytes * 0.1s = 3200 bytes
-    CHUNK_SIZE = 3200
+    print(f"[WAV] Start playing stream ({len(pcm_data)} bytes)...")
+    chunks = (pcm_data[i:i + CHUNK_SIZE] for i in range(0, len(pcm_data), CHUNK_SIZE))
+    play_pcm_chunks(client, chunks, name, on_underrun=on_underrun)
 
-    total_len = len(pcm_data)
-    offset = 0
 
+def play_pcm_chunks(client, chunks, name="default", on_underrun=None, should_stop=None):
+    """
+    边接收边播放 PCM（16k 单声道 16bit），输入块大小任意，内部重新切成 CHUNK_SIZE
+    :param chunks: bytes 迭代器（例如网络上传流）
+    :param should_stop: 返回 True 时立即停止发送
+    :return: 已发送的字节数
+    """
     # 检查客户端是否有 VoicePlayer 方法 (Unitree SDK 常见接口)
     # 如果没有 VoicePlayer，尝试使用 TtsMaker 发送原始数据 (视具体SDK版本而定，通常 VoicePlayer 用于 PCM)
     use_voice_player = hasattr(client, 'VoicePlayer')
 
     if not use_voice_player:
         print("[WAV] Warning: 'VoicePlayer' method not found on AudioClient. Playback might fail.")
-        return
-
-    print(f"[WAV] Start playing stream ({total_len} bytes)...")
-
-    while offset < total_len:
-        # 获取当前分片
-        end = min(offset + CHUNK_SIZE, total_len)
-        chunk = pcm_data[offset:end]
+        return 0
+
+    # 16k 单声道 16bit: 每秒 32000 字节
+    start_time = None
+    sent = 0
+    pending = b""
+
+    def _send(chunk):
+        nonlocal start_time, sent
+        if start_time is None:
+            start_time = time.time()
+        # 已发送的音频时长小于实际流逝的时间，说明缓冲区已经播空
+        lag = (time.time() - start_time) - sent / 32000.0
+        if sent and lag > 0:
+            if on_underrun is not None:
+                on_underrun(lag)
+            # 缓冲区重新开始填充，以当前时刻为新的基准
+            start_time += lag
 
         # 发送数据
         # 注意: 这里的 1004 是示例消息ID，SDK 内部可能会忽略或使用
         client.VoicePlayer(chunk, len(chunk))
-
-        offset += CHUNK_SIZE
+        sent += len(chunk)
 
         # 稍微延时以防止发送过快溢出缓冲区
         # 发送 3200 字节 (约 0.1秒音频)，我们休眠稍微短一点的时间让缓冲区保持充盈
-        time.sleep(0.08)
-
-    print("[WAV] Playback finished sending.")
\ No newline at end of file
+        time.sleep(0.08 * len(chunk) / CHUNK_SIZE)
+
+    for data in chunks:
+        if should_stop is not None and should_stop():
+            print("[WAV] Playback stopped.")
+            return sent
+        pending += data
+        while len(pending) >= CHUNK_SIZE:
+            _send(pending[:CHUNK_SIZE])
+            pending = pending[CHUNK_SIZE:]
+            if should_stop is not None and should_stop():
+                print("[WAV] Playback stopped.")
+                return sent
+
+    # 丢掉半个采样，保证 16bit 对齐
+    pending = pending[:len(pending) - len(pending) % 2]
+    if pending:
+        _send(pending)
+
+    print("[WAV] Playback finished sending.")
+    return sent